@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Замер разбора и маршрутизации обновлений getUpdates
+
+Сравнивает прежний путь (response.json() во вложенные словари и подписки
+в обработчиках) с записями updates.py - со стандартным json и с orjson,
+если он установлен. Пакеты синтетические, с полями как у настоящих
+обновлений Telegram; обработчики только читают поля, без отправки.
+
+Запуск: python benchmark_updates.py [--batch 1 10 100] [--seconds 1]
+"""
+
+import argparse
+import json
+import time
+
+from config import GET_UPDATES_LIMIT
+import updates
+
+
+def make_response(batch_size):
+    """Тело ответа getUpdates: сообщения из личных и групповых чатов и нажатия кнопок"""
+    result = []
+    for i in range(batch_size):
+        chat = {"id": 100000 + i, "first_name": "Айбек", "username": f"installer{i}", "type": "private"}
+        sender = {"id": 100000 + i, "is_bot": False, "first_name": "Айбек", "username": f"installer{i}",
+                  "language_code": "ru"}
+        if i % 3 == 2:
+            result.append({"update_id": 5000 + i, "callback_query": {
+                "id": f"4382{i}", "from": sender, "chat_instance": "-7711", "data": "s:1a2b:7",
+                "message": {"message_id": 900 + i, "from": {"id": 1, "is_bot": True, "first_name": "Homeline"},
+                            "chat": chat, "date": 1700000000, "text": "🔍 Найдено 3 файлов:",
+                            "reply_markup": {"inline_keyboard": [[{"text": "Диагностика", "callback_data": "s:1a2b:7"}]]}},
+            }})
+        else:
+            if i % 3 == 1:
+                chat = {"id": -100200300, "title": "Монтажники Токмак", "type": "supergroup"}
+            result.append({"update_id": 5000 + i, "message": {
+                "message_id": 900 + i, "from": sender, "chat": chat, "date": 1700000000,
+                "text": "затухание на онт -27 дбм что делать",
+            }})
+    return json.dumps({"ok": True, "result": result}, ensure_ascii=False).encode("utf-8")
+
+
+def legacy_path(content):
+    """Прежний путь: словари и подписки, как в process_message / process_callback"""
+    handled = 0
+    for update in json.loads(content)["result"]:
+        try:
+            if "message" in update:
+                message = update["message"]
+                chat_id = message["chat"]["id"]
+                user_name = message["from"].get("first_name", "Пользователь")
+                if "text" in message:
+                    handled += bool(chat_id and user_name and message["text"].strip())
+            elif "callback_query" in update:
+                callback_query = update["callback_query"]
+                chat_id = callback_query["message"]["chat"]["id"]
+                message_id = callback_query["message"]["message_id"]
+                handled += bool(chat_id and message_id and callback_query["data"] and callback_query["id"])
+        except Exception:
+            pass
+    return handled
+
+
+def records_path(content, loads):
+    """Записи updates.py, как в dispatch_update"""
+    data = loads(content)
+    handled = 0
+    for update in (updates.parse_update(raw) for raw in data["result"]):
+        message = update.message
+        if message is not None:
+            if message.text is not None:
+                handled += bool(message.chat.id and (message.first_name or "Пользователь") and message.text.strip())
+        elif update.callback is not None:
+            callback = update.callback
+            handled += bool(callback.chat.id and callback.message_id and callback.data and callback.id)
+    return handled
+
+
+def measure(function, content, batch_size, seconds, repeats=5):
+    """Микросекунд на одно обновление (лучший из нескольких прогонов - меньше шума)"""
+    best = None
+    for _ in range(repeats):
+        rounds = 0
+        started = time.perf_counter()
+        deadline = started + seconds / repeats
+        while time.perf_counter() < deadline:
+            function(content)
+            rounds += 1
+        micros = (time.perf_counter() - started) / (rounds * batch_size) * 1e6
+        best = micros if best is None else min(best, micros)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер разбора обновлений getUpdates")
+    parser.add_argument("--batch", type=int, nargs="+", default=[1, 10, GET_UPDATES_LIMIT],
+                        help="размеры пакетов (по умолчанию 1 10 100)")
+    parser.add_argument("--seconds", type=float, default=1.0, help="секунд на каждый замер")
+    args = parser.parse_args()
+
+    paths = [
+        ("словари + json", legacy_path),
+        ("записи + json", lambda content: records_path(content, json.loads)),
+    ]
+    if updates.orjson is not None:
+        paths.append(("записи + orjson", lambda content: records_path(content, updates.orjson.loads)))
+    else:
+        print("orjson не установлен - замер только со стандартным json")
+
+    print(f"{'пакет':>6}  {'путь':<18} {'мкс/обновление':>15}")
+    for batch_size in args.batch:
+        content = make_response(batch_size)
+        baseline = None
+        for name, function in paths:
+            micros = measure(function, content, batch_size, args.seconds)
+            baseline = baseline or micros
+            print(f"{batch_size:>6}  {name:<18} {micros:>15.2f}  x{baseline / micros:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Рассылка объявлений всем пользователям бота
+
+Получатели - чаты, которые писали боту: регистрируются при обработке
+сообщений (пачкой вместе со снимком состояния) и импортируются из журнала
+статистики. Рассылка - задание в SQLite: бот выполняет его в фоне со
+скоростью BROADCAST_RATE сообщений в секунду, отмечает каждого получателя,
+которому уже отправлено, и продолжает с того же места после перезапуска -
+повторно никто рассылку не получает.
+Заблокировавшие бота чаты помечаются и больше не получают рассылок.
+
+Примеры:
+    python broadcast.py --import-log
+    python broadcast.py --text "<b>Обновлена инструкция по роутерам</b>"
+    python broadcast.py --document настройка_роутеров.pdf --caption "📄 Новая версия"
+    python broadcast.py --status
+    python broadcast.py --cancel 3
+"""
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from config import (
+    BROADCAST_DB, BROADCAST_RATE, BROADCAST_WORKERS, BROADCAST_BATCH, SCALE_OUT, LEASE_TTL
+)
+from catalog import find_document
+from metrics import increment
+import telegram_api
+
+if SCALE_OUT:
+    import shared_store
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_LEASE = "broadcast"
+POLL_INTERVAL = 10  # Секунд между проверками новых заданий
+MAX_ATTEMPTS = 3  # Попыток отправки одному получателю
+START_CURSOR = -(2 ** 63)  # Меньше любого chat_id (у групп они отрицательные)
+
+# Ошибки, после которых чат больше не получает рассылок
+BLOCKED_DESCRIPTIONS = ("bot was blocked", "user is deactivated", "chat not found", "bot was kicked")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recipients (
+    chat_id INTEGER PRIMARY KEY,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    blocked INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS broadcast_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created REAL NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    cursor INTEGER NOT NULL,
+    sent INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    blocked INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+    job_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    PRIMARY KEY (job_id, chat_id)
+);
+"""
+
+_local = threading.local()
+_lock = threading.Lock()
+_known = set()  # Активные получатели, уже записанные в базу этим процессом
+_pending = {}  # chat_id -> время последнего сообщения, ждут записи
+
+
+def _connect():
+    """Соединение с базой рассылок (отдельное для каждого потока)"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(BROADCAST_DB, timeout=30, isolation_level=None)
+        conn.executescript(SCHEMA)
+        _local.conn = conn
+    return conn
+
+
+# ===================
+# РЕЕСТР ПОЛУЧАТЕЛЕЙ
+# ===================
+
+def register_recipient(chat_id):
+    """Запомнить чат как получателя рассылок (запись в базу - при flush_recipients)"""
+    if chat_id in _known:
+        return
+    with _lock:
+        _pending[chat_id] = time.time()
+
+
+def flush_recipients():
+    """Записать новых получателей одной транзакцией"""
+    with _lock:
+        if not _pending:
+            return 0
+        rows = list(_pending.items())
+        _pending.clear()
+    try:
+        with _connect() as conn:
+            # Написавший снова пользователь, видимо, разблокировал бота
+            conn.executemany(
+                "INSERT INTO recipients (chat_id, first_seen, last_seen) VALUES (?1, ?2, ?2) "
+                "ON CONFLICT (chat_id) DO UPDATE SET last_seen = excluded.last_seen, blocked = 0",
+                rows
+            )
+    except sqlite3.Error as e:
+        logger.error(f"Не удалось сохранить получателей рассылок: {e}")
+        with _lock:
+            for chat_id, seen in rows:
+                _pending.setdefault(chat_id, seen)
+        return 0
+    _known.update(chat_id for chat_id, _ in rows)
+    return len(rows)
+
+
+def import_log():
+    """Добавить в реестр все личные чаты из журнала статистики"""
+    from warmup import iter_log_records
+
+    for _, user_id, _ in iter_log_records():
+        try:
+            chat_id = int(user_id)
+        except ValueError:
+            continue
+        # У групп и каналов отрицательные id
+        if chat_id > 0:
+            register_recipient(chat_id)
+    return flush_recipients()
+
+
+def _mark_blocked(chat_id):
+    """Чат заблокировал бота или удален"""
+    _known.discard(chat_id)
+    _connect().execute("UPDATE recipients SET blocked = 1 WHERE chat_id = ?", (chat_id,))
+
+
+def _next_recipients(job_id, cursor, limit):
+    """Следующие активные получатели после cursor (по возрастанию chat_id), еще не получившие рассылку"""
+    rows = _connect().execute(
+        # Группы, попавшие в реестр раньше, пропускаются (id групп отрицательные)
+        "SELECT chat_id FROM recipients WHERE blocked = 0 AND chat_id > 0 AND chat_id > ? "
+        "AND chat_id NOT IN (SELECT chat_id FROM broadcast_deliveries WHERE job_id = ?) "
+        "ORDER BY chat_id LIMIT ?",
+        (cursor, job_id, limit)
+    ).fetchall()
+    return [row[0] for row in rows]
+
+
+# ===================
+# ЗАДАНИЯ РАССЫЛКИ
+# ===================
+
+def create_job(kind, payload):
+    """Создать задание рассылки: kind "message" ({"text"}) или "document" ({"filename", "caption"})"""
+    cursor = _connect().execute(
+        "INSERT INTO broadcast_jobs (kind, payload, created, cursor) VALUES (?, ?, ?, ?)",
+        (kind, json.dumps(payload, ensure_ascii=False), time.time(), START_CURSOR)
+    )
+    return cursor.lastrowid
+
+
+def cancel_job(job_id):
+    """Отменить задание (выполняющееся остановится после текущей пачки)"""
+    cursor = _connect().execute(
+        "UPDATE broadcast_jobs SET status = 'cancelled' WHERE id = ? AND status IN ('pending', 'running')",
+        (job_id,)
+    )
+    return cursor.rowcount > 0
+
+
+def _job_status(job_id):
+    row = _connect().execute("SELECT status FROM broadcast_jobs WHERE id = ?", (job_id,)).fetchone()
+    return row[0] if row else None
+
+
+def _record_delivery(job_id, chat_id, result):
+    """Отметить получателя (result - "sent", "failed" или "blocked"), чтобы не отправить ему повторно"""
+    conn = _connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        inserted = conn.execute(
+            "INSERT OR IGNORE INTO broadcast_deliveries (job_id, chat_id) VALUES (?, ?)", (job_id, chat_id)
+        ).rowcount
+        if inserted:
+            conn.execute(f"UPDATE broadcast_jobs SET {result} = {result} + 1 WHERE id = ?", (job_id,))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    if inserted and result != "failed":
+        increment(f"broadcast_{result}")
+
+
+def _checkpoint(job_id, cursor, status="running"):
+    """Сохранить прогресс задания: все получатели до cursor включительно уже отмечены"""
+    conn = _connect()
+    conn.execute(
+        "UPDATE broadcast_jobs SET cursor = ?, "
+        "status = CASE WHEN status = 'cancelled' THEN status ELSE ? END WHERE id = ?",
+        (cursor, status, job_id)
+    )
+    # Отметки до cursor больше не нужны - эти получатели и так пропускаются
+    conn.execute("DELETE FROM broadcast_deliveries WHERE job_id = ? AND chat_id <= ?", (job_id, cursor))
+
+
+class Pacer:
+    """Общий темп отправки для всех потоков рассылки"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self, stop_event):
+        """Дождаться своего слота. False - рассылка остановлена"""
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        return not stop_event.wait(slot - now)
+
+    def pause(self, seconds):
+        """Сдвинуть все следующие слоты (retry_after от Telegram)"""
+        with self.lock:
+            self.next_slot = max(self.next_slot, time.monotonic() + seconds)
+
+
+def _make_sender(kind, payload):
+    """Функция отправки одному чату (ошибки Bot API выбрасываются)"""
+    if kind == "message":
+        return lambda chat_id: telegram_api.send_message(chat_id, payload["text"], raise_errors=True)
+
+    document = find_document(payload["filename"])
+    if document is None or not os.path.exists(document.path):
+        raise ValueError(f"Документ {payload['filename']} не найден")
+    caption = payload.get("caption") or f"📄 <b>{document.description}</b>"
+    return lambda chat_id: telegram_api.send_document(
+        chat_id, document.path, document.filename, caption, raise_errors=True
+    )
+
+
+def _send_one(send, chat_id, pacer, stop_event):
+    """Отправить одному получателю: "sent", "blocked", "failed" или "stopped" """
+    for _ in range(MAX_ATTEMPTS):
+        if not pacer.wait(stop_event):
+            return "stopped"
+        try:
+            return "sent" if send(chat_id) else "failed"
+        except telegram_api.TelegramError as e:
+            if e.retry_after:
+                pacer.pause(e.retry_after)
+                continue
+            if e.retryable:
+                continue
+            if e.error_code == 403 or any(text in str(e).lower() for text in BLOCKED_DESCRIPTIONS):
+                _mark_blocked(chat_id)
+                return "blocked"
+            logger.debug("Рассылка: чат %s пропущен: %s", chat_id, e)
+            return "failed"
+        except requests.RequestException:
+            continue
+    return "failed"
+
+
+def run_job(job_id, kind, payload, cursor, stop_event):
+    """Выполнить задание с сохраненного места"""
+    try:
+        send = _make_sender(kind, payload)
+    except ValueError as e:
+        logger.error(f"📣 Рассылка #{job_id} невозможна: {e}")
+        _connect().execute("UPDATE broadcast_jobs SET status = 'failed' WHERE id = ?", (job_id,))
+        return
+
+    pacer = Pacer(BROADCAST_RATE)
+
+    def deliver(chat_id):
+        result = _send_one(send, chat_id, pacer, stop_event)
+        # Отметка сразу после отправки: остановка посреди пачки не приведет к повтору
+        if result != "stopped":
+            _record_delivery(job_id, chat_id, result)
+        return result
+
+    logger.info(f"📣 Рассылка #{job_id} ({kind}) запущена")
+    with ThreadPoolExecutor(max_workers=BROADCAST_WORKERS, thread_name_prefix=f"broadcast-{job_id}") as pool:
+        while not stop_event.is_set():
+            if _job_status(job_id) == "cancelled":
+                logger.info(f"📣 Рассылка #{job_id} отменена")
+                _connect().execute("DELETE FROM broadcast_deliveries WHERE job_id = ?", (job_id,))
+                return
+            if SCALE_OUT and not shared_store.try_acquire_lease(BROADCAST_LEASE):
+                return
+
+            # Первый документ загружается один раз, остальным уходит его file_id
+            needs_upload = kind == "document" and not telegram_api.get_cached_file_id(
+                find_document(payload["filename"]).path
+            )
+            chat_ids = _next_recipients(job_id, cursor, 1 if needs_upload else BROADCAST_BATCH)
+            if not chat_ids:
+                _checkpoint(job_id, cursor, status="done")
+                _connect().execute("DELETE FROM broadcast_deliveries WHERE job_id = ?", (job_id,))
+                break
+
+            results = list(pool.map(deliver, chat_ids))
+            # cursor сдвигается только по непрерывно обработанным; остальные отмечены в broadcast_deliveries
+            for chat_id, result in zip(chat_ids, results):
+                if result == "stopped":
+                    break
+                cursor = chat_id
+            _checkpoint(job_id, cursor)
+
+    row = _connect().execute(
+        "SELECT status, sent, failed, blocked FROM broadcast_jobs WHERE id = ?", (job_id,)
+    ).fetchone()
+    logger.info(f"📣 Рассылка #{job_id}: {row[0]}, отправлено {row[1]}, ошибок {row[2]}, заблокировали {row[3]}")
+
+
+def _next_job():
+    """Самое старое незавершенное задание"""
+    return _connect().execute(
+        "SELECT id, kind, payload, cursor FROM broadcast_jobs "
+        "WHERE status IN ('pending', 'running') ORDER BY id LIMIT 1"
+    ).fetchone()
+
+
+def _runner(stop_event):
+    """Фоновый поток: выполняет задания по очереди"""
+    while not stop_event.is_set():
+        try:
+            flush_recipients()
+            job = _next_job()
+            if job and (not SCALE_OUT or shared_store.try_acquire_lease(BROADCAST_LEASE)):
+                job_id, kind, payload, cursor = job
+                _connect().execute("UPDATE broadcast_jobs SET status = 'running' WHERE id = ?", (job_id,))
+                run_job(job_id, kind, json.loads(payload), cursor, stop_event)
+                if SCALE_OUT:
+                    shared_store.release_lease(BROADCAST_LEASE)
+                continue
+        except Exception:
+            logger.exception("Ошибка выполнения рассылки")
+        # В режиме реплик аренда продлевается чаще, чем истекает
+        stop_event.wait(min(POLL_INTERVAL, LEASE_TTL / 3))
+
+
+def start_runner(stop_event):
+    """Запустить выполнение заданий рассылки в фоне"""
+    thread = threading.Thread(target=_runner, args=(stop_event,), name="broadcast", daemon=True)
+    thread.start()
+    return thread
+
+
+def print_status():
+    """Получатели и последние задания"""
+    conn = _connect()
+    active, blocked = conn.execute(
+        "SELECT COALESCE(SUM(blocked = 0), 0), COALESCE(SUM(blocked = 1), 0) FROM recipients"
+    ).fetchone()
+    print(f"Получателей: {active} (заблокировали бота: {blocked})")
+    for row in conn.execute(
+        "SELECT id, kind, status, sent, failed, blocked, payload FROM broadcast_jobs ORDER BY id DESC LIMIT 10"
+    ):
+        print(f"#{row[0]} {row[1]:8} {row[2]:9} отправлено={row[3]} ошибок={row[4]} заблокировали={row[5]} {row[6][:60]}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Рассылка объявлений пользователям бота")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--text", help="Текст объявления (HTML)")
+    group.add_argument("--document", metavar="FILENAME", help="PDF из каталога, например настройка_роутеров.pdf")
+    group.add_argument("--import-log", action="store_true", help="Добавить получателей из журнала статистики")
+    group.add_argument("--status", action="store_true", help="Показать получателей и задания")
+    group.add_argument("--cancel", type=int, metavar="JOB_ID", help="Отменить задание")
+    parser.add_argument("--caption", help="Подпись к документу (HTML)")
+    args = parser.parse_args(argv)
+
+    if args.import_log:
+        print(f"Добавлено получателей: {import_log()}")
+    elif args.status:
+        print_status()
+    elif args.cancel is not None:
+        print("Отменено" if cancel_job(args.cancel) else "Задание не найдено или уже завершено")
+    elif args.document:
+        if find_document(args.document) is None:
+            parser.error(f"Документ не найден в каталоге: {args.document}")
+        job_id = create_job("document", {"filename": args.document, "caption": args.caption})
+        print(f"Задание #{job_id} создано - бот выполнит его в фоне")
+    else:
+        job_id = create_job("message", {"text": args.text})
+        print(f"Задание #{job_id} создано - бот выполнит его в фоне")
+
+
+if __name__ == "__main__":
+    main()
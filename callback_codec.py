@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Компактный callback_data для кнопок документов
+
+Формат: "~" + base64url(байт схемы и действия, 2 байта версии каталога,
+идентификаторы документов в varint). Один документ занимает 7 символов,
+а разбор сводится к обращению к таблице каталога по индексу.
+"""
+
+import base64
+import binascii
+
+from catalog import get_catalog_version, get_document
+
+PREFIX = "~"
+SCHEME_VERSION = 1
+
+# Действия
+ACTION_SEND = 1  # Отправить документ
+ACTION_SEND_ALL = 2  # Отправить все документы одним альбомом (до 10)
+ACTION_PIN = 3  # Закрепить/открепить документ в сессии
+
+# Лимит Telegram на callback_data
+MAX_CALLBACK_LENGTH = 64
+
+
+def _encode_varint(value, out):
+    """Записать неотрицательное число в формате varint"""
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _decode_varints(data):
+    """Прочитать все числа varint из байтов"""
+    values = []
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = shift = 0
+    if shift:
+        raise ValueError("Обрезанный varint")
+    return values
+
+
+def encode_callback(action, *doc_ids):
+    """Собрать callback_data для действия с документами"""
+    raw = bytearray([(SCHEME_VERSION << 4) | action])
+    raw += get_catalog_version().to_bytes(2, "big")
+    for doc_id in doc_ids:
+        _encode_varint(doc_id, raw)
+    data = PREFIX + base64.urlsafe_b64encode(bytes(raw)).decode("ascii").rstrip("=")
+    if len(data) > MAX_CALLBACK_LENGTH:
+        raise ValueError(f"callback_data длиннее {MAX_CALLBACK_LENGTH} байт")
+    return data
+
+
+def is_encoded_callback(data):
+    """Относится ли callback_data к этой схеме"""
+    return data.startswith(PREFIX)
+
+
+def decode_callback(data):
+    """Разобрать callback_data
+
+    Возвращает (действие, список документов). Для кнопки от старой версии
+    каталога или поврежденных данных список документов - None.
+    """
+    try:
+        encoded = data[len(PREFIX):]
+        raw = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4))
+        if len(raw) < 3 or raw[0] >> 4 != SCHEME_VERSION:
+            return None, None
+        action = raw[0] & 0x0F
+        if int.from_bytes(raw[1:3], "big") != get_catalog_version():
+            return action, None
+        documents = [get_document(doc_id) for doc_id in _decode_varints(raw[3:])]
+        if not documents or None in documents:
+            return action, None
+        return action, documents
+    except (ValueError, binascii.Error):
+        return None, None
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Каталог документов базы знаний с короткими числовыми идентификаторами
+
+Каталог берется из скомпилированной базы знаний (kb_artifact) при первом
+обращении, а не при импорте модуля. Идентификаторы общие для всех
+филиалов, поэтому кнопка документа не зависит от филиала чата.
+"""
+
+import threading
+from collections import namedtuple
+
+from file_store import content_key
+from kb_artifact import load_knowledge_base
+from tenants import DEFAULT_TENANT
+
+Document = namedtuple("Document", "doc_id category filename description path tenant")
+
+_lock = threading.Lock()
+_documents = None
+_by_content = {}
+
+
+def get_documents():
+    """Все документы всех филиалов: в филиале сначала категории, затем специальные файлы"""
+    global _documents
+    if _documents is None:
+        with _lock:
+            if _documents is None:
+                _documents = tuple(
+                    Document(doc_id, *row) for doc_id, row in enumerate(load_knowledge_base().documents)
+                )
+    return _documents
+
+
+def get_catalog_version():
+    """Версия каталога (меняется при изменении состава или порядка документов)"""
+    return load_knowledge_base().catalog_version
+
+
+def get_document(doc_id):
+    """Документ по идентификатору или None"""
+    documents = get_documents()
+    if 0 <= doc_id < len(documents):
+        return documents[doc_id]
+    return None
+
+
+def _tenant_data(tenant):
+    """Каталог филиала (неизвестный филиал - филиал по умолчанию)"""
+    tenants = load_knowledge_base().tenants
+    return tenants.get(tenant) or tenants[DEFAULT_TENANT]
+
+
+def find_by_link(link):
+    """Документ по постоянному id из ссылки /start или None"""
+    doc_id = load_knowledge_base().links.get(link)
+    return None if doc_id is None else get_documents()[doc_id]
+
+
+def find_document(filename, tenant=DEFAULT_TENANT):
+    """Документ филиала по имени файла или None"""
+    doc_id = _tenant_data(tenant)["by_filename"].get(filename)
+    return None if doc_id is None else get_documents()[doc_id]
+
+
+def documents_in_category(category, tenant=DEFAULT_TENANT):
+    """Документы категории в порядке базы знаний филиала"""
+    documents = get_documents()
+    return [documents[doc_id] for doc_id in _tenant_data(tenant)["by_category"].get(category, ())]
+
+
+def get_categories(tenant=DEFAULT_TENANT):
+    """Категории филиала: код -> название (в порядке базы знаний)"""
+    return _tenant_data(tenant)["categories"]
+
+
+def get_category_name(category, tenant=DEFAULT_TENANT):
+    """Название категории для меню или None"""
+    return _tenant_data(tenant)["categories"].get(category)
+
+
+def documents_by_content(tenant=DEFAULT_TENANT):
+    """Документы филиала по ключу содержимого (для общих индексов поиска)"""
+    by_content = _by_content.get(tenant)
+    if by_content is None:
+        by_content = {}
+        documents = get_documents()
+        for doc_ids in _tenant_data(tenant)["by_category"].values():
+            for doc_id in doc_ids:
+                by_content.setdefault(content_key(documents[doc_id].path), documents[doc_id])
+        _by_content[tenant] = by_content
+    return by_content
+
+
+def get_special_document(key, tenant=DEFAULT_TENANT):
+    """Специальный файл филиала (например, "quick") или None"""
+    doc_id = _tenant_data(tenant)["special"].get(key)
+    return None if doc_id is None else get_documents()[doc_id]
+
+
+def get_special_keys(tenant=DEFAULT_TENANT):
+    """Ключи специальных файлов филиала"""
+    return tuple(_tenant_data(tenant)["special"])
+
+
+def get_tenant_name(tenant=DEFAULT_TENANT):
+    """Название филиала"""
+    return _tenant_data(tenant)["name"]
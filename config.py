@@ -5,6 +5,7 @@
 """
 
 import os
+import socket
 
 # Токен бота - из переменной окружения или файла
 TOKEN = os.getenv("TELEGRAM_TOKEN") or "8272254555:AAGmzBd_6dEySqfKelR8vwoEtT5-21_ehR8"
@@ -53,6 +54,11 @@ KNOWLEDGE_BASE = {
     }
 }
 
+# Несколько филиалов в одном процессе (tenants.py): эта база - филиал по умолчанию,
+# остальные описываются в TENANTS_FILE (JSON) со своими папками, каталогом и чатами
+DEFAULT_TENANT_NAME = "Homeline Токмак"
+TENANTS_FILE = os.getenv("TENANTS_FILE") or "tenants.json"
+
 # Специальные файлы (находятся в корне или в оборудовании)
 SPECIAL_FILES = {
     "quick": "быстрый_справочник.pdf",  # Из папки ОБОРУДОВАНИЕ
@@ -427,5 +433,99 @@ SEARCH_KEYWORDS = {
 
 # Настройки
 TIMEOUT_SECONDS = 30
+HTTP_POOL_SIZE = 16  # Соединений с Bot API в общем пуле (ответы, очередь, рассылки)
+GET_UPDATES_LIMIT = 100  # Обновлений в одном ответе getUpdates (максимум Telegram)
 LOG_FILE = "bot_stats.txt"
-DEBUG_MODE = True  # Включить отладку
+DEBUG_MODE = (os.getenv("DEBUG_MODE") or "False").lower() == "true"  # Включить отладку
+
+# Логирование
+LOG_FORMAT = (os.getenv("LOG_FORMAT") or "text").lower()  # text или json
+LOG_LEVELS = os.getenv("LOG_LEVELS") or ""  # Например: handlers=DEBUG,telegram_api=INFO
+LOG_DEBUG_RATE_LIMIT = 20  # DEBUG-записей в секунду с одного места в коде (0 - без ограничения)
+
+# Тёплый перезапуск - снимок offset, кэшей и метрик
+STATE_FILE = os.getenv("STATE_FILE") or "bot_state.json"
+STATE_SNAPSHOT_INTERVAL = 60  # Секунд между снимками
+SEARCH_CACHE_SIZE = 500  # Максимум запросов в кэше поиска
+DEDUP_WINDOW = 2000  # Сколько последних update_id и callback id помнить от повторов
+
+# Ограничение частоты запросов по чатам (flood_control.py)
+FLOOD_BURST = 5  # Сообщений подряд без ограничения
+FLOOD_RATE = 0.5  # Сообщений в секунду после исчерпания запаса
+FLOOD_TRACKED_CHATS = 10000  # Чатов, для которых помнится состояние (LRU)
+COALESCE_WINDOW = 10  # Секунд - одинаковые запросы чата получают один ответ
+MAX_QUERY_LENGTH = 100  # Символов запроса, остальное отбрасывается до поиска
+
+# Групповые чаты: кроме команд, упоминаний и ответов боту - только короткие сообщения с ключевым словом
+GROUP_AUTOSEARCH_MAX_WORDS = 3
+GROUP_AUTOSEARCH_MIN_KEY_LENGTH = 3  # Более короткие ключи ("rx", "ap") в переписке не ищутся
+
+# Масштабирование на несколько реплик - общее хранилище SQLite на общем диске
+SCALE_OUT = (os.getenv("SCALE_OUT") or "False").lower() == "true"
+SHARED_DB_PATH = os.getenv("SHARED_DB_PATH") or "shared_state.db"
+REPLICA_ID = os.getenv("RENDER_INSTANCE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+LEASE_TTL = 60  # Секунд - аренда права опрашивать getUpdates
+WORKER_THREADS = 2  # Обработчиков очереди обновлений на реплику
+CLAIM_TIMEOUT = 120  # Секунд - после этого зависшее обновление забирает другая реплика
+
+# Сессии пользователей: недавние и закрепленные документы
+SESSIONS_DB = SHARED_DB_PATH if SCALE_OUT else (os.getenv("SESSIONS_DB") or "sessions.db")
+SESSION_CACHE_SIZE = 5000  # Сессий в памяти (LRU)
+RECENT_DOCUMENTS = 5  # Недавних документов в сессии
+PINNED_DOCUMENTS = 5  # Закрепленных документов в сессии
+
+# Очередь исходящих сообщений с повторами (outbox.py)
+OUTBOX_DB = SHARED_DB_PATH if SCALE_OUT else (os.getenv("OUTBOX_DB") or "outbox.db")
+OUTBOX_WORKERS = 4  # Потоков отправки на процесс
+OUTBOX_MAX_ATTEMPTS = 8  # Попыток, после которых сообщение отбрасывается
+OUTBOX_MAX_BACKOFF = 300  # Секунд - предельная пауза между повторами
+# Секунд - после этого недоставленное сообщение забирает другой воркер. Дольше самой долгой
+# отправки: альбом из 10 файлов с попыткой по file_id и повторной загрузкой (TIMEOUT_SECONDS на файл)
+OUTBOX_CLAIM_TIMEOUT = TIMEOUT_SECONDS * 12
+
+# Рассылки объявлений (broadcast.py)
+BROADCAST_DB = SHARED_DB_PATH if SCALE_OUT else (os.getenv("BROADCAST_DB") or "broadcast.db")
+BROADCAST_RATE = 20  # Сообщений в секунду (лимит Telegram около 30, остаток - для ответов)
+BROADCAST_WORKERS = 8  # Параллельных отправок
+BROADCAST_BATCH = 200  # Получателей между сохранениями прогресса
+
+# Прогрев кэшей при запуске по истории запросов из LOG_FILE
+WARMUP_TOP_QUERIES = 100  # Самых частых запросов для кэша поиска
+WARMUP_TOP_DOCUMENTS = 5  # Самых популярных PDF для предзагрузки
+WARMUP_CHAT_ID = os.getenv("WARMUP_CHAT_ID")  # Служебный чат для предзагрузки PDF (без него только кэш поиска)
+
+# Индекс текста PDF и векторный поиск (нужны pypdf и numpy, без них поиск только по словам)
+SEARCH_INDEX_DIR = os.getenv("SEARCH_INDEX_DIR") or "search_index"
+VECTOR_DIMENSIONS = 8192  # Размер хэшированного пространства n-грамм
+VECTOR_MIN_SCORE = 0.12  # Минимальная косинусная близость для выдачи документа
+VECTOR_MAX_RESULTS = 3  # Документов в выдаче векторного поиска
+
+# Скомпилированная база знаний (kb_artifact.py), пересобирается при изменении config.py
+KB_ARTIFACT_FILE = os.path.join(SEARCH_INDEX_DIR, "knowledge_base.bin")
+
+# Фрагменты текста PDF в ответе на поиск
+SNIPPET_LINES = 3  # Строк в одном фрагменте
+SNIPPET_MAX_LENGTH = 300  # Символов во фрагменте (длинные обрезаются)
+SNIPPET_MAX_RESULTS = 2  # Фрагментов в ответе
+
+# Превью первой страницы PDF перед документом (previews.py, нужны pypdfium2 и Pillow)
+PREVIEWS_DIR = os.path.join(SEARCH_INDEX_DIR, "previews")
+PREVIEW_WIDTH = 1024  # Точек по ширине - текст инструкции читается на телефоне
+PREVIEW_QUALITY = 70  # Качество JPEG
+PREVIEW_BEFORE_DOCUMENT = (os.getenv("PREVIEW_BEFORE_DOCUMENT") or "True").lower() == "true"
+
+# Задержки обработки обновлений и SLO для /health (slo.py)
+SLO_WINDOW = 300  # Секунд - окно скользящих перцентилей
+SLO_LAG_P95_MS = 5000  # p95 от отправки сообщения до начала обработки
+SLO_PROCESSING_P95_MS = 1000  # p95 времени обработки обновления
+SLO_REPLY_P95_MS = 10000  # p95 от получения обновления до доставки ответа
+SLO_MIN_SAMPLES = 20  # Меньше замеров в окне - перцентиль не проверяется
+SLO_POLL_MAX_AGE = 90  # Секунд без getUpdates, после которых опрос считается зависшим
+
+# Адаптивный опрос getUpdates (poll_control.py)
+POLL_IDLE_DELAY = 0.1  # Секунд паузы после неполного пакета (после полного - без паузы)
+POLL_BACKOFF_BASE = 1  # Секунд - первая пауза после ошибки, дальше вдвое больше
+POLL_BACKOFF_MAX = 60  # Секунд - предельная пауза между попытками
+POLL_BREAKER_THRESHOLD = 5  # Ошибок подряд, после которых опрос приостанавливается
+POLL_BREAKER_COOLDOWN = 30  # Секунд паузы разомкнутого предохранителя (растет при повторных срабатываниях)
+POLL_BREAKER_MAX_COOLDOWN = 300  # Секунд - предельная пауза предохранителя
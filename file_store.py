@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Адресация файлов базы знаний по содержимому
+
+Ключ файла - sha256 его содержимого, поэтому одинаковый PDF в базах
+разных филиалов (или в двух папках одной базы) - один и тот же файл:
+у него один file_id в Telegram и одни разделы в индексе поиска.
+"""
+
+import hashlib
+import os
+import threading
+
+_lock = threading.Lock()
+
+# (путь, размер, mtime) -> sha256, чтобы не читать файл повторно
+_DIGESTS = {}
+
+
+def content_digest(path):
+    """sha256 содержимого файла (OSError, если файла нет)"""
+    stat = os.stat(path)
+    stat_key = (path, stat.st_size, stat.st_mtime_ns)
+    digest = _DIGESTS.get(stat_key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        with _lock:
+            _DIGESTS[stat_key] = digest
+    return digest
+
+
+def content_key(path):
+    """Ключ документа в индексах: хэш содержимого или путь, если файла нет"""
+    try:
+        return content_digest(path)
+    except OSError:
+        return f"missing:{path}"
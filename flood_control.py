@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ограничение частоты запросов по чатам
+
+У каждого чата свое ведро токенов: FLOOD_BURST сообщений подряд, затем
+FLOOD_RATE сообщений в секунду. Одинаковые запросы чата в пределах
+COALESCE_WINDOW секунд получают один ответ. Состояние хранится для
+FLOOD_TRACKED_CHATS последних чатов (LRU), так что память ограничена.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from config import FLOOD_BURST, FLOOD_RATE, FLOOD_TRACKED_CHATS, COALESCE_WINDOW, MAX_QUERY_LENGTH
+from metrics import increment
+
+_lock = threading.Lock()
+_buckets = OrderedDict()
+
+
+class Bucket:
+    """Ведро токенов чата и последний обработанный запрос"""
+    __slots__ = ("tokens", "updated", "warned", "last_query", "last_query_at")
+
+    def __init__(self, now):
+        self.tokens = float(FLOOD_BURST)
+        self.updated = now
+        self.warned = False
+        self.last_query = None
+        self.last_query_at = 0.0
+
+
+def _get_bucket(chat_id, now):
+    """Ведро чата (вызывается под _lock)"""
+    bucket = _buckets.get(chat_id)
+    if bucket is None:
+        bucket = _buckets[chat_id] = Bucket(now)
+        if len(_buckets) > FLOOD_TRACKED_CHATS:
+            _buckets.popitem(last=False)
+    else:
+        _buckets.move_to_end(chat_id)
+        bucket.tokens = min(FLOOD_BURST, bucket.tokens + (now - bucket.updated) * FLOOD_RATE)
+        bucket.updated = now
+    return bucket
+
+
+def acquire(chat_id):
+    """Разрешить сообщение чата
+
+    Возвращает (разрешено, секунд до следующего токена или None). Время
+    ожидания возвращается только для первого отклоненного сообщения
+    подряд, чтобы предупреждать чат один раз.
+    """
+    now = time.monotonic()
+    with _lock:
+        bucket = _get_bucket(chat_id, now)
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            bucket.warned = False
+            return True, None
+        increment("flood_throttled")
+        if bucket.warned:
+            return False, None
+        bucket.warned = True
+        return False, (1 - bucket.tokens) / FLOOD_RATE
+
+
+def is_repeated_query(chat_id, query):
+    """Такой же запрос чата уже обработан в пределах COALESCE_WINDOW"""
+    now = time.monotonic()
+    with _lock:
+        bucket = _get_bucket(chat_id, now)
+        if bucket.last_query == query and now - bucket.last_query_at < COALESCE_WINDOW:
+            increment("queries_coalesced")
+            return True
+        bucket.last_query = query
+        bucket.last_query_at = now
+        return False
+
+
+def truncate_query(text):
+    """Обрезать длинный текст до MAX_QUERY_LENGTH символов (по границе слова)"""
+    if len(text) <= MAX_QUERY_LENGTH:
+        return text
+    increment("queries_truncated")
+    cut = text[:MAX_QUERY_LENGTH]
+    space = cut.rfind(" ")
+    return cut[:space] if space > MAX_QUERY_LENGTH // 2 else cut
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Отбор сообщений групповых чатов до обработки
+
+В группе бот отвечает только на команды (без @ или с @ этого бота),
+упоминания, ответы на свои сообщения и короткие сообщения с ключевым
+словом. Остальное отбрасывается до журнала и обработчиков. Если у бота
+включен режим приватности, Telegram сам присылает только команды,
+упоминания и ответы, и фильтр почти ничего не отбрасывает.
+
+Ключевое слово в обычной переписке должно стоять целым словом, а общие
+слова из таблицы ("как", "что", "план") не считаются: иначе бот
+отвечал бы на "как дела" и "что по плану".
+"""
+
+import re
+
+from config import GROUP_AUTOSEARCH_MAX_WORDS, GROUP_AUTOSEARCH_MIN_KEY_LENGTH
+from kb_artifact import load_knowledge_base
+from metrics import increment
+from telegram_api import BOT_INFO
+from tenants import DEFAULT_TENANT, tenant_for_chat
+
+GROUP_CHAT_TYPES = ("group", "supergroup")
+
+# Ключи из таблицы, которые в обычной переписке не означают вопрос к боту
+GROUP_STOPWORDS = frozenset((
+    "как", "что", "почему", "зачем", "нет", "имя", "план", "дом", "дома", "двор", "этаж", "этажи",
+    "офис", "офиса", "офисы", "кафе", "банк", "место", "показ", "пакет", "снять", "горит", "синий",
+    "желтый", "красный", "зеленый", "клиент", "клиенту", "клиента", "сервис", "услуг", "услуги",
+    "ошибка", "сломан", "глюк", "баг", "быстрый", "точка", "коробка", "машина", "машинка", "name",
+    "key", "join", "unit", "point", "quick", "access", "сломался", "проблема", "починить", "исправить",
+    "проверить", "проверка", "показать", "качество", "компания", "организация", "предприятие", "заказчик",
+    "заказчика", "квартира", "квартиры", "ресторан", "магазин", "аптека", "салон", "склад", "фирма",
+    "забор", "домик", "калитка", "коридор", "подъезд", "подъезды", "лестница", "площадка", "мастерская",
+    "установить", "продажи", "продать", "не работает",
+))
+
+# Шаблоны ключей по филиалам: (список ключей базы знаний, регулярное выражение)
+_patterns = {}
+
+
+def _strip_mention(text, username):
+    """Текст без упоминания бота. None - бот не упомянут"""
+    mention = f"@{username}"
+    position = text.lower().find(mention.lower())
+    if position < 0:
+        return None
+    return f"{text[:position]} {text[position + len(mention):]}".strip()
+
+
+def _keyword_pattern(tenant):
+    """Выражение для поиска ключевых слов филиала целыми словами"""
+    tenants = load_knowledge_base().tenants
+    keywords = (tenants.get(tenant) or tenants[DEFAULT_TENANT])["keywords"]
+    cached = _patterns.get(tenant)
+    if cached is not None and cached[0] is keywords:
+        return cached[1]
+
+    keys = sorted(
+        {
+            key for key, _ in keywords
+            if len(key) >= GROUP_AUTOSEARCH_MIN_KEY_LENGTH and key not in GROUP_STOPWORDS
+            and any(char.isalpha() for char in key)
+        },
+        key=len, reverse=True,
+    )
+    pattern = re.compile(r"(?<![\w-])(?:" + "|".join(map(re.escape, keys)) + r")(?![\w-])") if keys else None
+    _patterns[tenant] = (keywords, pattern)
+    return pattern
+
+
+def has_group_keyword(text, tenant):
+    """В тексте есть ключевое слово филиала целым словом (кроме общих слов)"""
+    pattern = _keyword_pattern(tenant)
+    return pattern is not None and pattern.search(text.lower().replace("ё", "е")) is not None
+
+
+def filter_update(update):
+    """Обновление для обработки или None, если его нужно отбросить
+
+    У команд и упоминаний в группе текст очищается от имени бота: для них
+    возвращается новая запись сообщения, исходная не меняется.
+    """
+    message = update.message
+    if message is None or message.chat.type not in GROUP_CHAT_TYPES:
+        return update
+
+    text = relevant_text(message)
+    if text is None:
+        increment("group_messages_ignored")
+        return None
+    if text != message.text:
+        return update.with_message(message.with_text(text))
+    return update
+
+
+def relevant_text(message):
+    """Текст сообщения группы для обработчиков или None, если бот не должен отвечать"""
+    text = message.text
+    if not text:
+        return None
+    username = BOT_INFO.get("username")
+
+    if text.startswith("/"):
+        command, separator, arguments = text.partition(" ")
+        name, _, target = command.partition("@")
+        if target and (not username or target.lower() != username.lower()):
+            # Команда другому боту
+            return None
+        return f"{name}{separator}{arguments}"
+
+    if username:
+        stripped = _strip_mention(text, username)
+        if stripped is not None:
+            return stripped
+
+    if BOT_INFO.get("id") and message.reply_to_from_id == BOT_INFO["id"]:
+        return text
+
+    # Обычная переписка: только короткие сообщения с ключевым словом
+    if len(text.split()) > GROUP_AUTOSEARCH_MAX_WORDS:
+        return None
+    return text if has_group_keyword(text, tenant_for_chat(message.chat.id)) else None
@@ -4,12 +4,62 @@
 Обработчики команд и callback для Telegram бота
 """
 
+import logging
+import math
 import os
-from config import KNOWLEDGE_BASE, SPECIAL_FILES, SEARCH_KEYWORDS, DEBUG_MODE
+import threading
+from config import KNOWLEDGE_BASE, SPECIAL_FILES, SEARCH_CACHE_SIZE
+from keyword_search import match_files
+import vector_search
+import snippets
+from metrics import increment
+from catalog import (
+    documents_in_category, find_by_link, find_document, get_categories, get_category_name,
+    get_special_document, get_special_keys, get_tenant_name
+)
+from callback_codec import (
+    ACTION_SEND, ACTION_SEND_ALL, ACTION_PIN, encode_callback, decode_callback, is_encoded_callback
+)
 from telegram_api import (
-    log_usage, get_file_path, send_message, send_document, 
-    create_inline_keyboard, edit_message_text, answer_callback_query
+    log_usage, create_inline_keyboard, edit_message_text, edit_message_reply_markup,
+    answer_callback_query
 )
+# Ответы ставятся в очередь исходящих и отправляются фоновыми воркерами
+from outbox import send_message, send_document, send_media_group
+import sessions
+import flood_control
+import broadcast
+from tenants import DEFAULT_TENANT, get_tenants, tenant_for_chat
+
+# Максимум документов в одном альбоме sendMediaGroup
+MEDIA_GROUP_LIMIT = 10
+
+# Сколько недавних документов добавлять под результатами поиска
+RECENT_IN_SEARCH = 3
+
+logger = logging.getLogger(__name__)
+
+# Кэш результатов поиска: запрос (с префиксом филиала) -> список найденных файлов
+SEARCH_CACHE = {}
+
+# Кэш готовых кнопок результатов: запрос (с префиксом филиала) -> (id документов, кнопки)
+RESULT_BUTTONS_CACHE = {}
+
+# Подписи кнопок специальных файлов в меню /all
+SPECIAL_BUTTONS = {"quick": "⚡ Быстрый справочник"}
+
+MAIN_MENU_TEXT = """📚 <b>Все инструкции Homeline:</b>
+
+<b>11 PDF файлов</b> в 3 категориях:
+
+1️⃣ <b>КРИТИЧЕСКИЕ</b> - диагностика, настройки
+2️⃣ <b>ПОДКЛЮЧЕНИЯ</b> - частный сектор, МКД  
+3️⃣ <b>ОБОРУДОВАНИЕ</b> - ONT, гибриды, инструменты
+
+Выбери категорию:"""
+
+# Кэши заполняются и из обработчиков, и из фонового прогрева
+_cache_lock = threading.Lock()
 
 
 class PDFManager:
@@ -39,11 +89,115 @@ class PDFManager:
 pdf_manager = PDFManager("pdf_files")
 
 
-def handle_start(chat_id, user_name):
-    """Обработать команду /start"""
+def _cache_put(cache, key, value):
+    """Сохранить значение в кэш, вытесняя самую старую запись"""
+    with _cache_lock:
+        if len(cache) >= SEARCH_CACHE_SIZE:
+            cache.pop(next(iter(cache)))
+        cache[key] = value
+
+
+def _cache_key(keyword, tenant):
+    """Ключ кэшей поиска (у филиала по умолчанию - сам запрос)"""
+    return keyword if tenant == DEFAULT_TENANT else f"{tenant}/{keyword}"
+
+
+def find_files(keyword, tenant=DEFAULT_TENANT):
+    """Найти файлы филиала по ключевым словам (результат кэшируется)"""
+    cache_key = _cache_key(keyword, tenant)
+    found_files = SEARCH_CACHE.get(cache_key)
+    if found_files is not None:
+        increment("search_cache_hits")
+        return found_files
+    
+    found_files = match_files(keyword, tenant)
+    if not found_files:
+        # Ни одно ключевое слово не подошло - ранжированный поиск по тексту PDF
+        found_files = vector_search.search(keyword, tenant)
+        if found_files:
+            increment("vector_search_hits")
+        elif not vector_search.is_ready():
+            # Индекс еще строится - пустой результат не кэшируем
+            return found_files
+    
+    _cache_put(SEARCH_CACHE, cache_key, found_files)
+    return found_files
+
+
+def build_result_buttons(keyword, found_files, tenant=DEFAULT_TENANT):
+    """Кнопки найденных документов (кэшируются вместе с запросом)"""
+    cache_key = _cache_key(keyword, tenant)
+    cached = RESULT_BUTTONS_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    doc_ids = []
+    buttons = []
+    
+    for filename in found_files:
+        document = find_document(filename, tenant)
+        if document is None:
+            logger.warning("Файл %r из SEARCH_KEYWORDS отсутствует в каталоге", filename)
+            continue
+        
+        doc_ids.append(document.doc_id)
+        callback_data = encode_callback(ACTION_SEND, document.doc_id)
+        buttons.append([{"text": document.description, "callback_data": callback_data}])
+    
+    # Несколько файлов - предлагаем получить все одним сообщением
+    if len(doc_ids) > 1:
+        send_all_ids = doc_ids[:MEDIA_GROUP_LIMIT]
+        buttons.append([{
+            "text": f"📦 Отправить все ({len(send_all_ids)})",
+            "callback_data": encode_callback(ACTION_SEND_ALL, *send_all_ids)
+        }])
+    
+    result = (doc_ids, buttons)
+    _cache_put(RESULT_BUTTONS_CACHE, cache_key, result)
+    return result
+
+
+def build_recent_buttons(chat_id, with_pin_buttons=False, exclude_ids=(), limit=None):
+    """Кнопки закрепленных и недавних документов чата"""
+    session = sessions.get_session(chat_id)
+    tenant = tenant_for_chat(chat_id)
+    seen = set(exclude_ids)
+    rows = []
+    for prefix, filenames in (("📌", session.pinned), ("🕘", session.recent)):
+        for filename in filenames:
+            document = find_document(filename, tenant)
+            if document is None or document.doc_id in seen:
+                continue
+            seen.add(document.doc_id)
+            row = [{
+                "text": f"{prefix} {document.description}",
+                "callback_data": encode_callback(ACTION_SEND, document.doc_id)
+            }]
+            if with_pin_buttons:
+                row.append({
+                    "text": "✖" if prefix == "📌" else "📌",
+                    "callback_data": encode_callback(ACTION_PIN, document.doc_id)
+                })
+            rows.append(row)
+    return rows[:limit]
+
+
+def handle_start(chat_id, user_name, link=None):
+    """Обработать команду /start (с параметром - ссылка на документ, например из QR-кода)"""
+    if link:
+        document = find_by_link(link)
+        if document is not None:
+            # Документ сразу, без приветствия и меню
+            increment("deep_links")
+            log_usage(chat_id, f"link_{link}")
+            send_catalog_document(chat_id, document)
+            return
+        increment("deep_links_unknown")
+        send_message(chat_id, "⌛ Документ по этой ссылке не найден - возможно, он удален из базы знаний.")
+    
     log_usage(chat_id, "start")
     
-    text = f"""🛠️ <b>База знаний Homeline Токмак</b>
+    text = f"""🛠️ <b>База знаний {get_tenant_name(tenant_for_chat(chat_id))}</b>
 
 Привет, {user_name}!
 
@@ -64,7 +218,13 @@ def handle_start(chat_id, user_name):
 
 <b>💡 Попробуй написать:</b> модемчик, вифи, или любое слово!"""
     
-    send_message(chat_id, text)
+    # Недавние и закрепленные документы - открываются одним нажатием
+    recent_buttons = build_recent_buttons(chat_id, with_pin_buttons=True)
+    if recent_buttons:
+        text += "\n\n<b>🕘 Недавние</b> (📌 - закрепить):"
+        send_message(chat_id, text, create_inline_keyboard(recent_buttons))
+    else:
+        send_message(chat_id, text)
 
 
 def handle_search(chat_id, text, is_command=True):
@@ -95,21 +255,21 @@ def handle_search(chat_id, text, is_command=True):
     
     log_usage(chat_id, f"search_{keyword}")
     
-    if DEBUG_MODE:
-        print(f"DEBUG: Поиск по ключевому слову: '{keyword}'")
+    logger.debug("Поиск по ключевому слову: %r", keyword)
     
-    # Поиск файлов
-    found_files = []
-    for key, files in SEARCH_KEYWORDS.items():
-        if key in keyword:
-            if DEBUG_MODE:
-                print(f"DEBUG: Найдено совпадение с ключом '{key}': {files}")
-            found_files.extend(files)
+    increment("searches")
+    tenant = tenant_for_chat(chat_id)
     
-    if DEBUG_MODE:
-        print(f"DEBUG: Всего найдено файлов: {len(found_files)} - {found_files}")
+    # Поиск файлов (сначала в кэше)
+    found_files = find_files(keyword, tenant)
+    
+    logger.debug("Всего найдено файлов: %d - %s", len(found_files), found_files)
     
     if not found_files:
+        # Недавние документы нужнее всего, когда поиск ничего не дал
+        recent_buttons = build_recent_buttons(chat_id, limit=RECENT_IN_SEARCH)
+        keyboard = create_inline_keyboard(recent_buttons) if recent_buttons else None
+        
         # При автопоиске показываем подсказку
         if not is_command:
             help_text = f"""🔍 <b>Ничего не найдено по запросу:</b> '{keyword}'
@@ -123,151 +283,65 @@ def handle_search(chat_id, text, is_command=True):
 
 <b>🔍 Всего работает 190+ слов!</b>
 Или используй /all для просмотра всех категорий"""
-            send_message(chat_id, help_text)
+            send_message(chat_id, help_text, keyboard)
         else:
-            send_message(chat_id, f"❌ Не найдено по запросу: {keyword}")
+            send_message(chat_id, f"❌ Не найдено по запросу: {keyword}", keyboard)
         return
     
     # Создать кнопки
-    if DEBUG_MODE:
-        print(f"DEBUG: Начинаем создание кнопок для {len(set(found_files))} файлов")
-        
-    buttons = []
+    doc_ids, result_buttons = build_result_buttons(keyword, found_files, tenant)
     
-    for i, filename in enumerate(set(found_files)):
-        if DEBUG_MODE:
-            print(f"DEBUG: Обрабатываем файл {i}: '{filename}'")
-        
-        # Найти категорию и описание файла
-        category = None
-        description = filename[:30] + "..."
-        
-        for cat_key, cat_info in KNOWLEDGE_BASE.items():
-            if filename in cat_info["files"]:
-                category = cat_key
-                description = cat_info["files"][filename]
-                if DEBUG_MODE:
-                    print(f"DEBUG: Найдена категория '{category}' для файла '{filename}'")
-                break
-        
-        # Если категория не найдена, ищем в специальных файлах
-        if category is None:
-            if DEBUG_MODE:
-                print(f"DEBUG: Категория не найдена, ищем в специальных файлах")
-            for special_key, special_filename in SPECIAL_FILES.items():
-                if filename == special_filename:
-                    category = "special"
-                    if DEBUG_MODE:
-                        print(f"DEBUG: Найден специальный файл: {special_key}")
-                    break
-        
-        # Если категория так и не найдена - ставим default
-        if category is None:
-            if DEBUG_MODE:
-                print(f"DEBUG: ВНИМАНИЕ! Категория не найдена для файла '{filename}', ставим 'unknown'")
-            category = "unknown"
-        
-        # Создаем безопасный callback_data БЕЗ эмодзи, кириллицы и спецсимволов
-        try:
-            # Убираем ВСЕ небезопасные символы для Telegram callback_data
-            import re
-            # Оставляем только латиницу, цифры и подчеркивания
-            safe_filename = re.sub(r'[^a-zA-Z0-9_]', '', 
-                                 filename.replace('ДИАГНОСТИКА', 'DIAGNOSTIKA')
-                                        .replace('ЗАТУХАНИЯ', 'ZATUHANIYA') 
-                                        .replace('НАСТРОЙКА', 'NASTROYKA')
-                                        .replace('РОУТЕРОВ', 'ROUTEROV')
-                                        .replace('Базовая', 'Bazovaya')
-                                        .replace('ГИБРИДЫ', 'GIBRIDY')
-                                        .replace('ПОДКЛЮЧЕНИЕ', 'PODKLYUCHENIE')
-                                        .replace('ЧАСТНОМ', 'CHASTNOM')
-                                        .replace('СЕКТОРЕ', 'SEKTORE')
-                                        .replace('КОММЕРЧЕСКИХ', 'KOMMERCHESKIH')
-                                        .replace('ОБЪЕКТОВ', 'OBYEKTOV')
-                                        .replace('ДЕМОНСТРАЦИЯ', 'DEMONSTRATSIYA')
-                                        .replace('УСЛУГ', 'USLUG')
-                                        .replace('КЛИЕНТУ', 'KLIENTU')
-                                        .replace('ПРОСТЫЕ', 'PROSTYE')
-                                        .replace('СВАРОЧНЫЕ', 'SVAROCHNYE')
-                                        .replace('АППАРАТЫ', 'APPARATY')
-                                        .replace('ИЗМЕРИТЕЛИ', 'IZMERITELI')
-                                        .replace('ОПТИЧЕСКОЙ', 'OPTICHESKOY')
-                                        .replace('МОЩНОСТИ', 'MOSHCHNOSTI')
-                                        .replace('СКАЛЫВАТЕЛЯ', 'SKALYVATELEY')
-                                        .replace('СТРИППЕРА', 'STRIPPERA')
-                                        .replace(' ', '')
-                                        .replace('.', '')
-                                        .replace('(', '')
-                                        .replace(')', '')
-                                        .replace('-', '')
-                                        .replace('№', 'N'))
-            
-            # Ограничиваем длину (Telegram лимит 64 символа)
-            if len(safe_filename) > 50:
-                safe_filename = safe_filename[:50]
-                
-            callback_data = f"search_{category}_{i}_{safe_filename}"
-            
-            if DEBUG_MODE:
-                print(f"DEBUG: Создан безопасный callback_data: '{callback_data}'")
-            
-            buttons.append([{"text": description, "callback_data": callback_data}])
-            if DEBUG_MODE:
-                print(f"DEBUG: Кнопка добавлена: '{description}'")
-            
-        except Exception as e:
-            if DEBUG_MODE:
-                print(f"DEBUG: ОШИБКА при создании кнопки для '{filename}': {e}")
-            continue
-    
-    if DEBUG_MODE:
-        print(f"DEBUG: Создано {len(buttons)} кнопок")
-    
-    if len(buttons) == 0:
-        if DEBUG_MODE:
-            print("DEBUG: ПРОБЛЕМА! Кнопки не созданы")
+    if len(doc_ids) == 0:
+        logger.warning("Кнопки не созданы для файлов: %s", found_files)
         send_message(chat_id, f"❌ Ошибка создания кнопок для найденных файлов")
         return
     
-    if DEBUG_MODE:
-        print(f"DEBUG: Создаем клавиатуру...")
-        
+    # Недавние документы, которых нет среди результатов
+    buttons = result_buttons + build_recent_buttons(chat_id, exclude_ids=doc_ids, limit=RECENT_IN_SEARCH)
+    
     keyboard = create_inline_keyboard(buttons)
     
     # Разный текст для команды и автопоиска
     if is_command:
-        result_text = f"🔍 <b>Найдено {len(set(found_files))} файлов:</b>"
+        result_text = f"🔍 <b>Найдено {len(doc_ids)} файлов:</b>"
     else:
-        result_text = f"🎯 <b>Автопоиск по '{keyword}':</b>\nНайдено {len(set(found_files))} файлов:"
+        result_text = f"🎯 <b>Автопоиск по '{keyword}':</b>\nНайдено {len(doc_ids)} файлов:"
+    
+    # Фрагменты текста с ответом - документ остается запасным вариантом
+    snippet_text = snippets.format_snippets(keyword, found_files, tenant)
+    if snippet_text:
+        result_text = f"{snippet_text}\n\n{result_text}"
     
-    if DEBUG_MODE:
-        print(f"DEBUG: Отправляем сообщение с {len(buttons)} кнопками...")
-        
     send_message(chat_id, result_text, keyboard)
 
 
-def handle_all(chat_id):
-    """Показать все инструкции"""
-    log_usage(chat_id, "all")
-    
-    buttons = [
-        [{"text": "1️⃣ КРИТИЧЕСКИЕ", "callback_data": "cat_critical"}],
-        [{"text": "2️⃣ ПОДКЛЮЧЕНИЯ", "callback_data": "cat_connections"}], 
-        [{"text": "3️⃣ ОБОРУДОВАНИЕ", "callback_data": "cat_equipment"}],
-        [{"text": "⚡ Быстрый справочник", "callback_data": "special_quick"}]
-    ]
+def build_main_menu(tenant):
+    """Текст и клавиатура меню категорий филиала"""
+    categories = get_categories(tenant)
+    buttons = [[{"text": name, "callback_data": f"cat_{category}"}] for category, name in categories.items()]
+    for key in get_special_keys(tenant):
+        buttons.append([{"text": SPECIAL_BUTTONS.get(key, f"📄 {key.upper()}"), "callback_data": f"special_{key}"}])
     
-    keyboard = create_inline_keyboard(buttons)
-    text = """📚 <b>Все инструкции Homeline:</b>
+    if tenant == DEFAULT_TENANT:
+        text = MAIN_MENU_TEXT
+    else:
+        files_count = sum(len(documents_in_category(category, tenant)) for category in categories)
+        lines = "\n".join(f"<b>{name}</b>" for name in categories.values())
+        text = f"""📚 <b>Все инструкции {get_tenant_name(tenant)}:</b>
 
-<b>11 PDF файлов</b> в 3 категориях:
+<b>{files_count} PDF файлов</b> в {len(categories)} категориях:
 
-1️⃣ <b>КРИТИЧЕСКИЕ</b> - диагностика, настройки
-2️⃣ <b>ПОДКЛЮЧЕНИЯ</b> - частный сектор, МКД  
-3️⃣ <b>ОБОРУДОВАНИЕ</b> - ONT, гибриды, инструменты
+{lines}
 
 Выбери категорию:"""
+    return text, create_inline_keyboard(buttons)
+
+
+def handle_all(chat_id):
+    """Показать все инструкции"""
+    log_usage(chat_id, "all")
     
+    text, keyboard = build_main_menu(tenant_for_chat(chat_id))
     send_message(chat_id, text, keyboard)
 
 
@@ -275,9 +349,29 @@ def handle_quick(chat_id):
     """Отправить быстрый справочник"""
     log_usage(chat_id, "quick")
     
-    file_path = get_file_path(SPECIAL_FILES["quick"])
+    document = get_special_document("quick", tenant_for_chat(chat_id))
+    if document is None:
+        send_message(chat_id, "⚡ Быстрого справочника в этой базе знаний нет. Открой /all")
+        return
     caption = "⚡ <b>Быстрый справочник</b>"
-    send_document(chat_id, file_path, SPECIAL_FILES["quick"], caption)
+    send_document(chat_id, document.path, document.filename, caption)
+
+
+def handle_branch(chat_id):
+    """Выбрать филиал (базу знаний) чата"""
+    log_usage(chat_id, "branch")
+    
+    tenants = get_tenants()
+    if len(tenants) == 1:
+        send_message(chat_id, f"🏢 Бот обслуживает один филиал: <b>{get_tenant_name(DEFAULT_TENANT)}</b>")
+        return
+    
+    current = tenant_for_chat(chat_id)
+    buttons = [
+        [{"text": f"{'✅ ' if tenant_id == current else ''}{tenant.name}", "callback_data": f"tenant_{tenant_id}"}]
+        for tenant_id, tenant in tenants.items()
+    ]
+    send_message(chat_id, "🏢 <b>Выбери филиал:</b>", create_inline_keyboard(buttons))
 
 
 def handle_contacts(chat_id):
@@ -296,273 +390,135 @@ def handle_contacts(chat_id):
     send_message(chat_id, text)
 
 
+def send_catalog_document(chat_id, document):
+    """Отправить документ из каталога"""
+    caption = f"📄 <b>{document.description}</b>"
+    log_usage(chat_id, f"doc_{document.filename}")
+    # Превью первой страницы приходит сразу, тяжелый PDF - следом
+    send_document(chat_id, document.path, document.filename, caption, preview=True)
+    sessions.record_open(chat_id, document.filename)
+
+
+def send_catalog_documents(chat_id, documents):
+    """Отправить несколько документов одним запросом sendMediaGroup"""
+    send_media_group(chat_id, [
+        (document.path, document.filename, f"📄 <b>{document.description}</b>")
+        for document in documents[:MEDIA_GROUP_LIMIT]
+    ])
+    for document in reversed(documents[:MEDIA_GROUP_LIMIT]):
+        log_usage(chat_id, f"doc_{document.filename}")
+        sessions.record_open(chat_id, document.filename)
+
+
+def send_stale_button_message(chat_id):
+    """Сообщить, что кнопка устарела"""
+    send_message(chat_id, "⌛ Кнопка устарела - база знаний обновилась.\nПовтори поиск или открой /all")
+
+
 def handle_callback(chat_id, callback_data, message_id):
     """Обработать нажатие кнопки"""
     try:
-        if DEBUG_MODE:
-            print(f"DEBUG: Получен callback: {callback_data}")
-        
-        if callback_data.startswith("search_"):
-            # Обработка callback из автопоиска
-            parts = callback_data.split("_")
-            if len(parts) >= 4:
-                category = parts[1]
-                safe_filename = "_".join(parts[3:])  # Объединяем обратно если было несколько _
-                
-                if DEBUG_MODE:
-                    print(f"DEBUG: Поиск файла по safe_filename: '{safe_filename}' в категории '{category}'")
-                
-                # ИСПРАВЛЕНИЕ: Ищем файл по безопасному имени напрямую
-                found_filename = None
-                
-                # Проходим по всем файлам из поисковых ключевых слов
-                for filename in [f for files in SEARCH_KEYWORDS.values() for f in files]:
-                    # Создаем безопасное имя для сравнения (такое же как при создании кнопки)
-                    import re
-                    test_safe = re.sub(r'[^a-zA-Z0-9_]', '', 
-                                     filename.replace('ДИАГНОСТИКА', 'DIAGNOSTIKA')
-                                            .replace('ЗАТУХАНИЯ', 'ZATUHANIYA')
-                                            .replace('НАСТРОЙКА', 'NASTROYKA')
-                                            .replace('РОУТЕРОВ', 'ROUTEROV')
-                                            .replace('Базовая', 'Bazovaya')
-                                            .replace('ГИБРИДЫ', 'GIBRIDY')
-                                            .replace('ПОДКЛЮЧЕНИЕ', 'PODKLYUCHENIE')
-                                            .replace('ЧАСТНОМ', 'CHASTNOM')
-                                            .replace('СЕКТОРЕ', 'SEKTORE')
-                                            .replace('КОММЕРЧЕСКИХ', 'KOMMERCHESKIH')
-                                            .replace('ОБЪЕКТОВ', 'OBYEKTOV')
-                                            .replace('ДЕМОНСТРАЦИЯ', 'DEMONSTRATSIYA')
-                                            .replace('УСЛУГ', 'USLUG')
-                                            .replace('КЛИЕНТУ', 'KLIENTU')
-                                            .replace('ПРОСТЫЕ', 'PROSTYE')
-                                            .replace('СВАРОЧНЫЕ', 'SVAROCHNYE')
-                                            .replace('АППАРАТЫ', 'APPARATY')
-                                            .replace('ИЗМЕРИТЕЛИ', 'IZMERITELI')
-                                            .replace('ОПТИЧЕСКОЙ', 'OPTICHESKOY')
-                                            .replace('МОЩНОСТИ', 'MOSHCHNOSTI')
-                                            .replace('СКАЛЫВАТЕЛЯ', 'SKALYVATELEY')
-                                            .replace('СТРИППЕРА', 'STRIPPERA')
-                                            .replace(' ', '')
-                                            .replace('.', '')
-                                            .replace('(', '')
-                                            .replace(')', '')
-                                            .replace('-', '')
-                                            .replace('№', 'N'))
-                    
-                    # Ограничиваем длину также как при создании кнопки
-                    if len(test_safe) > 50:
-                        test_safe = test_safe[:50]
-                    
-                    if DEBUG_MODE:
-                        print(f"DEBUG: Сравнение: '{test_safe}' == '{safe_filename}' ?")
-                    
-                    if test_safe == safe_filename:
-                        found_filename = filename
-                        if DEBUG_MODE:
-                            print(f"DEBUG: НАЙДЕН файл по безопасному имени: '{found_filename}'")
-                        break
+        if is_encoded_callback(callback_data):
+            # Кнопка документа: действие и документы из таблицы каталога
+            action, documents = decode_callback(callback_data)
+            if documents is None:
+                send_stale_button_message(chat_id)
+                return
+            
+            if action == ACTION_SEND:
+                send_catalog_document(chat_id, documents[0])
+            elif action == ACTION_SEND_ALL:
+                send_catalog_documents(chat_id, documents)
+            elif action == ACTION_PIN:
+                sessions.toggle_pin(chat_id, documents[0].filename)
+                keyboard = create_inline_keyboard(build_recent_buttons(chat_id, with_pin_buttons=True))
+                edit_message_reply_markup(chat_id, message_id, keyboard)
                 
-                if found_filename:
-                    # Найти правильную категорию для этого файла
-                    correct_category = None
-                    for cat_key, cat_info in KNOWLEDGE_BASE.items():
-                        if found_filename in cat_info["files"]:
-                            correct_category = cat_key
-                            if DEBUG_MODE:
-                                print(f"DEBUG: Файл '{found_filename}' принадлежит категории '{correct_category}'")
-                            break
-                    
-                    # Если не найден в основных категориях, ищем в специальных
-                    if correct_category is None:
-                        for special_key, special_filename in SPECIAL_FILES.items():
-                            if found_filename == special_filename:
-                                correct_category = "special"
-                                if DEBUG_MODE:
-                                    print(f"DEBUG: Найден специальный файл: {special_key}")
-                                break
-                    
-                    # Отправляем файл
-                    if correct_category == "special":
-                        file_path = get_file_path(found_filename)
-                        caption = f"📄 <b>{found_filename}</b>"
-                        send_document(chat_id, file_path, found_filename, caption)
-                    else:
-                        description = KNOWLEDGE_BASE[correct_category]["files"].get(found_filename, found_filename)
-                        file_path = get_file_path(found_filename, correct_category)
-                        caption = f"📄 <b>{description}</b>"
-                        send_document(chat_id, file_path, found_filename, caption)
-                    return
-                else:
-                    if DEBUG_MODE:
-                        print(f"DEBUG: ОШИБКА - файл не найден по safe_filename: '{safe_filename}'")
-                    send_message(chat_id, f"❌ Файл не найден. Обратитесь к администратору.")
-                    return
+        elif callback_data.startswith(("search_", "file_")):
+            # Кнопки старого формата больше не поддерживаются
+            send_stale_button_message(chat_id)
                 
         elif callback_data.startswith("cat_"):
             # Показать категорию
             category = callback_data.replace("cat_", "")
-            if DEBUG_MODE:
-                print(f"DEBUG: Открываем категорию: {category}")
+            logger.debug("Открываем категорию: %s", category)
             
-            if category in KNOWLEDGE_BASE:
-                cat_info = KNOWLEDGE_BASE[category]
+            tenant = tenant_for_chat(chat_id)
+            category_name = get_category_name(category, tenant)
+            if category_name:
                 buttons = []
                 
-                for i, (filename, desc) in enumerate(cat_info["files"].items()):
-                    # Создаем безопасный callback БЕЗ эмодзи и кириллицы
-                    import re
-                    safe_filename = re.sub(r'[^a-zA-Z0-9_]', '', 
-                                         filename.replace('ДИАГНОСТИКА', 'DIAGNOSTIKA')
-                                                .replace('ЗАТУХАНИЯ', 'ZATUHANIYA')
-                                                .replace('НАСТРОЙКА', 'NASTROYKA')
-                                                .replace('РОУТЕРОВ', 'ROUTEROV')
-                                                .replace('Базовая', 'Bazovaya')
-                                                .replace('ГИБРИДЫ', 'GIBRIDY')
-                                                .replace('ПОДКЛЮЧЕНИЕ', 'PODKLYUCHENIE')
-                                                .replace('ЧАСТНОМ', 'CHASTNOM')
-                                                .replace('СЕКТОРЕ', 'SEKTORE')
-                                                .replace('КОММЕРЧЕСКИХ', 'KOMMERCHESKIH')
-                                                .replace('ОБЪЕКТОВ', 'OBYEKTOV')
-                                                .replace('ДЕМОНСТРАЦИЯ', 'DEMONSTRATSIYA')
-                                                .replace('УСЛУГ', 'USLUG')
-                                                .replace('КЛИЕНТУ', 'KLIENTU')
-                                                .replace('ПРОСТЫЕ', 'PROSTYE')
-                                                .replace('СВАРОЧНЫЕ', 'SVAROCHNYE')
-                                                .replace('АППАРАТЫ', 'APPARATY')
-                                                .replace('ИЗМЕРИТЕЛИ', 'IZMERITELI')
-                                                .replace('ОПТИЧЕСКОЙ', 'OPTICHESKOY')
-                                                .replace('МОЩНОСТИ', 'MOSHCHNOSTI')
-                                                .replace('СКАЛЫВАТЕЛЯ', 'SKALYVATELEY')
-                                                .replace('СТРИППЕРА', 'STRIPPERA'))[:50]
-                    
-                    buttons.append([{"text": desc, "callback_data": f"file_{category}_{i}_{safe_filename}"}])
+                for document in documents_in_category(category, tenant):
+                    callback = encode_callback(ACTION_SEND, document.doc_id)
+                    buttons.append([{"text": document.description, "callback_data": callback}])
                 
                 buttons.append([{"text": "⬅️ Назад", "callback_data": "back"}])
                 keyboard = create_inline_keyboard(buttons)
                 
                 # Обновить сообщение
-                edit_text = f"<b>{cat_info['name']}</b>\n\nВыбери PDF:"
+                edit_text = f"<b>{category_name}</b>\n\nВыбери PDF:"
                 edit_message_text(chat_id, message_id, edit_text, keyboard)
                 
-        elif callback_data.startswith("file_"):
-            # Отправить файл из категории
-            parts = callback_data.split("_")
-            if len(parts) >= 4:
-                category = parts[1] 
-                safe_filename = "_".join(parts[3:])  # Объединяем обратно
-                
-                if DEBUG_MODE:
-                    print(f"DEBUG: Ищем файл {safe_filename} в категории {category}")
-                
-                if category in KNOWLEDGE_BASE:
-                    # Найти оригинальный filename по индексу (более надежно)
-                    try:
-                        file_index = int(parts[2])  # Индекс из callback_data
-                        filenames = list(KNOWLEDGE_BASE[category]["files"].keys())
-                        
-                        if file_index < len(filenames):
-                            filename = filenames[file_index]
-                            description = KNOWLEDGE_BASE[category]["files"][filename]
-                            file_path = get_file_path(filename, category)
-                            caption = f"📄 <b>{description}</b>"
-                            send_document(chat_id, file_path, filename, caption)
-                            return
-                    except (ValueError, IndexError) as e:
-                        if DEBUG_MODE:
-                            print(f"DEBUG: Ошибка получения файла по индексу: {e}")
-                    
-                    # Fallback - поиск по безопасному имени (для совместимости)
-                    for filename in KNOWLEDGE_BASE[category]["files"]:
-                        import re
-                        test_safe = re.sub(r'[^a-zA-Z0-9_]', '', 
-                                         filename.replace('ДИАГНОСТИКА', 'DIAGNOSTIKA')
-                                                .replace('ЗАТУХАНИЯ', 'ZATUHANIYA')
-                                                .replace('НАСТРОЙКА', 'NASTROYKA')
-                                                .replace('РОУТЕРОВ', 'ROUTEROV')
-                                                .replace('Базовая', 'Bazovaya')
-                                                .replace('ГИБРИДЫ', 'GIBRIDY')
-                                                .replace('ПОДКЛЮЧЕНИЕ', 'PODKLYUCHENIE')
-                                                .replace('ЧАСТНОМ', 'CHASTNOM')
-                                                .replace('СЕКТОРЕ', 'SEKTORE')
-                                                .replace('КОММЕРЧЕСКИХ', 'KOMMERCHESKIH')
-                                                .replace('ОБЪЕКТОВ', 'OBYEKTOV')
-                                                .replace('ДЕМОНСТРАЦИЯ', 'DEMONSTRATSIYA')
-                                                .replace('УСЛУГ', 'USLUG')
-                                                .replace('КЛИЕНТУ', 'KLIENTU')
-                                                .replace('ПРОСТЫЕ', 'PROSTYE')
-                                                .replace('СВАРОЧНЫЕ', 'SVAROCHNYE')
-                                                .replace('АППАРАТЫ', 'APPARATY')
-                                                .replace('ИЗМЕРИТЕЛИ', 'IZMERITELI')
-                                                .replace('ОПТИЧЕСКОЙ', 'OPTICHESKOY')
-                                                .replace('МОЩНОСТИ', 'MOSHCHNOSTI')
-                                                .replace('СКАЛЫВАТЕЛЯ', 'SKALYVATELEY')
-                                                .replace('СТРИППЕРА', 'STRIPPERA'))[:50]
-                                          
-                        if test_safe == safe_filename:
-                            description = KNOWLEDGE_BASE[category]["files"][filename]
-                            file_path = get_file_path(filename, category)
-                            caption = f"📄 <b>{description}</b>"
-                            send_document(chat_id, file_path, filename, caption)
-                            return
-                            
         elif callback_data.startswith("special_"):
             # Специальные файлы
             file_type = callback_data.replace("special_", "")
-            if DEBUG_MODE:
-                print(f"DEBUG: Специальный файл: {file_type}")
+            logger.debug("Специальный файл: %s", file_type)
             
-            if file_type in SPECIAL_FILES:
-                filename = SPECIAL_FILES[file_type]
-                file_path = get_file_path(filename)
+            document = get_special_document(file_type, tenant_for_chat(chat_id))
+            if document is not None:
                 caption = f"📄 <b>{file_type.upper()}</b>"
-                send_document(chat_id, file_path, filename, caption)
+                send_document(chat_id, document.path, document.filename, caption)
+                
+        elif callback_data.startswith("tenant_"):
+            # Выбор филиала
+            tenant = callback_data.replace("tenant_", "")
+            if tenant in get_tenants():
+                sessions.set_tenant(chat_id, tenant)
+                edit_message_text(
+                    chat_id, message_id, f"🏢 Филиал: <b>{get_tenant_name(tenant)}</b>\n\nОткрой /all или напиши слово"
+                )
                 
         elif callback_data == "back":
             # Вернуться к главному меню - редактируем сообщение
-            if DEBUG_MODE:
-                print("DEBUG: Возврат в главное меню")
-            
-            buttons = [
-                [{"text": "1️⃣ КРИТИЧЕСКИЕ", "callback_data": "cat_critical"}],
-                [{"text": "2️⃣ ПОДКЛЮЧЕНИЯ", "callback_data": "cat_connections"}], 
-                [{"text": "3️⃣ ОБОРУДОВАНИЕ", "callback_data": "cat_equipment"}],
-                [{"text": "⚡ Быстрый справочник", "callback_data": "special_quick"}]
-            ]
-            
-            keyboard = create_inline_keyboard(buttons)
-            text = """📚 <b>Все инструкции Homeline:</b>
-
-<b>11 PDF файлов</b> в 3 категориях:
-
-1️⃣ <b>КРИТИЧЕСКИЕ</b> - диагностика, настройки
-2️⃣ <b>ПОДКЛЮЧЕНИЯ</b> - частный сектор, МКД  
-3️⃣ <b>ОБОРУДОВАНИЕ</b> - ONT, гибриды, инструменты
-
-Выбери категорию:"""
+            logger.debug("Возврат в главное меню")
             
+            text, keyboard = build_main_menu(tenant_for_chat(chat_id))
             edit_message_text(chat_id, message_id, text, keyboard)
             
-    except Exception as e:
-        if DEBUG_MODE:
-            print(f"Ошибка callback: {e}")
-            import traceback
-            traceback.print_exc()
+    except Exception:
+        logger.exception("Ошибка callback")
 
 
 def process_message(message):
-    """Обработать входящее сообщение"""
+    """Обработать входящее сообщение (updates.Message)"""
     try:
-        chat_id = message["chat"]["id"]
-        user_name = message["from"].get("first_name", "Пользователь")
+        chat_id = message.chat.id
+        user_name = message.first_name or "Пользователь"
+        if message.chat.type == "private":
+            # Рассылки - только в личные чаты, не в группы
+            broadcast.register_recipient(chat_id)
         
-        if "text" in message:
-            text = message["text"].strip()
+        if message.text is not None:
+            # Длинный текст (например, вставленная переписка) обрезается до поиска
+            text = flood_control.truncate_query(message.text.strip())
+            
+            allowed, retry_after = flood_control.acquire(chat_id)
+            if not allowed:
+                if retry_after is not None:
+                    send_message(
+                        chat_id,
+                        f"⏳ <b>Слишком много сообщений.</b>\nПодожди {math.ceil(retry_after)} сек. и повтори запрос."
+                    )
+                return
             
             # Обработка команд (начинаются с /)
             if text.startswith("/"):
-                if text == "/start":
-                    handle_start(chat_id, user_name)
+                if text == "/start" or text.startswith("/start "):
+                    handle_start(chat_id, user_name, text[len("/start"):].strip())
                 elif text.startswith("/search"):
+                    query = " ".join(text.split()[1:]).lower()
+                    if query and flood_control.is_repeated_query(chat_id, query):
+                        return
                     handle_search(chat_id, text, is_command=True)
                 elif text == "/all":
                     handle_all(chat_id)
@@ -570,6 +526,8 @@ def process_message(message):
                     handle_quick(chat_id)
                 elif text == "/contacts":
                     handle_contacts(chat_id)
+                elif text == "/branch":
+                    handle_branch(chat_id)
                 else:
                     # Неизвестная команда
                     help_text = """❓ <b>Неизвестная команда</b>
@@ -600,37 +558,28 @@ def process_message(message):
                     send_message(chat_id, help_text)
                     return
                 
+                # Тот же запрос только что обработан - ответ уже отправлен
+                if flood_control.is_repeated_query(chat_id, text.lower()):
+                    return
+                
                 # Автопоиск по тексту
-                if DEBUG_MODE:
-                    print(f"DEBUG: Автопоиск активирован для: '{text}'")
+                logger.debug("Автопоиск активирован для: %r", text)
                 log_usage(chat_id, f"autosearch_{text}")
                 handle_search(chat_id, text, is_command=False)
                 
-    except Exception as e:
-        if DEBUG_MODE:
-            print(f"Ошибка обработки сообщения: {e}")
-            import traceback
-            traceback.print_exc()
+    except Exception:
+        logger.exception("Ошибка обработки сообщения")
 
 
-def process_callback(callback_query):
-    """Обработать callback от кнопки"""
+def process_callback(callback):
+    """Обработать callback от кнопки (updates.Callback)"""
     try:
-        chat_id = callback_query["message"]["chat"]["id"]
-        message_id = callback_query["message"]["message_id"]
-        callback_data = callback_query["data"]
-        
-        if DEBUG_MODE:
-            print(f"DEBUG: Получен callback_query: {callback_data}")
+        logger.debug("Получен callback_query: %s", callback.data)
         
         # Ответить на callback (убрать "часики")
-        callback_id = callback_query["id"]
-        answer_callback_query(callback_id)
+        answer_callback_query(callback.id)
         
-        handle_callback(chat_id, callback_data, message_id)
+        handle_callback(callback.chat.id, callback.data, callback.message_id)
         
-    except Exception as e:
-        if DEBUG_MODE:
-            print(f"Ошибка callback: {e}")
-            import traceback
-            traceback.print_exc()
+    except Exception:
+        logger.exception("Ошибка callback")
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Скомпилированная база знаний для быстрого запуска
+
+Каталоги документов, меню категорий и таблицы ключевых слов всех
+филиалов (tenants) собираются один раз и сохраняются в KB_ARTIFACT_FILE
+(marshal). Формат файла: MAGIC, версия формата, sha256 содержимого,
+содержимое. При запуске файл только читается и проверяется по
+контрольной сумме; если config.py, TENANTS_FILE или код сборки новее
+файла, он пересобирается.
+
+Сборка: python kb_artifact.py
+Постоянные ссылки на документы (для QR-кодов): python kb_artifact.py --links
+"""
+
+import argparse
+import hashlib
+import logging
+import marshal
+import os
+import threading
+import zlib
+from collections import namedtuple
+
+from config import KB_ARTIFACT_FILE, TENANTS_FILE
+from tenants import DEFAULT_TENANT, get_tenants
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"HLKB"
+FORMAT_VERSION = 3
+HEADER_SIZE = len(MAGIC) + 1 + hashlib.sha256().digest_size
+
+_SOURCES = (
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.py"),
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "tenants.py"),
+    os.path.abspath(__file__),
+    TENANTS_FILE,
+)
+
+# tenants: id филиала -> {name, by_filename, by_category, categories, special, keywords}
+# links: постоянный id документа для ссылок /start -> номер документа
+KnowledgeBase = namedtuple("KnowledgeBase", "documents catalog_version tenants links")
+
+_lock = threading.Lock()
+_knowledge_base = None
+
+
+def link_id(filename, tenant_id=DEFAULT_TENANT):
+    """Постоянный id документа для ссылки t.me/<бот>?start=<id>
+
+    Зависит только от филиала и имени файла, поэтому напечатанный QR-код
+    продолжает работать после перестановки документов или обновления PDF.
+    """
+    name = filename if tenant_id == DEFAULT_TENANT else f"{tenant_id}/{filename}"
+    return hashlib.sha1(name.encode("utf-8")).hexdigest()[:10]
+
+
+def _base_folders():
+    """Папки баз знаний филиалов (пути документов зависят от окружения)"""
+    return {tenant_id: tenant.base_folder for tenant_id, tenant in get_tenants().items()}
+
+
+def compile_knowledge_base():
+    """Собрать базы знаний всех филиалов в виде простых типов (для marshal)"""
+    # Общая нумерация документов: филиал за филиалом, в филиале сначала категории, затем специальные файлы
+    documents = []
+    tenants = {}
+    for tenant_id, tenant in get_tenants().items():
+        first_id = len(documents)
+        special = {}
+        for category, cat_info in tenant.knowledge_base.items():
+            for filename, description in cat_info["files"].items():
+                path = os.path.join(tenant.base_folder, cat_info["folder"], filename)
+                documents.append((category, filename, description, path, tenant_id))
+        for key, filename in tenant.special_files.items():
+            special[key] = len(documents)
+            documents.append(("special", filename, filename, os.path.join(tenant.base_folder, filename), tenant_id))
+
+        # Первый документ с таким именем (категории важнее специальных файлов)
+        by_filename = {}
+        by_category = {}
+        for doc_id in range(first_id, len(documents)):
+            category, filename = documents[doc_id][:2]
+            by_filename.setdefault(filename, doc_id)
+            by_category.setdefault(category, []).append(doc_id)
+
+        tenants[tenant_id] = {
+            "name": tenant.name,
+            "by_filename": by_filename,
+            "by_category": {category: tuple(doc_ids) for category, doc_ids in by_category.items()},
+            "categories": {category: cat_info["name"] for category, cat_info in tenant.knowledge_base.items()},
+            "special": special,
+            "keywords": tuple((key, tuple(files)) for key, files in tenant.search_keywords.items()),
+        }
+
+    # Версия каталога меняется при любом изменении состава или порядка документов
+    # (для единственного филиала - та же строка, что и до появления филиалов)
+    catalog_version = zlib.crc32("\n".join(
+        f"{category}/{filename}" if tenant_id == DEFAULT_TENANT else f"{tenant_id}:{category}/{filename}"
+        for category, filename, _, _, tenant_id in documents
+    ).encode("utf-8")) & 0xFFFF
+
+    # Первый документ с таким именем в филиале (как в by_filename)
+    links = {}
+    for doc_id, (_, filename, _, _, tenant_id) in enumerate(documents):
+        links.setdefault(link_id(filename, tenant_id), doc_id)
+
+    return {
+        "base_folders": _base_folders(),
+        "documents": tuple(documents),
+        "catalog_version": catalog_version,
+        "tenants": tenants,
+        "links": links,
+    }
+
+
+def save_artifact(data, path=KB_ARTIFACT_FILE):
+    """Записать базу знаний в файл (атомарно)"""
+    payload = marshal.dumps(data)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + bytes([FORMAT_VERSION]) + hashlib.sha256(payload).digest() + payload)
+    os.replace(tmp_path, path)
+    logger.info(f"📦 База знаний скомпилирована: {len(data['documents'])} документов, {len(payload)} байт")
+
+
+def read_artifact(path=KB_ARTIFACT_FILE):
+    """Прочитать базу знаний из файла. None - файла нет, он устарел или поврежден"""
+    try:
+        sources = [source for source in _SOURCES if os.path.exists(source)]
+        if os.path.getmtime(path) < max(os.path.getmtime(source) for source in sources):
+            return None
+        with open(path, "rb") as f:
+            raw = f.read()
+    except OSError:
+        return None
+
+    if len(raw) < HEADER_SIZE or raw[:len(MAGIC)] != MAGIC or raw[len(MAGIC)] != FORMAT_VERSION:
+        return None
+    payload = memoryview(raw)[HEADER_SIZE:]
+    if hashlib.sha256(payload).digest() != raw[len(MAGIC) + 1:HEADER_SIZE]:
+        logger.warning(f"Контрольная сумма {path} не совпадает - база знаний будет пересобрана")
+        return None
+    try:
+        data = marshal.loads(payload)
+    except (EOFError, ValueError, TypeError):
+        return None
+    # Пути документов зависят от окружения
+    if data.get("base_folders") != _base_folders():
+        return None
+    return data
+
+
+def load_knowledge_base():
+    """База знаний (читается один раз при первом обращении)"""
+    global _knowledge_base
+    if _knowledge_base is None:
+        with _lock:
+            if _knowledge_base is None:
+                data = read_artifact()
+                if data is None:
+                    data = compile_knowledge_base()
+                    try:
+                        save_artifact(data)
+                    except OSError as e:
+                        logger.warning(f"Не удалось сохранить {KB_ARTIFACT_FILE}: {e}")
+                del data["base_folders"]
+                _knowledge_base = KnowledgeBase(**data)
+    return _knowledge_base
+
+
+def print_links():
+    """Постоянные ссылки на документы (параметр start для QR-кодов)"""
+    data = load_knowledge_base()
+    for link, doc_id in sorted(data.links.items(), key=lambda item: item[1]):
+        category, filename, description, _, tenant_id = data.documents[doc_id]
+        print(f"start={link}\t{tenant_id}\t{category}\t{filename}\t{description}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Сборка базы знаний")
+    parser.add_argument("--links", action="store_true", help="показать ссылки /start на документы")
+    args = parser.parse_args()
+    if args.links:
+        print_links()
+    else:
+        save_artifact(compile_knowledge_base())
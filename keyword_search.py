@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Поиск файлов по таблице ключевых слов SEARCH_KEYWORDS (из скомпилированной базы знаний)
+
+Кроме самого запроса проверяются его варианты: набранный не в той
+раскладке ("jyn" -> "онт", "пзщт" -> "gpon") и транслит ("vaifai" ->
+"вайфай"). Все варианты склеиваются в одну строку и сверяются с таблицей
+за один проход, так что таблица ключевых слов не растет.
+"""
+
+import re
+
+from kb_artifact import load_knowledge_base
+from tenants import DEFAULT_TENANT
+
+# Варианты запроса проверяются только по ключам не короче этого:
+# короткие ключи ("rx", "tx") слишком часто случайно входят в перекодированный текст
+MIN_VARIANT_KEY_LENGTH = 3
+
+_QWERTY = "`qwertyuiop[]asdfghjkl;'zxcvbnm,."
+_YCUKEN = "ёйцукенгшщзхъфывапролджэячсмитьбю"
+
+_EN_TO_RU = str.maketrans(_QWERTY, _YCUKEN)
+_RU_TO_EN = str.maketrans(_YCUKEN, _QWERTY)
+
+# Сочетания латиницы для транслита (длинные раньше коротких)
+_TRANSLIT = {
+    "shch": "щ", "sch": "щ",
+    "zh": "ж", "kh": "х", "ch": "ч", "sh": "ш", "ts": "ц",
+    "ya": "я", "ja": "я", "yu": "ю", "ju": "ю", "yo": "е", "jo": "е", "ye": "е",
+    "a": "а", "b": "б", "c": "к", "d": "д", "e": "е", "f": "ф", "g": "г",
+    "h": "х", "i": "и", "j": "й", "k": "к", "l": "л", "m": "м", "n": "н",
+    "o": "о", "p": "п", "q": "к", "r": "р", "s": "с", "t": "т", "u": "у",
+    "v": "в", "w": "в", "x": "кс", "y": "ы", "z": "з", "'": "ь",
+}
+# "i" и "y" после гласной читаются как "й" (vaifai, sarai)
+_TRANSLIT_PATTERN = re.compile(
+    "(?P<short>(?<=[aeiouy])[iy])|" + "|".join(sorted(map(re.escape, _TRANSLIT), key=len, reverse=True))
+)
+
+_LATIN_WORD = re.compile(r"[a-z`\[\];',.]*[a-z][a-z`\[\];',.]*")
+_CYRILLIC_WORD = re.compile(r"[а-яё]+")
+
+
+def _translit_char(match):
+    return "й" if match.group("short") else _TRANSLIT[match.group(0)]
+
+
+def query_variants(keyword):
+    """Перекодированные варианты запроса (без самого запроса)"""
+    variants = []
+    latin_words = _LATIN_WORD.findall(keyword)
+    if latin_words:
+        latin = " ".join(latin_words)
+        variants.append(latin.translate(_EN_TO_RU))
+        variants.append(_TRANSLIT_PATTERN.sub(_translit_char, latin))
+    cyrillic_words = _CYRILLIC_WORD.findall(keyword)
+    if cyrillic_words:
+        cyrillic = " ".join(cyrillic_words)
+        variants.append(cyrillic.translate(_RU_TO_EN))
+        if "ё" in cyrillic:
+            variants.append(cyrillic.replace("ё", "е"))
+    return variants
+
+
+def match_files(keyword, tenant=DEFAULT_TENANT):
+    """Файлы филиала, чьи ключевые слова входят в запрос или его варианты (без повторов, в порядке совпадений)"""
+    # Перевод строки не встречается в ключах, поэтому совпадение не склеит соседние варианты
+    variants = "\n".join(query_variants(keyword))
+    found_files = []
+    tenants = load_knowledge_base().tenants
+    for key, files in (tenants.get(tenant) or tenants[DEFAULT_TENANT])["keywords"]:
+        if key in keyword or (len(key) >= MIN_VARIANT_KEY_LENGTH and key in variants):
+            found_files.extend(files)
+    return list(dict.fromkeys(found_files))
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Анализ журнала статистики бота (bot_stats.txt) за один проход
+
+Строки формата "timestamp - user_id - action" читаются генераторами,
+поэтому память не зависит от размера журнала. Поддерживаются
+ротированные и сжатые части (bot_stats.txt.1, bot_stats.txt.2.gz, ...).
+
+Примеры:
+    python log_analyzer.py
+    python log_analyzer.py bot_stats.txt.*.gz bot_stats.txt --top 50
+    python log_analyzer.py --format csv --output report.csv
+"""
+
+import argparse
+import bz2
+import csv
+import glob
+import gzip
+import json
+import lzma
+import os
+import sys
+from collections import Counter
+from datetime import datetime
+from functools import lru_cache
+
+from config import LOG_FILE
+from keyword_search import match_files
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Документ, полученный в течение этого времени после поиска, считается конверсией
+CONVERSION_WINDOW = 300  # секунд
+
+# Сколько разных запросов считать, прежде чем отбросить редкие
+MAX_TRACKED_QUERIES = 200000
+
+OPENERS = {
+    ".gz": gzip.open,
+    ".bz2": bz2.open,
+    ".xz": lzma.open,
+}
+
+
+def default_paths():
+    """Журнал и его ротированные части, от старых к новым"""
+    paths = glob.glob(f"{glob.escape(LOG_FILE)}*")
+    return sorted(paths, key=os.path.getmtime)
+
+
+def iter_lines(paths):
+    """Строки всех файлов по очереди (сжатые файлы распаковываются на лету)"""
+    for path in paths:
+        opener = OPENERS.get(os.path.splitext(path)[1], open)
+        with opener(path, "rt", encoding="utf-8", errors="replace") as f:
+            yield from f
+
+
+def parse_records(lines):
+    """(время, user_id, действие) для корректных строк"""
+    for line in lines:
+        parts = line.rstrip("\n").split(" - ", 2)
+        if len(parts) != 3:
+            continue
+        try:
+            timestamp = datetime.strptime(parts[0], TIMESTAMP_FORMAT)
+        except ValueError:
+            continue
+        yield timestamp, parts[1], parts[2]
+
+
+@lru_cache(maxsize=100000)
+def has_results(query):
+    """Находит ли запрос хоть один документ"""
+    return bool(match_files(query))
+
+
+def _bounded_increment(counter, key, limit=MAX_TRACKED_QUERIES):
+    """Увеличить счетчик, отбрасывая редкие значения при переполнении"""
+    counter[key] += 1
+    if len(counter) > limit:
+        top = counter.most_common(limit // 5)
+        counter.clear()
+        counter.update(dict(top))
+
+
+def analyze(records, top=20):
+    """Собрать отчет за один проход по записям"""
+    queries = Counter()
+    zero_result = Counter()
+    documents = Counter()
+    actions = Counter()
+    users = Counter()
+    hourly = Counter()
+    conversions = Counter()
+    last_search = {}  # user_id -> (время, запрос)
+    first_seen = last_seen = None
+    total = 0
+
+    for timestamp, user_id, action in records:
+        total += 1
+        first_seen = first_seen or timestamp
+        last_seen = timestamp
+        users[user_id] += 1
+        hourly[timestamp.hour] += 1
+
+        kind, _, value = action.partition("_")
+        actions[kind if value else action] += 1
+
+        if kind == "search" and value:
+            _bounded_increment(queries, value)
+            if not has_results(value):
+                _bounded_increment(zero_result, value)
+            last_search[user_id] = (timestamp, value)
+        elif kind == "doc" and value:
+            documents[value] += 1
+            search = last_search.pop(user_id, None)
+            if search and (timestamp - search[0]).total_seconds() <= CONVERSION_WINDOW:
+                _bounded_increment(conversions, search[1])
+
+    return {
+        "records": total,
+        "first_seen": first_seen.strftime(TIMESTAMP_FORMAT) if first_seen else None,
+        "last_seen": last_seen.strftime(TIMESTAMP_FORMAT) if last_seen else None,
+        "actions": dict(actions.most_common()),
+        "top_queries": queries.most_common(top),
+        "zero_result_queries": zero_result.most_common(top),
+        "top_documents": documents.most_common(top),
+        "users": {"total": len(users), "top": users.most_common(top)},
+        "hourly_load": [hourly.get(hour, 0) for hour in range(24)],
+        "query_conversion": [
+            (query, count, conversions.get(query, 0), round(conversions.get(query, 0) / count, 3))
+            for query, count in queries.most_common(top)
+        ],
+    }
+
+
+def write_json(report, out):
+    """Отчет в JSON"""
+    json.dump(report, out, ensure_ascii=False, indent=2)
+    out.write("\n")
+
+
+def write_csv(report, out):
+    """Отчет в CSV: раздел, ключ, значение, доп. значение (для конверсии - число переходов)"""
+    writer = csv.writer(out)
+    writer.writerow(["section", "key", "value", "extra"])
+    for name in ("records", "first_seen", "last_seen"):
+        writer.writerow(["summary", name, report[name], ""])
+    writer.writerow(["summary", "users_total", report["users"]["total"], ""])
+    for action, count in report["actions"].items():
+        writer.writerow(["actions", action, count, ""])
+    for section in ("top_queries", "zero_result_queries", "top_documents"):
+        for key, count in report[section]:
+            writer.writerow([section, key, count, ""])
+    for user_id, count in report["users"]["top"]:
+        writer.writerow(["top_users", user_id, count, ""])
+    for hour, count in enumerate(report["hourly_load"]):
+        writer.writerow(["hourly_load", f"{hour:02d}", count, ""])
+    for query, searches, converted, _ in report["query_conversion"]:
+        writer.writerow(["query_conversion", query, searches, converted])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Анализ журнала статистики бота")
+    parser.add_argument("paths", nargs="*", help=f"Файлы журнала (по умолчанию {LOG_FILE}*)")
+    parser.add_argument("--top", type=int, default=20, help="Размер топов")
+    parser.add_argument("--format", choices=("json", "csv"), default="json")
+    parser.add_argument("--output", help="Файл отчета (по умолчанию stdout)")
+    args = parser.parse_args(argv)
+
+    paths = args.paths or default_paths()
+    if not paths:
+        parser.error(f"Журнал не найден: {LOG_FILE}")
+
+    report = analyze(parse_records(iter_lines(paths)), top=args.top)
+    writer = write_csv if args.format == "csv" else write_json
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="") as out:
+            writer(report, out)
+    else:
+        writer(report, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Настройка структурированного логирования бота
+
+- сообщения форматируются только если запись действительно выводится
+  (logger.debug("... %s", x) вместо print(f"..."));
+- уровни задаются для каждого модуля (LOG_LEVELS="handlers=DEBUG,telegram_api=INFO");
+- частые DEBUG-записи ограничиваются по количеству в секунду;
+- вывод в JSON (или текст) идет через очередь в отдельном потоке,
+  поэтому обработчики обновлений не ждут записи в stdout;
+- SIGUSR1 включает/выключает DEBUG на лету.
+"""
+
+import json
+import logging
+import logging.handlers
+import queue
+import signal
+import sys
+import threading
+
+from config import DEBUG_MODE, LOG_FORMAT, LOG_LEVELS, LOG_DEBUG_RATE_LIMIT
+
+# Модули бота, уровень которых переключается вместе с DEBUG
+BOT_LOGGERS = (
+    "__main__", "handlers", "telegram_api", "state", "shared_store", "outbox", "broadcast", "sessions",
+    "warmup", "slo", "poll_control", "vector_search", "snippets", "group_filter", "updates", "tenants",
+    "file_store", "catalog", "kb_artifact", "keyword_search", "pdf_text", "previews", "flood_control",
+    "callback_codec", "metrics", "log_analyzer", "multipart",
+)
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON"""
+    def format(self, record):
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+class DebugRateLimitFilter(logging.Filter):
+    """Пропускает не больше N DEBUG-записей в секунду с одного места в коде"""
+    def __init__(self, per_second):
+        super().__init__()
+        self.per_second = per_second
+        self._lock = threading.Lock()
+        self._windows = {}
+        self.dropped = 0
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.per_second <= 0:
+            return True
+        key = (record.pathname, record.lineno)
+        second = int(record.created)
+        with self._lock:
+            window_second, count = self._windows.get(key, (second, 0))
+            if window_second != second:
+                window_second, count = second, 0
+            if count >= self.per_second:
+                self.dropped += 1
+                return False
+            self._windows[key] = (window_second, count + 1)
+        return True
+
+
+def _parse_levels(spec):
+    """Разобрать строку вида "handlers=DEBUG,telegram_api=INFO" """
+    levels = {}
+    for item in (spec or "").split(","):
+        name, _, level = item.partition("=")
+        name, level = name.strip(), level.strip().upper()
+        if name and level in logging._nameToLevel:
+            levels[name] = logging._nameToLevel[level]
+    return levels
+
+
+def set_level(name, level):
+    """Изменить уровень логгера во время работы"""
+    if isinstance(level, str):
+        level = logging._nameToLevel.get(level.upper(), logging.INFO)
+    logging.getLogger(name).setLevel(level)
+
+
+def toggle_debug(signum=None, frame=None):
+    """Включить или выключить DEBUG для модулей бота"""
+    enable = not logging.getLogger("handlers").isEnabledFor(logging.DEBUG)
+    for name in BOT_LOGGERS:
+        set_level(name, logging.DEBUG if enable else logging.INFO)
+    logging.getLogger(__name__).info("DEBUG %s", "включен" if enable else "выключен")
+
+
+def setup_logging():
+    """Настроить логирование через очередь с неблокирующей записью"""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(DebugRateLimitFilter(LOG_DEBUG_RATE_LIMIT))
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(logging.INFO)
+
+    # Сторонние библиотеки (urllib3, werkzeug) остаются на INFO
+    base_level = logging.DEBUG if DEBUG_MODE else logging.INFO
+    for name in BOT_LOGGERS:
+        logging.getLogger(name).setLevel(base_level)
+    for name, level in _parse_levels(LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+    if hasattr(signal, "SIGUSR1") and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR1, toggle_debug)
+
+
+def shutdown_logging():
+    """Дописать накопленные записи перед выходом"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
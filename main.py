@@ -5,121 +5,385 @@
 Telegram бот базы знаний Homeline с веб-сервером для Render.com
 """
 
-import logging
 import time
+
+# Момент запуска процесса - для замера холодного старта
+BOOT_STARTED = time.time()
+
+import logging
+import signal
 import os
-from threading import Thread
-from flask import Flask
-
-# Импорт модулей бота
-from config import TOKEN, BASE_FOLDER, DEBUG_MODE, IS_PRODUCTION
-from handlers import process_message, process_callback
-from telegram_api import get_updates, check_bot_connection, send_message
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.DEBUG if DEBUG_MODE else logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+from threading import Thread, Event
+
+# Импорт модулей бота (тяжелые модули загружаются лениво в load_bot_modules)
+from config import TOKEN, BASE_FOLDER, DEBUG_MODE, IS_PRODUCTION, SCALE_OUT, WORKER_THREADS, LEASE_TTL
+from metrics import increment, set_value, get_metrics
+from logging_setup import setup_logging, shutdown_logging
+from poll_control import PollController, CLOSED
+import slo
+
+handlers = None
+telegram_api = None
+state = None
+shared_store = None
+warmup = None
+group_filter = None
+outbox = None
+broadcast = None
+
+# Настройка логирования (уровни модулей, JSON, неблокирующая запись)
+setup_logging()
 logger = logging.getLogger(__name__)
 
-# Flask веб-сервер для health check
-app = Flask(__name__)
+# Событие остановки бота (SIGTERM от Render или Ctrl+C)
+stop_event = Event()
+_polling = False
 
-@app.route('/')
-def home():
-    return "✅ Homeline Telegram Bot работает!"
+# Темп опроса getUpdates и предохранитель от сбоев Telegram
+poll_controller = PollController()
 
-@app.route('/health')
-def health():
-    return {"status": "ok", "bot": "running"}
+# Готовность бота (для /health) вместо фиксированной паузы при запуске
+bot_ready = Event()
+_first_update_handled = False
+
+
+class ShutdownRequested(BaseException):
+    """Прерывание long polling при остановке"""
+
+
+def request_shutdown(signum, frame):
+    """Обработчик сигнала остановки"""
+    logger.info(f"Получен сигнал {signum}, останавливаю бота...")
+    stop_event.set()
+    # Ожидание getUpdates можно прервать сразу, обработку обновления - нет
+    if _polling:
+        raise ShutdownRequested()
+
+
+def elapsed_ms():
+    """Миллисекунды с запуска процесса"""
+    return int((time.time() - BOOT_STARTED) * 1000)
+
+
+def create_app():
+    """Flask веб-сервер для health check (Flask импортируется только здесь)"""
+    from flask import Flask
+    
+    app = Flask(__name__)
+    
+    @app.route('/')
+    def home():
+        return "✅ Homeline Telegram Bot работает!"
+    
+    @app.route('/health')
+    def health():
+        # Статус degraded - нарушены SLO задержек, опрос Telegram завис или разомкнут предохранитель
+        report = slo.health()
+        report["bot"] = "running" if bot_ready.is_set() else "starting"
+        report["poll_breaker"] = poll_controller.status()
+        if report["poll_breaker"]["state"] != CLOSED:
+            report["status"] = "degraded"
+            report["breaches"].append(f"предохранитель опроса: {report['poll_breaker']['state']}")
+        return report
+    
+    @app.route('/stats')
+    def stats():
+        try:
+            # Получаем статистику от бота
+            metrics = get_metrics()
+            stats_data = {
+                "status": "running" if bot_ready.is_set() else "starting",
+                "base_folder": BASE_FOLDER,
+                "debug_mode": DEBUG_MODE,
+                "is_production": IS_PRODUCTION,
+                "startup_ms_to_ready": metrics.get("startup_ms_to_ready"),
+                "startup_ms_to_first_update": metrics.get("startup_ms_to_first_update")
+            }
+            return stats_data
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+    
+    return app
 
-@app.route('/stats')
-def stats():
-    try:
-        # Получаем статистику от бота
-        stats_data = {
-            "status": "running",
-            "base_folder": BASE_FOLDER,
-            "debug_mode": DEBUG_MODE,
-            "is_production": IS_PRODUCTION
-        }
-        return stats_data
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
 
 def run_flask():
     """Запуск Flask сервера в отдельном потоке"""
+    from werkzeug.serving import make_server
+    
     port = int(os.environ.get('PORT', 10000))  # Render использует переменную PORT
-    app.run(host='0.0.0.0', port=port, debug=False)
+    server = make_server('0.0.0.0', port, create_app(), threaded=True)
+    # Порт уже открыт - health check отвечает, пока бот догружается
+    logger.info(f"🌐 Веб-сервер запущен на порту {port} через {elapsed_ms()} мс")
+    server.serve_forever()
 
-def run_telegram_bot():
-    """Запуск Telegram бота"""
+
+def load_bot_modules():
+    """Импорт обработчиков, индекса ключевых слов и состояния"""
+    global handlers, telegram_api, state, shared_store, warmup, group_filter, outbox, broadcast
+    import telegram_api
+    import handlers
+    import state
+    import warmup
+    import group_filter
+    import outbox
+    import broadcast
+    if SCALE_OUT:
+        import shared_store
+
+
+def check_connection_async():
+    """Проверка getMe в фоне, пока загружаются индексы"""
+    result = {}
+    
+    def check():
+        import telegram_api as api
+        result["ok"] = api.check_bot_connection()
+    
+    thread = Thread(target=check, name="get-me", daemon=True)
+    thread.start()
+    
+    def wait():
+        thread.join()
+        return result.get("ok", False)
+    
+    return wait
+
+
+def mark_update_handled():
+    """Зафиксировать время до первого обработанного обновления"""
+    global _first_update_handled
+    if not _first_update_handled:
+        _first_update_handled = True
+        startup_ms = elapsed_ms()
+        set_value("startup_ms_to_first_update", startup_ms)
+        logger.info(f"⏱️ Первое обновление обработано через {startup_ms} мс после запуска")
+
+
+def dispatch_update(update):
+    """Передать обновление нужному обработчику (не больше одного раза)"""
+    # Повтор после падения или таймаута - обработчики уже отработали
+    update_id = update.update_id
+    if update_id is not None and not state.claim_update(update_id):
+        increment("updates_duplicate")
+        return
+    
+    started = slo.begin_update(update)
     try:
-        logger.info("Запуск Telegram бота...")
-        
-        # Проверка подключения к Telegram
-        if not check_bot_connection():
-            raise Exception("Не удалось подключиться к Telegram API")
-        
-        logger.info(f"📂 Базовая папка: {BASE_FOLDER}")
-        logger.info(f"🚀 Супер поиск активирован!")
+        # Обработка обычного сообщения
+        if update.message is not None:
+            handlers.process_message(update.message)
         
-        # Основной цикл получения обновлений
-        offset = 0
+        # Обработка callback от кнопок
+        elif update.callback is not None:
+            callback = update.callback
+            if not state.claim_callback(callback.id):
+                increment("callbacks_duplicate")
+                return
+            handlers.process_callback(callback)
+    finally:
+        slo.end_update(started)
+
+
+def poll_updates(offset, poll_timeout=30):
+    """getUpdates, который можно прервать сигналом остановки. Ошибки Bot API и сети выбрасываются"""
+    global _polling
+    poll_controller.before_poll()
+    _polling = True
+    try:
+        return telegram_api.get_updates(offset, poll_timeout, poll_controller.limit, raise_errors=True)
+    finally:
+        _polling = False
+        slo.mark_poll()
+
+
+def run_polling_loop(offset):
+    """Одиночный режим: опрос и обработка в главном потоке"""
+    slo.set_poller(True)
+    while not stop_event.is_set():
+        try:
+            updates = poll_updates(offset)
+            # Пауза до следующего опроса: без паузы после полного пакета
+            delay = poll_controller.success(len(updates))
+            
+            if updates:
+                for update in updates:
+                    try:
+                        # Посторонняя переписка групп отбрасывается до любой обработки
+                        relevant = group_filter.filter_update(update)
+                        if relevant is not None:
+                            dispatch_update(relevant)
+                        increment("updates_processed")
+                        mark_update_handled()
+                            
+                    except Exception as e:
+                        logger.error(f"Ошибка обработки обновления: {e}")
+                        increment("updates_failed")
+                    
+                    finally:
+                        # Обновляем offset для следующего запроса
+                        offset = max(offset, update.update_id + 1)
+                        state.set_offset(offset)
+                    
+                    # Остальные обновления пакета придут заново после перезапуска
+                    if stop_event.is_set():
+                        break
+            
+            if delay:
+                stop_event.wait(delay)
+            
+        except ShutdownRequested:
+            break
+            
+        except Exception as e:
+            # Нарастающая пауза, после серии ошибок - предохранитель
+            stop_event.wait(poll_controller.failure(e))
+
+
+def run_queue_worker():
+    """Воркер реплики: обрабатывает обновления из общей очереди"""
+    while not stop_event.is_set():
+        try:
+            update = shared_store.claim_update()
+        except Exception as e:
+            logger.error(f"Ошибка чтения очереди обновлений: {e}")
+            stop_event.wait(1)
+            continue
         
-        logger.info("🔄 Начинаю получение сообщений...")
+        if update is None:
+            stop_event.wait(0.5)
+            continue
         
-        while True:
+        try:
+            dispatch_update(update)
+            increment("updates_processed")
+            mark_update_handled()
+        except Exception as e:
+            logger.error(f"Ошибка обработки обновления: {e}")
+            increment("updates_failed")
+        finally:
+            shared_store.complete_update(update.update_id)
+
+
+def run_scale_out_loop():
+    """Режим нескольких реплик: владелец аренды опрашивает Telegram, все реплики обрабатывают очередь"""
+    workers = [
+        Thread(target=run_queue_worker, name=f"queue-worker-{i}")
+        for i in range(WORKER_THREADS)
+    ]
+    for worker in workers:
+        worker.start()
+    
+    is_leader = False
+    last_purge = 0
+    
+    try:
+        while not stop_event.is_set():
             try:
-                updates = get_updates(offset)
+                if not shared_store.try_acquire_lease():
+                    if is_leader:
+                        logger.warning("⚠️ Аренда опроса потеряна")
+                        is_leader = False
+                        slo.set_poller(False)
+                    stop_event.wait(LEASE_TTL / 3)
+                    continue
+                
+                if not is_leader:
+                    logger.info("👑 Реплика получила аренду и опрашивает Telegram")
+                    is_leader = True
+                    slo.set_poller(True)
+                
+                # Long polling короче аренды, чтобы успеть ее продлить
+                offset = shared_store.get_offset()
+                updates = poll_updates(offset, poll_timeout=min(30, LEASE_TTL // 2))
+                delay = poll_controller.success(len(updates))
                 
                 if updates:
-                    for update in updates:
-                        try:
-                            # Обработка обычного сообщения
-                            if "message" in update:
-                                process_message(update["message"])
-                            
-                            # Обработка callback от кнопок
-                            elif "callback_query" in update:
-                                process_callback(update["callback_query"])
-                                
-                        except Exception as e:
-                            logger.error(f"Ошибка обработки обновления: {e}")
-                            continue
-                        
-                        # Обновляем offset для следующего запроса
-                        offset = max(offset, update.get('update_id', 0) + 1)
+                    offset = max(update.update_id for update in updates) + 1
+                    # Посторонняя переписка групп не попадает в общую очередь
+                    relevant = [
+                        kept for kept in map(group_filter.filter_update, updates) if kept is not None
+                    ]
+                    shared_store.enqueue_updates(relevant, offset)
+                    increment("updates_enqueued", len(relevant))
                 
-                # Небольшая пауза между запросами
-                time.sleep(0.1)
+                if time.time() - last_purge > 600:
+                    shared_store.purge_done_updates()
+                    last_purge = time.time()
                 
-            except KeyboardInterrupt:
-                logger.info("Получен сигнал остановки...")
+                if delay:
+                    stop_event.wait(delay)
+                
+            except ShutdownRequested:
                 break
                 
             except Exception as e:
-                logger.error(f"Ошибка в главном цикле: {e}")
-                # При ошибке ждем 5 секунд и продолжаем
-                time.sleep(5)
+                # Предохранитель дольше аренды отдает опрос другой реплике
+                stop_event.wait(poll_controller.failure(e))
+    
+    finally:
+        stop_event.set()
+        if is_leader:
+            shared_store.release_lease()
+        # Дожидаемся обновлений, которые воркеры уже обрабатывают
+        for worker in workers:
+            worker.join(timeout=30)
+
+
+def run_telegram_bot():
+    """Запуск Telegram бота"""
+    try:
+        logger.info("Запуск Telegram бота...")
+        
+        # Проверка подключения к Telegram идет параллельно с загрузкой индексов
+        wait_connection = check_connection_async()
+        load_bot_modules()
+        
+        # Восстанавливаем offset и кэши из снимка
+        offset = state.load_state()
+        
+        if not wait_connection():
+            raise Exception("Не удалось подключиться к Telegram API")
+        
+        state.start_snapshot_thread(stop_event)
+        outbox.start_workers(stop_event)
+        broadcast.start_runner(stop_event)
+        warmup.start_warmup_thread(stop_event)
+        
+        logger.info(f"📂 Базовая папка: {BASE_FOLDER}")
+        logger.info(f"🚀 Супер поиск активирован!")
+        
+        startup_ms = elapsed_ms()
+        set_value("startup_ms_to_ready", startup_ms)
+        bot_ready.set()
+        logger.info(f"🔄 Начинаю получение сообщений (готов через {startup_ms} мс)...")
+        
+        if SCALE_OUT:
+            run_scale_out_loop()
+        else:
+            run_polling_loop(offset)
     
     except Exception as e:
         logger.error(f"Критическая ошибка: {e}")
         raise
+    
+    finally:
+        stop_event.set()
+        if state and state.save_state():
+            logger.info(f"💾 Снимок состояния сохранен (offset={state.get_offset()})")
+
 
 def main():
     """Главная функция - запуск веб-сервера и Telegram бота"""
     logger.info("🚀 Запуск Homeline Telegram Bot...")
     
+    # Корректная остановка: дождаться текущего обновления и сохранить снимок
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
+    
     try:
         # Запуск Flask сервера в отдельном потоке
         flask_thread = Thread(target=run_flask, daemon=True)
         flask_thread.start()
-        logger.info(f"🌐 Веб-сервер запущен на порту {os.environ.get('PORT', 10000)}")
-        
-        # Даем время серверу запуститься
-        time.sleep(2)
         
         # Запуск Telegram бота в главном потоке
         run_telegram_bot()
@@ -127,6 +391,9 @@ def main():
     except Exception as e:
         logger.error(f"💥 Критическая ошибка при запуске: {e}")
         raise
+    
+    finally:
+        shutdown_logging()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Счетчики метрик бота
+"""
+
+import threading
+
+_lock = threading.Lock()
+_counters = {}
+
+# Значения текущего процесса (set_value): после перезапуска начинаются заново, из снимка не восстанавливаются
+PROCESS_GAUGES = frozenset((
+    "startup_ms_to_ready", "startup_ms_to_first_update", "warmup_queries", "poll_breaker_state",
+    "poll_consecutive_failures",
+))
+
+
+def increment(name, value=1):
+    """Увеличить счетчик"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_value(name, value):
+    """Установить значение метрики (например, время запуска)"""
+    with _lock:
+        _counters[name] = value
+
+
+def get_metrics():
+    """Получить копию всех счетчиков"""
+    with _lock:
+        return dict(_counters)
+
+
+def restore_metrics(data):
+    """Восстановить накопленные счетчики из снимка (значения этого процесса не трогаются)"""
+    with _lock:
+        gauges = {name: value for name, value in _counters.items() if name in PROCESS_GAUGES}
+        _counters.clear()
+        for name, value in (data or {}).items():
+            if isinstance(value, (int, float)) and name not in PROCESS_GAUGES:
+                _counters[name] = value
+        _counters.update(gauges)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Потоковое тело multipart/form-data для загрузки файлов
+
+Файл не собирается в памяти целиком: заголовки формируются заранее,
+содержимое читается в один переиспользуемый буфер и сразу уходит в сокет.
+Длина известна заранее, поэтому requests ставит Content-Length.
+"""
+
+import os
+import uuid
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _quote(value):
+    """Экранировать значение параметра заголовка Content-Disposition"""
+    return value.replace("\\", "\\\\").replace('"', "%22").replace("\r", "%0D").replace("\n", "%0A")
+
+
+class MultipartFileBody:
+    """Тело запроса с полями формы и файлами, читаемыми кусками
+
+    files - список (имя поля, путь, имя файла, content-type).
+    """
+    def __init__(self, fields, files):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+
+        head = []
+        for name, value in fields.items():
+            if value is None:
+                continue
+            head.append(
+                f'--{self.boundary}\r\n'
+                f'Content-Disposition: form-data; name="{_quote(name)}"\r\n\r\n'
+                f'{value}\r\n'
+            )
+
+        self._head = "".join(head).encode("utf-8")
+
+        # Части файлов: (заголовок части, путь, размер)
+        self._parts = []
+        for index, (field, file_path, filename, content_type) in enumerate(files):
+            part_head = (
+                ('\r\n' if index else '') +
+                f'--{self.boundary}\r\n'
+                f'Content-Disposition: form-data; name="{_quote(field)}"; filename="{_quote(filename)}"\r\n'
+                f'Content-Type: {content_type}\r\n\r\n'
+            )
+            self._parts.append((part_head.encode("utf-8"), file_path, os.path.getsize(file_path)))
+        self._tail = f"\r\n--{self.boundary}--\r\n".encode("utf-8")
+
+    def __len__(self):
+        files_length = sum(len(part_head) + size for part_head, _, size in self._parts)
+        return len(self._head) + files_length + len(self._tail)
+
+    def __iter__(self):
+        buffer = bytearray(CHUNK_SIZE)
+        view = memoryview(buffer)
+        yield self._head
+        for part_head, file_path, _ in self._parts:
+            yield part_head
+            with open(file_path, "rb") as f:
+                while True:
+                    read = f.readinto(buffer)
+                    if not read:
+                        break
+                    # Буфер переиспользуется: кусок уже отправлен к следующему readinto
+                    yield view[:read]
+        yield self._tail
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Очередь исходящих сообщений на диске (SQLite)
+
+Обработчики только ставят ответ в очередь, а отправляют его фоновые
+воркеры. Временные ошибки (сеть, 429, 5xx) повторяются с нарастающей
+паузой, retry_after от Telegram приостанавливает все воркеры. Одинаковые
+неотправленные сообщения схлопываются, очередь переживает перезапуск.
+Сообщения одного чата уходят строго по порядку. Для ответов на
+обновления замеряется время от начала обработки до доставки (slo.py).
+"""
+
+import hashlib
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+
+from config import (
+    OUTBOX_DB, OUTBOX_WORKERS, OUTBOX_MAX_ATTEMPTS, OUTBOX_MAX_BACKOFF, SCALE_OUT, REPLICA_ID,
+    OUTBOX_CLAIM_TIMEOUT, PREVIEW_BEFORE_DOCUMENT
+)
+from metrics import increment
+from previews import preview_path
+import slo
+import telegram_api
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    dedup_key TEXT NOT NULL UNIQUE,
+    chat_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    claimed_by TEXT,
+    claimed_at REAL,
+    received_at REAL,
+    update_type TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_chat ON outbox (chat_id, id);
+"""
+
+_local = threading.local()
+_wakeup = threading.Event()
+_pause_lock = threading.Lock()
+_paused_until = 0.0
+
+
+def _connect():
+    """Соединение с базой очереди (отдельное для каждого потока)"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(OUTBOX_DB, timeout=30, isolation_level=None)
+        if not SCALE_OUT:
+            # Локальный файл: короткие записи без полной синхронизации на каждую вставку
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        for column in ("received_at REAL", "update_type TEXT"):
+            try:
+                # Очередь, созданная до замеров задержки ответов
+                conn.execute(f"ALTER TABLE outbox ADD COLUMN {column}")
+            except sqlite3.OperationalError:
+                pass
+        _local.conn = conn
+    return conn
+
+
+def _deliver(kind, payload):
+    """Отправить сообщение очереди (временные ошибки выбрасываются)"""
+    chat_id = payload["chat_id"]
+    if kind == "message":
+        telegram_api.send_message(chat_id, payload["text"], payload.get("reply_markup"), raise_errors=True)
+    elif kind == "document":
+        telegram_api.send_document(
+            chat_id, payload["file_path"], payload["filename"], payload["caption"], raise_errors=True
+        )
+    elif kind == "photo":
+        telegram_api.send_photo(chat_id, payload["file_path"], payload["caption"], raise_errors=True)
+    elif kind == "media_group":
+        telegram_api.send_media_group(chat_id, payload["documents"], raise_errors=True)
+    else:
+        logger.error(f"Неизвестный тип сообщения в очереди: {kind}")
+
+
+def _notify_failure(kind, payload, error):
+    """Сообщить пользователю, что файл не отправлен (как при прямой отправке)"""
+    if getattr(error, "error_code", None) == 403:
+        # Бот заблокирован - сообщение тоже не дойдет
+        return
+    if kind == "document":
+        send_message(payload["chat_id"], f"❌ Ошибка отправки файла: {payload['filename']}")
+    elif kind == "media_group":
+        send_message(payload["chat_id"], "❌ Ошибка отправки файлов")
+
+
+def _enqueue(kind, payload):
+    """Поставить сообщение в очередь. Если база недоступна - отправить сразу"""
+    encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+    dedup_key = hashlib.sha1(f"{kind}\n{encoded}".encode("utf-8")).hexdigest()
+    # Ответ на обновление (рассылки и прогрев идут вне обработки обновлений)
+    received_at, update_type = slo.current_update() or (None, None)
+    try:
+        cursor = _connect().execute(
+            "INSERT OR IGNORE INTO outbox "
+            "(dedup_key, chat_id, kind, payload, next_attempt, received_at, update_type) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (dedup_key, str(payload["chat_id"]), kind, encoded, time.time(), received_at, update_type)
+        )
+    except sqlite3.Error as e:
+        logger.error(f"Очередь исходящих недоступна, отправляем сразу: {e}")
+        if _deliver_now(kind, payload):
+            slo.observe_reply(received_at, update_type)
+        return
+    if cursor.rowcount:
+        increment("outbox_queued")
+        _wakeup.set()
+    else:
+        # Такое же сообщение еще ждет отправки
+        increment("outbox_duplicates")
+
+
+def _deliver_now(kind, payload):
+    """Синхронная отправка в обход очереди. True - отправлено"""
+    try:
+        _deliver(kind, payload)
+        return True
+    except Exception as e:
+        logger.warning(f"Не удалось отправить {kind} в чат {payload['chat_id']}: {e}")
+        _notify_failure(kind, payload, e)
+        return False
+
+
+def send_message(chat_id, text, reply_markup=None):
+    """Поставить текстовое сообщение в очередь"""
+    _enqueue("message", {"chat_id": chat_id, "text": text, "reply_markup": reply_markup})
+
+
+def send_document(chat_id, file_path, filename, caption="", preview=False):
+    """Поставить отправку PDF в очередь
+
+    preview - сначала отправить готовое превью первой страницы: оно весит
+    в десятки раз меньше PDF и видно сразу, документ уходит следом.
+    Если PDF уже загружен (есть file_id), он уходит мгновенно и превью не нужно
+    """
+    if preview and PREVIEW_BEFORE_DOCUMENT and not telegram_api.get_cached_file_id(file_path):
+        image_path = preview_path(file_path)
+        if image_path:
+            increment("previews_queued")
+            send_photo(chat_id, image_path, f"{caption}\n👀 Первая страница, PDF отправляется следом".strip())
+    _enqueue("document", {"chat_id": chat_id, "file_path": file_path, "filename": filename, "caption": caption})
+
+
+def send_photo(chat_id, file_path, caption=""):
+    """Поставить отправку изображения в очередь"""
+    _enqueue("photo", {"chat_id": chat_id, "file_path": file_path, "caption": caption})
+
+
+def send_media_group(chat_id, documents):
+    """Поставить альбом документов (путь, имя файла, подпись) в очередь"""
+    _enqueue("media_group", {"chat_id": chat_id, "documents": [list(document) for document in documents]})
+
+
+def _claim():
+    """Забрать самое старое готовое сообщение, перед которым в его чате ничего не ждет"""
+    conn = _connect()
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT id, kind, payload, attempts, received_at, update_type FROM outbox AS o "
+            "WHERE next_attempt <= ? AND (claimed_by IS NULL OR claimed_at < ?) "
+            "AND NOT EXISTS (SELECT 1 FROM outbox AS p WHERE p.chat_id = o.chat_id AND p.id < o.id) "
+            "ORDER BY id LIMIT 1",
+            (now, now - OUTBOX_CLAIM_TIMEOUT)
+        ).fetchone()
+        if row:
+            conn.execute(
+                "UPDATE outbox SET claimed_by = ?, claimed_at = ? WHERE id = ?", (REPLICA_ID, now, row[0])
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return row
+
+
+def _pause(seconds):
+    """Приостановить все воркеры (ответ 429 с retry_after)"""
+    global _paused_until
+    with _pause_lock:
+        _paused_until = max(_paused_until, time.time() + seconds)
+
+
+def _process(row):
+    """Отправить сообщение и удалить его из очереди или назначить повтор"""
+    item_id, kind, payload, attempts, received_at, update_type = row
+    payload = json.loads(payload)
+    try:
+        _deliver(kind, payload)
+    except Exception as e:
+        attempts += 1
+        if not telegram_api.is_retryable(e) or attempts >= OUTBOX_MAX_ATTEMPTS:
+            logger.warning(f"Сообщение {kind} #{item_id} не отправлено (попыток: {attempts}): {e}")
+            increment("outbox_dropped")
+            _connect().execute("DELETE FROM outbox WHERE id = ?", (item_id,))
+            _notify_failure(kind, payload, e)
+            return
+
+        retry_after = getattr(e, "retry_after", None) or 0
+        if retry_after:
+            _pause(retry_after)
+        delay = max(retry_after, min(OUTBOX_MAX_BACKOFF, 2 ** attempts) * random.uniform(0.5, 1.0))
+        logger.warning(f"Повтор {kind} #{item_id} через {delay:.1f} с (попытка {attempts}): {e}")
+        increment("outbox_retries")
+        _connect().execute(
+            "UPDATE outbox SET attempts = ?, next_attempt = ?, claimed_by = NULL WHERE id = ?",
+            (attempts, time.time() + delay, item_id)
+        )
+        return
+
+    increment("outbox_sent")
+    slo.observe_reply(received_at, update_type)
+    _connect().execute("DELETE FROM outbox WHERE id = ?", (item_id,))
+
+
+def _worker(stop_event):
+    """Цикл воркера отправки"""
+    while not stop_event.is_set():
+        pause = _paused_until - time.time()
+        if pause > 0:
+            stop_event.wait(pause)
+            continue
+
+        _wakeup.clear()
+        try:
+            row = _claim()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка чтения очереди исходящих: {e}")
+            stop_event.wait(1)
+            continue
+
+        if row is None:
+            # Новое сообщение будит воркер сразу, отложенные повторы проверяются раз в секунду
+            _wakeup.wait(1)
+            continue
+
+        try:
+            _process(row)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка обновления очереди исходящих: {e}")
+
+
+def pending_count():
+    """Сообщений в очереди"""
+    return _connect().execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+
+def start_workers(stop_event):
+    """Запустить воркеры отправки"""
+    if not SCALE_OUT:
+        # Сообщения, взятые до перезапуска этим же процессом, снова доступны сразу
+        _connect().execute("UPDATE outbox SET claimed_by = NULL WHERE claimed_by IS NOT NULL")
+    pending = pending_count()
+    if pending:
+        logger.info(f"📤 В очереди исходящих после перезапуска: {pending}")
+
+    threads = []
+    for i in range(OUTBOX_WORKERS):
+        thread = threading.Thread(target=_worker, args=(stop_event,), name=f"outbox-{i}", daemon=True)
+        thread.start()
+        threads.append(thread)
+    return threads
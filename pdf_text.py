@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Извлечение текста PDF каталога по страницам (разделам)
+
+Текст извлекается один раз и хранится в SEARCH_INDEX_DIR/sections.json.
+Файл пересобирается, если какой-либо PDF, config.py, TENANTS_FILE или
+код индексов новее него. Без pypdf разделы состоят только из описаний
+документов.
+
+Разделы привязаны к содержимому файла (file_store.content_key), а не к
+имени: PDF, общий для нескольких филиалов, извлекается и индексируется
+один раз.
+"""
+
+import json
+import logging
+import os
+import re
+
+from config import SEARCH_INDEX_DIR, TENANTS_FILE
+from catalog import get_documents
+from file_store import content_key
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+logger = logging.getLogger(__name__)
+
+SECTIONS_FILE = os.path.join(SEARCH_INDEX_DIR, "sections.json")
+_DIR = os.path.dirname(os.path.abspath(__file__))
+# Изменение описаний документов или формата индексов тоже требует пересборки
+SOURCE_FILES = [
+    os.path.join(_DIR, name) for name in ("config.py", "pdf_text.py", "vector_search.py", "snippets.py")
+] + [TENANTS_FILE]
+
+_WHITESPACE = re.compile(r"[ \t\r\f\v]+")
+
+
+def catalog_documents():
+    """Уникальные по содержимому файлы каталогов всех филиалов: (ключ, документ)"""
+    seen = set()
+    for document in get_documents():
+        key = content_key(document.path)
+        if key not in seen:
+            seen.add(key)
+            yield key, document
+
+
+def sources_mtime():
+    """Время изменения самого свежего источника индекса"""
+    paths = SOURCE_FILES + [document.path for document in get_documents()]
+    return max((os.path.getmtime(path) for path in paths if os.path.exists(path)), default=0)
+
+
+def is_stale(path):
+    """Файл индекса отсутствует или старше источников"""
+    return not os.path.exists(path) or os.path.getmtime(path) < sources_mtime()
+
+
+def extract_pages(path):
+    """Текст каждой страницы PDF"""
+    if PdfReader is None or not os.path.exists(path):
+        return []
+    try:
+        reader = PdfReader(path)
+        pages = []
+        for page in reader.pages:
+            text = page.extract_text() or ""
+            lines = (_WHITESPACE.sub(" ", line).strip() for line in text.splitlines())
+            pages.append("\n".join(line for line in lines if line))
+        return pages
+    except Exception as e:
+        logger.error(f"Не удалось извлечь текст из {path}: {e}")
+        return []
+
+
+def build_sections():
+    """Собрать разделы всех документов и сохранить на диск"""
+    if PdfReader is None:
+        logger.warning("pypdf не установлен - индексируются только описания документов")
+
+    sections = []
+    descriptions = set()
+    for document in get_documents():
+        # Описание документа - отдельный раздел (страница 0); у общего файла их может быть несколько
+        key = content_key(document.path)
+        if (key, document.description) not in descriptions:
+            descriptions.add((key, document.description))
+            sections.append({"key": key, "page": 0, "text": document.description})
+    for key, document in catalog_documents():
+        for page_number, text in enumerate(extract_pages(document.path), start=1):
+            if text:
+                sections.append({"key": key, "page": page_number, "text": text})
+
+    os.makedirs(SEARCH_INDEX_DIR, exist_ok=True)
+    tmp_path = f"{SECTIONS_FILE}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(sections, f, ensure_ascii=False)
+    os.replace(tmp_path, SECTIONS_FILE)
+    logger.info(f"📑 Извлечено разделов PDF: {len(sections)}")
+    return sections
+
+
+def load_sections():
+    """Разделы документов (пересобираются при изменении источников)"""
+    if is_stale(SECTIONS_FILE):
+        return build_sections()
+    with open(SECTIONS_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Адаптивный темп опроса getUpdates с предохранителем
+
+После полного пакета (GET_UPDATES_LIMIT обновлений) следующий запрос
+идет сразу - в очереди Telegram наверняка есть еще. После неполного -
+короткая пауза POLL_IDLE_DELAY. Ошибки (сеть, 5xx, 429, 409) дают
+экспоненциальную паузу со случайным разбросом, а POLL_BREAKER_THRESHOLD
+ошибок подряд размыкают предохранитель: опрос приостанавливается на
+время охлаждения, затем делается одна пробная попытка. Удачная замыкает
+предохранитель, неудачная снова размыкает его на вдвое большее время.
+"""
+
+import logging
+import random
+import threading
+import time
+
+from config import (
+    GET_UPDATES_LIMIT, POLL_IDLE_DELAY, POLL_BACKOFF_BASE, POLL_BACKOFF_MAX, POLL_BREAKER_THRESHOLD,
+    POLL_BREAKER_COOLDOWN, POLL_BREAKER_MAX_COOLDOWN
+)
+from metrics import increment, set_value
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Состояние предохранителя в метриках (метрики только числовые)
+STATE_CODES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class PollController:
+    """Пауза перед следующим getUpdates и состояние предохранителя"""
+
+    def __init__(self, limit=GET_UPDATES_LIMIT):
+        self.limit = limit
+        self.state = CLOSED
+        self.failures = 0  # Ошибок подряд
+        self.trips = 0  # Срабатываний предохранителя подряд (без удачного опроса между ними)
+        self.open_until = 0.0
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def before_poll(self):
+        """Перед запросом: разомкнутый предохранитель после охлаждения пропускает одну пробу"""
+        with self._lock:
+            if self.state == OPEN and time.time() >= self.open_until:
+                self._set_state(HALF_OPEN)
+                logger.info("🔌 Пробный запрос getUpdates после паузы предохранителя")
+
+    def success(self, batch_size):
+        """Запрос удался. Возвращает паузу перед следующим (секунды)"""
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info(f"✅ Опрос Telegram восстановлен после {self.failures} ошибок")
+                self._set_state(CLOSED)
+            self.failures = 0
+            self.trips = 0
+            self.last_error = None
+            set_value("poll_consecutive_failures", 0)
+        if batch_size >= self.limit:
+            increment("poll_full_batches")
+            return 0
+        return POLL_IDLE_DELAY
+
+    def failure(self, error):
+        """Запрос не удался. Возвращает паузу перед следующим (секунды)"""
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error)[:200]
+            increment("poll_errors")
+            set_value("poll_consecutive_failures", self.failures)
+
+            if self.state == HALF_OPEN or self.failures >= POLL_BREAKER_THRESHOLD:
+                self.trips += 1
+                cooldown = min(POLL_BREAKER_MAX_COOLDOWN, POLL_BREAKER_COOLDOWN * 2 ** (self.trips - 1))
+                cooldown = max(cooldown, getattr(error, "retry_after", None) or 0)
+                self.open_until = time.time() + cooldown
+                self._set_state(OPEN)
+                increment("poll_breaker_trips")
+                logger.error(
+                    f"⛔ Предохранитель опроса разомкнут на {cooldown} с после {self.failures} ошибок подряд: {error}"
+                )
+                return cooldown
+
+            delay = min(POLL_BACKOFF_MAX, POLL_BACKOFF_BASE * 2 ** (self.failures - 1)) * random.uniform(0.5, 1.0)
+            # Пауза от Telegram (429) важнее собственной оценки
+            delay = max(delay, getattr(error, "retry_after", None) or 0)
+            logger.warning(f"Ошибка опроса ({self.failures} подряд), повтор через {delay:.1f} с: {error}")
+            return delay
+
+    def _set_state(self, state):
+        """Сменить состояние (вызывается под _lock)"""
+        self.state = state
+        set_value("poll_breaker_state", STATE_CODES[state])
+
+    def status(self):
+        """Состояние для /health"""
+        with self._lock:
+            status = {"state": self.state, "consecutive_failures": self.failures, "last_error": self.last_error}
+            if self.state == OPEN:
+                status["retry_in_s"] = round(max(0.0, self.open_until - time.time()), 1)
+            return status
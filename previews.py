@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Превью первой страницы PDF каталога
+
+Первая страница каждого документа заранее рисуется в сжатый JPEG
+(PREVIEW_WIDTH точек по ширине) и хранится в PREVIEWS_DIR под ключом
+содержимого PDF, так что общий для филиалов файл рисуется один раз,
+а измененный PDF получает новое превью. Бот только отправляет готовые
+превью перед документом и никогда не рисует их на пути запроса.
+
+Нужны pypdfium2 и Pillow; без них превью не создаются и документы
+отправляются как раньше.
+
+Сборка: python previews.py
+"""
+
+import logging
+import os
+
+from config import PREVIEWS_DIR, PREVIEW_WIDTH, PREVIEW_QUALITY
+from file_store import content_digest
+import pdf_text
+
+try:
+    import pypdfium2
+except ImportError:
+    pypdfium2 = None
+
+logger = logging.getLogger(__name__)
+
+
+def preview_path(pdf_path):
+    """Путь к превью PDF или None, если превью нет"""
+    try:
+        path = os.path.join(PREVIEWS_DIR, f"{content_digest(pdf_path)}.jpg")
+    except OSError:
+        return None
+    return path if os.path.exists(path) else None
+
+
+def render_preview(pdf_path, path):
+    """Нарисовать первую страницу PDF в JPEG"""
+    document = pypdfium2.PdfDocument(pdf_path)
+    try:
+        page = document[0]
+        scale = PREVIEW_WIDTH / page.get_width()
+        image = page.render(scale=scale).to_pil().convert("RGB")
+    finally:
+        document.close()
+    tmp_path = f"{path}.tmp"
+    image.save(tmp_path, "JPEG", quality=PREVIEW_QUALITY, optimize=True, progressive=True)
+    os.replace(tmp_path, path)
+
+
+def build_previews():
+    """Создать недостающие превью и удалить превью старых версий PDF"""
+    if pypdfium2 is None:
+        logger.warning("pypdfium2 не установлен - превью документов не создаются")
+        return 0
+
+    os.makedirs(PREVIEWS_DIR, exist_ok=True)
+    wanted = set()
+    rendered = 0
+    for key, document in pdf_text.catalog_documents():
+        if key.startswith("missing:"):
+            continue
+        name = f"{key}.jpg"
+        wanted.add(name)
+        path = os.path.join(PREVIEWS_DIR, name)
+        if os.path.exists(path):
+            continue
+        try:
+            render_preview(document.path, path)
+            rendered += 1
+            logger.info(f"🖼️ {document.filename}: {os.path.getsize(path) // 1024} КБ")
+        except Exception as e:
+            logger.error(f"Не удалось нарисовать превью {document.path}: {e}")
+
+    for name in os.listdir(PREVIEWS_DIR):
+        if name.endswith(".jpg") and name not in wanted:
+            os.remove(os.path.join(PREVIEWS_DIR, name))
+    logger.info(f"🖼️ Превью: новых {rendered}, всего {len(wanted)}")
+    return rendered
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    build_previews()
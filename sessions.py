@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сессии пользователей: недавние и закрепленные документы, выбранный филиал
+
+В памяти держится не больше SESSION_CACHE_SIZE сессий (LRU), изменения
+пишутся в SQLite пачкой вместе со снимком состояния.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from config import SESSIONS_DB, SESSION_CACHE_SIZE, RECENT_DOCUMENTS, PINNED_DOCUMENTS
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.RLock()
+_sessions = OrderedDict()
+_dirty = {}
+_conn = None
+
+
+class Session:
+    """Компактная запись сессии чата (имена файлов документов)"""
+    __slots__ = ("chat_id", "recent", "pinned", "tenant")
+
+    def __init__(self, chat_id, recent=(), pinned=(), tenant=None):
+        self.chat_id = chat_id
+        self.recent = list(recent)
+        self.pinned = list(pinned)
+        self.tenant = tenant
+
+
+def _connect():
+    """Соединение с базой сессий (вызывается под _lock)"""
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(SESSIONS_DB, timeout=30, check_same_thread=False)
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "chat_id INTEGER PRIMARY KEY, recent TEXT NOT NULL, pinned TEXT NOT NULL, tenant TEXT)"
+        )
+        try:
+            # База, созданная до появления филиалов
+            _conn.execute("ALTER TABLE sessions ADD COLUMN tenant TEXT")
+        except sqlite3.OperationalError:
+            pass
+    return _conn
+
+
+def _load(chat_id):
+    """Загрузить сессию из базы или создать новую"""
+    try:
+        row = _connect().execute(
+            "SELECT recent, pinned, tenant FROM sessions WHERE chat_id = ?", (chat_id,)
+        ).fetchone()
+    except sqlite3.Error as e:
+        logger.error(f"Не удалось прочитать сессию {chat_id}: {e}")
+        row = None
+    if row:
+        return Session(chat_id, json.loads(row[0]), json.loads(row[1]), row[2])
+    return Session(chat_id)
+
+
+def get_session(chat_id):
+    """Сессия чата (самая свежая переносится в конец LRU)"""
+    with _lock:
+        session = _sessions.get(chat_id)
+        if session is None:
+            session = _dirty.get(chat_id) or _load(chat_id)
+            _sessions[chat_id] = session
+            if len(_sessions) > SESSION_CACHE_SIZE:
+                # Вытесненная сессия остается в _dirty до ближайшей записи
+                _sessions.popitem(last=False)
+        else:
+            _sessions.move_to_end(chat_id)
+        return session
+
+
+def record_open(chat_id, filename):
+    """Запомнить открытый документ"""
+    with _lock:
+        session = get_session(chat_id)
+        if session.recent[:1] == [filename]:
+            return
+        if filename in session.recent:
+            session.recent.remove(filename)
+        session.recent.insert(0, filename)
+        del session.recent[RECENT_DOCUMENTS:]
+        _dirty[chat_id] = session
+
+
+def toggle_pin(chat_id, filename):
+    """Закрепить или открепить документ. True - документ закреплен"""
+    with _lock:
+        session = get_session(chat_id)
+        if filename in session.pinned:
+            session.pinned.remove(filename)
+            pinned = False
+        else:
+            session.pinned.insert(0, filename)
+            del session.pinned[PINNED_DOCUMENTS:]
+            pinned = True
+        _dirty[chat_id] = session
+        return pinned
+
+
+def set_tenant(chat_id, tenant):
+    """Запомнить филиал, выбранный в чате"""
+    with _lock:
+        session = get_session(chat_id)
+        session.tenant = tenant
+        _dirty[chat_id] = session
+
+
+def flush():
+    """Записать измененные сессии одной транзакцией"""
+    with _lock:
+        if not _dirty:
+            return 0
+        rows = [
+            (session.chat_id, json.dumps(session.recent, ensure_ascii=False),
+             json.dumps(session.pinned, ensure_ascii=False), session.tenant)
+            for session in _dirty.values()
+        ]
+        try:
+            with _connect() as conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO sessions (chat_id, recent, pinned, tenant) VALUES (?, ?, ?, ?)", rows
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Не удалось сохранить сессии: {e}")
+            return 0
+        _dirty.clear()
+        return len(rows)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Общее хранилище для нескольких реплик бота (SQLite на общем диске)
+
+Одна реплика держит аренду и опрашивает getUpdates, обновления попадают
+в общую очередь, а обрабатывают их воркеры всех реплик.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+
+from config import SHARED_DB_PATH, REPLICA_ID, LEASE_TTL, CLAIM_TIMEOUT
+import updates as update_records
+
+logger = logging.getLogger(__name__)
+
+POLLER_LEASE = "poller"
+
+_local = threading.local()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS updates (
+    update_id INTEGER PRIMARY KEY,
+    payload TEXT NOT NULL,
+    claimed_by TEXT,
+    claimed_at REAL,
+    done INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS kv (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS file_ids (
+    digest TEXT PRIMARY KEY,
+    file_id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS usage_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    action TEXT NOT NULL
+);
+"""
+
+
+def _connect():
+    """Соединение с общей базой (отдельное для каждого потока)"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(SHARED_DB_PATH, timeout=30, isolation_level=None)
+        conn.executescript(SCHEMA)
+        _local.conn = conn
+    return conn
+
+
+def try_acquire_lease(name=POLLER_LEASE):
+    """Захватить или продлить аренду. True - эта реплика владелец"""
+    conn = _connect()
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT holder, expires_at FROM leases WHERE name = ?", (name,)).fetchone()
+        if row is None or row[0] == REPLICA_ID or row[1] < now:
+            conn.execute(
+                "INSERT OR REPLACE INTO leases (name, holder, expires_at) VALUES (?, ?, ?)",
+                (name, REPLICA_ID, now + LEASE_TTL)
+            )
+            acquired = True
+        else:
+            acquired = False
+        conn.execute("COMMIT")
+        return acquired
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def release_lease(name=POLLER_LEASE):
+    """Освободить аренду при остановке"""
+    _connect().execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, REPLICA_ID))
+
+
+def get_offset():
+    """Общий offset getUpdates"""
+    row = _connect().execute("SELECT value FROM kv WHERE key = 'offset'").fetchone()
+    return int(row[0]) if row else 0
+
+
+def enqueue_updates(updates, offset):
+    """Положить обновления в очередь и сдвинуть offset одной транзакцией"""
+    conn = _connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany(
+            "INSERT OR IGNORE INTO updates (update_id, payload) VALUES (?, ?)",
+            [(update.update_id, update_records.dumps(update)) for update in updates]
+        )
+        conn.execute("INSERT OR REPLACE INTO kv (key, value) VALUES ('offset', ?)", (str(offset),))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def claim_update():
+    """Забрать следующее необработанное обновление из очереди"""
+    conn = _connect()
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT update_id, payload FROM updates "
+            "WHERE done = 0 AND (claimed_by IS NULL OR claimed_at < ?) "
+            "ORDER BY update_id LIMIT 1",
+            (now - CLAIM_TIMEOUT,)
+        ).fetchone()
+        if row:
+            conn.execute(
+                "UPDATE updates SET claimed_by = ?, claimed_at = ? WHERE update_id = ?",
+                (REPLICA_ID, now, row[0])
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return update_records.loads(row[1]) if row else None
+
+
+def complete_update(update_id):
+    """Отметить обновление обработанным"""
+    _connect().execute("UPDATE updates SET done = 1 WHERE update_id = ?", (update_id,))
+
+
+def purge_done_updates(keep_seconds=3600):
+    """Удалить давно обработанные обновления"""
+    _connect().execute(
+        "DELETE FROM updates WHERE done = 1 AND claimed_at < ?",
+        (time.time() - keep_seconds,)
+    )
+
+
+def get_file_id(digest):
+    """file_id документа из общего кэша"""
+    row = _connect().execute("SELECT file_id FROM file_ids WHERE digest = ?", (digest,)).fetchone()
+    return row[0] if row else None
+
+
+def set_file_id(digest, file_id):
+    """Сохранить file_id в общий кэш"""
+    _connect().execute(
+        "INSERT OR REPLACE INTO file_ids (digest, file_id) VALUES (?, ?)", (digest, file_id)
+    )
+
+
+def delete_file_id(digest):
+    """Удалить устаревший file_id"""
+    _connect().execute("DELETE FROM file_ids WHERE digest = ?", (digest,))
+
+
+def log_usage(timestamp, user_id, action):
+    """Записать событие статистики в общий журнал"""
+    _connect().execute(
+        "INSERT INTO usage_log (ts, user_id, action) VALUES (?, ?, ?)",
+        (timestamp, str(user_id), action)
+    )
+
+
+def iter_usage(batch_size=1000):
+    """Постранично читать общий журнал статистики: (ts, user_id, action)"""
+    last_id = 0
+    while True:
+        rows = _connect().execute(
+            "SELECT id, ts, user_id, action FROM usage_log WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, batch_size)
+        ).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            yield row[1], row[2], row[3]
+        last_id = rows[-1][0]
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Задержки обработки обновлений и проверка SLO
+
+Для каждого обновления замеряются:
+- lag - от даты сообщения в Telegram до начала обработки;
+- processing - время обработки;
+- reply - от начала обработки до доставки ответа (каждого сообщения из очереди).
+
+Замеры по типам обновлений (message, callback_query) хранятся в
+скользящих скетчах: логарифмические корзины с точностью около 2.5%,
+разбитые на интервалы, так что старые замеры выпадают из окна SLO_WINDOW
+без хранения самих значений. Вместе с давностью последнего getUpdates
+это дает статус /health: ok или degraded.
+"""
+
+import math
+import threading
+import time
+from collections import deque
+
+from config import (
+    SLO_WINDOW, SLO_LAG_P95_MS, SLO_PROCESSING_P95_MS, SLO_REPLY_P95_MS, SLO_MIN_SAMPLES, SLO_POLL_MAX_AGE
+)
+
+# Основание логарифмических корзин: значение корзины отличается от замера не больше чем на ~2.5%
+GAMMA = 1.05
+_LOG_GAMMA = math.log(GAMMA)
+
+# Интервалов в окне: замеры выпадают из окна порциями по SLO_WINDOW / SLOTS секунд
+SLOTS = 10
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Пороги p95 по видам замеров
+SLO_P95_MS = {"lag": SLO_LAG_P95_MS, "processing": SLO_PROCESSING_P95_MS, "reply": SLO_REPLY_P95_MS}
+
+_lock = threading.Lock()
+_sketches = {}  # (вид замера, тип обновления) -> RollingSketch
+_local = threading.local()
+_last_poll = None
+_poller = False
+
+
+class RollingSketch:
+    """Скользящий перцентильный скетч миллисекундных замеров"""
+    __slots__ = ("slot_seconds", "slots")
+
+    def __init__(self, window=SLO_WINDOW, slots=SLOTS):
+        self.slot_seconds = window / slots
+        # (номер интервала, {корзина: число замеров})
+        self.slots = deque(maxlen=slots)
+
+    def add(self, value_ms, now):
+        """Добавить замер"""
+        slot = int(now // self.slot_seconds)
+        if not self.slots or self.slots[-1][0] != slot:
+            self.slots.append((slot, {}))
+        buckets = self.slots[-1][1]
+        bucket = math.ceil(math.log(value_ms) / _LOG_GAMMA) if value_ms > 1 else 0
+        buckets[bucket] = buckets.get(bucket, 0) + 1
+
+    def quantiles(self, now, quantiles=QUANTILES):
+        """Число замеров в окне и значения перцентилей (мс)"""
+        oldest = int(now // self.slot_seconds) - self.slots.maxlen
+        merged = {}
+        for slot, buckets in self.slots:
+            if slot > oldest:
+                for bucket, count in buckets.items():
+                    merged[bucket] = merged.get(bucket, 0) + count
+        total = sum(merged.values())
+        if not total:
+            return 0, [None] * len(quantiles)
+
+        values = []
+        ordered = sorted(merged.items())
+        for quantile in quantiles:
+            rank = quantile * (total - 1)
+            seen = 0
+            for bucket, count in ordered:
+                seen += count
+                if seen > rank:
+                    break
+            values.append(round(GAMMA ** bucket, 1) if bucket else 1.0)
+        return total, values
+
+
+def observe(kind, update_type, value_ms, now=None):
+    """Записать замер вида kind (lag, processing, reply)"""
+    now = time.time() if now is None else now
+    with _lock:
+        sketch = _sketches.get((kind, update_type))
+        if sketch is None:
+            sketch = _sketches[(kind, update_type)] = RollingSketch()
+        sketch.add(max(value_ms, 0), now)
+
+
+def begin_update(update):
+    """Начало обработки обновления: замер lag и контекст для ответов из этого потока"""
+    now = time.time()
+    kind = update.kind
+    if update.message is not None and update.message.date:
+        observe("lag", kind, (now - update.message.date) * 1000, now)
+    _local.current = (now, kind)
+    return now
+
+
+def end_update(started):
+    """Конец обработки обновления"""
+    current = getattr(_local, "current", None)
+    _local.current = None
+    if current is not None:
+        observe("processing", current[1], (time.time() - started) * 1000)
+
+
+def current_update():
+    """(время начала обработки, тип) обновления, которое обрабатывает этот поток, или None"""
+    return getattr(_local, "current", None)
+
+
+def observe_reply(received_at, kind):
+    """Ответ на обновление доставлен"""
+    if received_at:
+        observe("reply", kind, (time.time() - received_at) * 1000)
+
+
+def mark_poll():
+    """getUpdates завершился (успешно или нет - цикл опроса жив)"""
+    global _last_poll
+    _last_poll = time.time()
+
+
+def set_poller(active):
+    """Этот процесс опрашивает Telegram (в SCALE_OUT - только владелец аренды)"""
+    global _poller
+    if active and not _poller:
+        # Отсчет с начала опроса, иначе зависший первый getUpdates не заметен
+        mark_poll()
+    _poller = active
+
+
+def health():
+    """Статус, перцентили и нарушения SLO для /health"""
+    now = time.time()
+    with _lock:
+        items = sorted(_sketches.items())
+        report = {}
+        breaches = []
+        for (kind, kind_type), sketch in items:
+            count, values = sketch.quantiles(now)
+            if not count:
+                continue
+            entry = {"count": count}
+            entry.update(
+                (f"p{int(quantile * 100)}_ms", value) for quantile, value in zip(QUANTILES, values)
+            )
+            report.setdefault(kind, {})[kind_type] = entry
+            p95 = values[QUANTILES.index(0.95)]
+            if count >= SLO_MIN_SAMPLES and p95 > SLO_P95_MS[kind]:
+                breaches.append(f"{kind}.{kind_type}.p95 {p95:.0f} > {SLO_P95_MS[kind]} мс")
+
+    poll_age = None if _last_poll is None else round(now - _last_poll, 1)
+    if _poller and poll_age is not None and poll_age > SLO_POLL_MAX_AGE:
+        breaches.append(f"getUpdates {poll_age:.0f} с назад > {SLO_POLL_MAX_AGE} с")
+
+    return {
+        "status": "degraded" if breaches else "ok",
+        "polling": _poller,
+        "seconds_since_poll": poll_age,
+        "breaches": breaches,
+        "latency": report,
+    }
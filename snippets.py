@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Короткие фрагменты текста PDF для мгновенного ответа на поиск
+
+Фрагменты (по SNIPPET_LINES строк подряд) нарезаются из разделов
+pdf_text один раз и хранятся в SEARCH_INDEX_DIR/snippets.json. На запрос
+выбираются фрагменты найденных документов с наибольшим числом слов
+запроса, совпадения выделяются жирным, остальной текст экранируется.
+Фрагменты общего для нескольких филиалов PDF хранятся один раз.
+"""
+
+import html
+import json
+import logging
+import os
+import re
+import threading
+
+from config import SEARCH_INDEX_DIR, SNIPPET_LINES, SNIPPET_MAX_LENGTH, SNIPPET_MAX_RESULTS
+from catalog import find_document
+from file_store import content_key
+from keyword_search import query_variants
+from metrics import increment
+from tenants import DEFAULT_TENANT
+import pdf_text
+
+logger = logging.getLogger(__name__)
+
+SNIPPETS_FILE = os.path.join(SEARCH_INDEX_DIR, "snippets.json")
+
+# Слова запроса сравниваются по началу, чтобы не зависеть от окончаний
+STEM_LENGTH = 5
+MIN_TERM_LENGTH = 3
+STOP_WORDS = {"как", "что", "где", "для", "нет", "или", "при", "это", "the", "and"}
+
+_WORD = re.compile(r"\w+")
+
+_lock = threading.Lock()
+_snippets = None  # ключ содержимого файла -> [(страница, текст, текст в нижнем регистре)]
+
+
+def _normalize(text):
+    """Нижний регистр без "ё" (длина строки не меняется)"""
+    return text.lower().replace("ё", "е")
+
+
+def build_snippets():
+    """Нарезать страницы PDF на фрагменты и сохранить на диск"""
+    snippets = []
+    for section in pdf_text.load_sections():
+        if section["page"] == 0:
+            # Описание документа и так видно на кнопке
+            continue
+        lines = section["text"].splitlines()
+        for start in range(0, len(lines), SNIPPET_LINES):
+            text = "\n".join(lines[start:start + SNIPPET_LINES])
+            snippets.append({"key": section["key"], "page": section["page"], "text": text})
+
+    os.makedirs(SEARCH_INDEX_DIR, exist_ok=True)
+    tmp_path = f"{SNIPPETS_FILE}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(snippets, f, ensure_ascii=False)
+    os.replace(tmp_path, SNIPPETS_FILE)
+    logger.info(f"📝 Подготовлено фрагментов: {len(snippets)}")
+    return snippets
+
+
+def load_snippets():
+    """Загрузить фрагменты, при необходимости пересобрав их"""
+    global _snippets
+    with _lock:
+        if pdf_text.is_stale(SNIPPETS_FILE):
+            snippets = build_snippets()
+        else:
+            with open(SNIPPETS_FILE, "r", encoding="utf-8") as f:
+                snippets = json.load(f)
+
+        by_key = {}
+        for snippet in snippets:
+            by_key.setdefault(snippet["key"], []).append(
+                (snippet["page"], snippet["text"], _normalize(snippet["text"]))
+            )
+        _snippets = by_key
+    return bool(by_key)
+
+
+def _query_stems(keyword):
+    """Основы слов запроса и его вариантов в другой раскладке или транслите"""
+    stems = set()
+    for text in [keyword] + query_variants(keyword):
+        for word in _WORD.findall(_normalize(text)):
+            if len(word) >= MIN_TERM_LENGTH and word not in STOP_WORDS:
+                stems.add(word[:STEM_LENGTH])
+    return stems
+
+
+def _highlight(text, normalized, pattern):
+    """Экранировать текст и выделить слова, начинающиеся с основ запроса"""
+    suffix = ""
+    if len(text) > SNIPPET_MAX_LENGTH:
+        text = text[:SNIPPET_MAX_LENGTH].rstrip()
+        suffix = "…"
+    parts = []
+    position = 0
+    for match in pattern.finditer(normalized, 0, len(text)):
+        parts.append(html.escape(text[position:match.start()]))
+        parts.append(f"<b>{html.escape(text[match.start():match.end()])}</b>")
+        position = match.end()
+    parts.append(html.escape(text[position:]))
+    return "".join(parts) + suffix
+
+
+def find_snippets(keyword, filenames, tenant=DEFAULT_TENANT, limit=SNIPPET_MAX_RESULTS):
+    """Лучшие фрагменты найденных документов филиала: [(документ, страница, HTML текст)]"""
+    snippets = _snippets
+    if not snippets:
+        return []
+    stems = _query_stems(keyword)
+    if not stems:
+        return []
+    pattern = re.compile(r"\b(%s)\w*" % "|".join(map(re.escape, sorted(stems, key=len, reverse=True))))
+
+    scored = []
+    for rank, filename in enumerate(filenames):
+        document = find_document(filename, tenant)
+        if document is None:
+            continue
+        for page, text, normalized in snippets.get(content_key(document.path), ()):
+            hits = {match.group(1) for match in pattern.finditer(normalized)}
+            if hits:
+                # Больше разных слов запроса, затем более релевантный документ и ранняя страница
+                scored.append((-len(hits), rank, page, document, text, normalized))
+    scored.sort(key=lambda item: item[:3])
+
+    return [
+        (document, page, _highlight(text, normalized, pattern))
+        for _, _, page, document, text, normalized in scored[:limit]
+    ]
+
+
+def format_snippets(keyword, filenames, tenant=DEFAULT_TENANT):
+    """Текст фрагментов для сообщения с результатами поиска (пустая строка - фрагментов нет)"""
+    results = find_snippets(keyword, filenames, tenant)
+    if not results:
+        return ""
+    increment("snippet_answers")
+    blocks = [
+        f"📝 <i>{html.escape(document.description)}, стр. {page}:</i>\n{text}"
+        for document, page, text in results
+    ]
+    return "\n\n".join(blocks)
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Снимок состояния бота для тёплого перезапуска
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+
+from config import STATE_FILE, STATE_SNAPSHOT_INTERVAL, SEARCH_CACHE_SIZE, DEDUP_WINDOW
+from metrics import get_metrics, restore_metrics
+from telegram_api import FILE_ID_CACHE
+from handlers import SEARCH_CACHE
+from kb_artifact import load_knowledge_base
+import pdf_text
+import sessions
+import broadcast
+
+logger = logging.getLogger(__name__)
+
+STATE_VERSION = 1
+
+# Ключ кэша file_id - sha256 содержимого файла. Ключи старых снимков (пути к файлам) отбрасываются
+FILE_ID_KEY = re.compile(r"[0-9a-f]{64}")
+
+# Журнал обработанных обновлений между снимками (переживает падение процесса)
+JOURNAL_FILE = f"{STATE_FILE}.journal"
+
+_lock = threading.Lock()
+_offset = 0
+_journal = None
+
+
+class RecentIds:
+    """Ограниченное окно недавно обработанных идентификаторов"""
+    def __init__(self, maxlen):
+        self.maxlen = maxlen
+        self._order = deque()
+        self._ids = set()
+
+    def __contains__(self, item):
+        return item in self._ids
+
+    def __len__(self):
+        return len(self._order)
+
+    def add(self, item):
+        """Добавить идентификатор. False - он уже был в окне"""
+        if item in self._ids:
+            return False
+        self._order.append(item)
+        self._ids.add(item)
+        if len(self._order) > self.maxlen:
+            self._ids.discard(self._order.popleft())
+        return True
+
+    def to_list(self):
+        """Идентификаторы в порядке обработки"""
+        return list(self._order)
+
+
+handled_updates = RecentIds(DEDUP_WINDOW)
+handled_callbacks = RecentIds(DEDUP_WINDOW)
+
+
+def get_offset():
+    """Текущий offset опроса"""
+    return _offset
+
+
+def set_offset(offset):
+    """Запомнить offset для следующего снимка"""
+    global _offset
+    _offset = offset
+
+
+def _append_journal(line):
+    """Дописать строку в журнал (вызывается под _lock)"""
+    global _journal
+    try:
+        if _journal is None:
+            _journal = open(JOURNAL_FILE, "a", encoding="utf-8", buffering=1)
+        _journal.write(line + "\n")
+    except OSError as e:
+        logger.error(f"Не удалось записать журнал обновлений: {e}")
+
+
+def claim_update(update_id):
+    """Взять обновление в работу. False - оно уже обрабатывалось"""
+    with _lock:
+        if not handled_updates.add(update_id):
+            return False
+        _append_journal(f"u {update_id}")
+        return True
+
+
+def claim_callback(callback_id):
+    """Взять callback в работу. False - он уже обрабатывался"""
+    with _lock:
+        if not handled_callbacks.add(callback_id):
+            return False
+        _append_journal(f"c {callback_id}")
+        return True
+
+
+def search_version():
+    """Версия результатов поиска: каталог, таблицы ключевых слов и источники векторного индекса"""
+    knowledge_base = load_knowledge_base()
+    keywords = sorted((tenant_id, tenant["keywords"]) for tenant_id, tenant in knowledge_base.tenants.items())
+    source = f"{knowledge_base.catalog_version}\n{keywords!r}\n{pdf_text.sources_mtime()}"
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+
+def _replay_journal():
+    """Применить журнал, записанный после последнего снимка"""
+    global _offset
+    try:
+        with open(JOURNAL_FILE, "r", encoding="utf-8") as f:
+            for line in f:
+                kind, _, value = line.strip().partition(" ")
+                if kind == "u" and value.lstrip("-").isdigit():
+                    update_id = int(value)
+                    handled_updates.add(update_id)
+                    _offset = max(_offset, update_id + 1)
+                elif kind == "c" and value:
+                    handled_callbacks.add(value)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.error(f"Не удалось прочитать журнал обновлений: {e}")
+
+
+def load_state():
+    """Восстановить offset, кэши и метрики из файла снимка"""
+    global _offset
+    try:
+        with open(STATE_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        logger.info("Снимок состояния не найден, холодный старт")
+        data = {"version": STATE_VERSION}
+    except (OSError, ValueError) as e:
+        logger.error(f"Не удалось прочитать снимок состояния: {e}")
+        data = {"version": STATE_VERSION}
+
+    if data.get("version") != STATE_VERSION:
+        logger.warning("Версия снимка состояния не совпадает, игнорирую")
+        data = {"version": STATE_VERSION}
+
+    _offset = int(data.get("offset", 0))
+    FILE_ID_CACHE.update(
+        (key, file_id) for key, file_id in data.get("file_ids", {}).items() if FILE_ID_KEY.fullmatch(key)
+    )
+    # После изменения каталога, ключевых слов или PDF кэш поиска устарел
+    search_cache = data.get("search_cache", {}) if data.get("search_version") == search_version() else {}
+    for keyword, files in list(search_cache.items())[-SEARCH_CACHE_SIZE:]:
+        SEARCH_CACHE[keyword] = files
+    restore_metrics(data.get("metrics"))
+    for update_id in data.get("handled_updates", []):
+        handled_updates.add(update_id)
+    for callback_id in data.get("handled_callbacks", []):
+        handled_callbacks.add(callback_id)
+    _replay_journal()
+
+    logger.info(
+        f"♻️ Состояние восстановлено: offset={_offset}, "
+        f"file_id={len(FILE_ID_CACHE)}, поиск={len(SEARCH_CACHE)}, "
+        f"обработано={len(handled_updates)}"
+    )
+    return _offset
+
+
+def save_state():
+    """Атомарно записать снимок состояния на диск"""
+    global _journal
+    tmp_path = f"{STATE_FILE}.tmp"
+    with _lock:
+        data = {
+            "version": STATE_VERSION,
+            "saved_at": int(time.time()),
+            "offset": _offset,
+            "file_ids": dict(FILE_ID_CACHE),
+            "search_cache": dict(SEARCH_CACHE),
+            "search_version": search_version(),
+            "metrics": get_metrics(),
+            "handled_updates": handled_updates.to_list(),
+            "handled_callbacks": handled_callbacks.to_list(),
+        }
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, STATE_FILE)
+        except OSError as e:
+            logger.error(f"Не удалось сохранить снимок состояния: {e}")
+            return False
+
+        # Сессии пользователей и новые получатели рассылок пишутся пачкой вместе со снимком
+        sessions.flush()
+        broadcast.flush_recipients()
+
+        # Все из журнала уже в снимке - начинаем журнал заново
+        if _journal is not None:
+            _journal.close()
+            _journal = None
+        try:
+            os.remove(JOURNAL_FILE)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Не удалось очистить журнал обновлений: {e}")
+        return True
+
+
+def start_snapshot_thread(stop_event):
+    """Периодически сохранять снимок до остановки бота"""
+    def run():
+        while not stop_event.wait(STATE_SNAPSHOT_INTERVAL):
+            save_state()
+
+    thread = threading.Thread(target=run, name="state-snapshot", daemon=True)
+    thread.start()
+    return thread
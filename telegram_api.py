@@ -5,54 +5,163 @@
 """
 
 import json
+import logging
 import os
 import requests
 from datetime import datetime
-from config import BASE_URL, BASE_FOLDER, TIMEOUT_SECONDS, LOG_FILE, DEBUG_MODE
+from config import (
+    BASE_URL, TIMEOUT_SECONDS, LOG_FILE, SCALE_OUT, HTTP_POOL_SIZE, GET_UPDATES_LIMIT
+)
+from metrics import increment
+from multipart import MultipartFileBody
+from file_store import content_digest
+from updates import decode_updates
+
+if SCALE_OUT:
+    import shared_store
+
+logger = logging.getLogger(__name__)
+
+# Общий пул HTTP-соединений с Bot API для всех потоков (ответы, очередь, рассылки, опрос)
+_http = requests.Session()
+_http.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE))
+
+# Кэш file_id загруженных документов: sha256 содержимого -> file_id
+# (одинаковый PDF разных филиалов загружается один раз)
+FILE_ID_CACHE = {}
+
+# Ответ getMe (id, username, can_read_all_group_messages) после check_bot_connection
+BOT_INFO = {}
+
+
+class TelegramError(Exception):
+    """Ошибка Bot API. retryable - стоит повторить (429, 5xx), retry_after - пауза от Telegram"""
+
+    def __init__(self, description, retryable=False, retry_after=None, error_code=None):
+        super().__init__(description)
+        self.retryable = retryable
+        self.retry_after = retry_after
+        self.error_code = error_code
+
+
+def _check_response(response, method):
+    """Ответ Bot API при ok=true, иначе TelegramError"""
+    try:
+        response_data = response.json()
+    except ValueError:
+        response_data = {"ok": False, "description": response.text[:200]}
+    if response_data.get("ok"):
+        return response_data
+    retry_after = (response_data.get("parameters") or {}).get("retry_after")
+    raise TelegramError(
+        f"{method}: HTTP {response.status_code}: {response_data.get('description')}",
+        retryable=response.status_code == 429 or response.status_code >= 500,
+        retry_after=retry_after,
+        error_code=response_data.get("error_code") or response.status_code
+    )
+
+
+# Признаки ответа 400 о неверном file_id (только тогда файл загружается заново)
+BAD_FILE_ID_DESCRIPTIONS = ("file identifier", "file_id", "remote file")
+
+
+def is_bad_file_id(error):
+    """Telegram отклонил сохраненный file_id, а не получателя или сообщение"""
+    return (
+        isinstance(error, TelegramError) and error.error_code == 400
+        and any(text in str(error).lower() for text in BAD_FILE_ID_DESCRIPTIONS)
+    )
+
+
+def is_retryable(error):
+    """Временная ошибка отправки: сеть, таймаут, 429 или 5xx"""
+    if isinstance(error, TelegramError):
+        return error.retryable
+    return isinstance(error, requests.RequestException)
 
 
 def log_usage(user_id, action):
     """Логирование использования"""
     try:
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if SCALE_OUT:
+            # Общий журнал для всех реплик
+            shared_store.log_usage(timestamp, user_id, action)
+            return
         with open(LOG_FILE, "a", encoding="utf-8") as f:
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             f.write(f"{timestamp} - {user_id} - {action}\n")
     except:
         pass
 
 
-def get_file_path(filename, category=None):
-    """Получить путь к файлу"""
-    from config import KNOWLEDGE_BASE
-    
-    if category and category in KNOWLEDGE_BASE:
-        folder = KNOWLEDGE_BASE[category]["folder"]
-        return os.path.join(BASE_FOLDER, folder, filename)
-    return os.path.join(BASE_FOLDER, filename)
+def _file_cache_key(file_path):
+    """Ключ кэша file_id - хэш содержимого, одинаковый на всех репликах"""
+    return content_digest(file_path)
+
+
+def _get_cached_file_id(cache_key):
+    """Найти file_id в локальном или общем кэше"""
+    file_id = FILE_ID_CACHE.get(cache_key)
+    if file_id is None and SCALE_OUT:
+        file_id = shared_store.get_file_id(cache_key)
+        if file_id:
+            FILE_ID_CACHE[cache_key] = file_id
+    return file_id
+
+
+def get_cached_file_id(file_path):
+    """file_id уже загруженного файла или None"""
+    try:
+        return _get_cached_file_id(_file_cache_key(file_path))
+    except OSError:
+        return None
+
+
+def _forget_file_id(cache_key):
+    """Удалить устаревший file_id"""
+    FILE_ID_CACHE.pop(cache_key, None)
+    if SCALE_OUT:
+        shared_store.delete_file_id(cache_key)
+
+
+def _remember_file_id(cache_key, response_data):
+    """Запомнить file_id из ответа sendDocument или sendPhoto"""
+    try:
+        if response_data and response_data.get("ok"):
+            result = response_data["result"]
+            if "photo" in result:
+                # Telegram возвращает несколько размеров фото, последний - исходный
+                file_id = result["photo"][-1]["file_id"]
+            else:
+                file_id = result["document"]["file_id"]
+            FILE_ID_CACHE[cache_key] = file_id
+            if SCALE_OUT:
+                shared_store.set_file_id(cache_key, file_id)
+    except (KeyError, TypeError):
+        pass
 
 
 def get_me():
     """Получить информацию о боте"""
     try:
-        response = requests.get(f"{BASE_URL}/getMe", timeout=10)
+        response = _http.get(f"{BASE_URL}/getMe", timeout=10)
         if response.status_code == 200:
             data = response.json()
             if data["ok"]:
                 return data["result"]
         return None
     except Exception as e:
-        if DEBUG_MODE:
-            print(f"DEBUG: Ошибка get_me: {e}")
+        logger.debug("Ошибка get_me: %s", e)
         return None
 
 
-def send_message(chat_id, text, reply_markup=None):
-    """Отправить текстовое сообщение"""
+def send_message(chat_id, text, reply_markup=None, raise_errors=False):
+    """Отправить текстовое сообщение
+
+    raise_errors - ошибки Bot API и сети выбрасываются вызывающему (для повторов)
+    """
     try:
-        if DEBUG_MODE:
-            print(f"DEBUG: send_message вызван для chat_id={chat_id}")
-            print(f"DEBUG: Текст сообщения: '{text[:100]}...'")
-            print(f"DEBUG: Клавиатура: {'Есть' if reply_markup else 'Нет'}")
+        logger.debug("send_message chat_id=%s клавиатура=%s текст=%.100r", chat_id, bool(reply_markup), text)
         
         payload = {
             "chat_id": chat_id,
@@ -61,144 +170,246 @@ def send_message(chat_id, text, reply_markup=None):
         }
         if reply_markup:
             payload["reply_markup"] = json.dumps(reply_markup)
-            if DEBUG_MODE:
-                print(f"DEBUG: Добавлена клавиатура в payload")
             
-        if DEBUG_MODE:
-            print(f"DEBUG: Отправляем HTTP запрос к {BASE_URL}/sendMessage")
+        response = _http.post(f"{BASE_URL}/sendMessage", data=payload, timeout=TIMEOUT_SECONDS)
+        return _check_response(response, "sendMessage")
             
-        response = requests.post(f"{BASE_URL}/sendMessage", data=payload, timeout=TIMEOUT_SECONDS)
+    except Exception as e:
+        if raise_errors and isinstance(e, (TelegramError, requests.RequestException)):
+            raise
+        if isinstance(e, TelegramError):
+            logger.warning("%s", e)
+        else:
+            logger.exception("Исключение в send_message")
+        return None
+
+
+def _send_file(chat_id, method, field, file_path, filename, caption, content_type):
+    """Отправить файл по file_id из кэша, а если его нет или он устарел - загрузить"""
+    cache_key = _file_cache_key(file_path)
+    cached_file_id = _get_cached_file_id(cache_key)
+    if cached_file_id:
+        # Файл уже загружался - отправляем по file_id без повторной загрузки
+        data = {
+            'chat_id': chat_id,
+            field: cached_file_id,
+            'caption': caption,
+            'parse_mode': 'HTML'
+        }
+        response = _http.post(f"{BASE_URL}/{method}", data=data, timeout=TIMEOUT_SECONDS)
+        try:
+            response_data = _check_response(response, method)
+            increment(f"{field}s_sent_cached")
+            return response_data
+        except TelegramError as e:
+            if not is_bad_file_id(e):
+                # Сбой Telegram, заблокированный бот, удаленный чат - file_id тут ни при чем,
+                # повторная загрузка ничего не даст
+                raise
+            logger.debug("file_id устарел, загружаем файл заново: %s", e)
+            _forget_file_id(cache_key)
         
-        if DEBUG_MODE:
-            print(f"DEBUG: HTTP ответ: {response.status_code}")
+    # Потоковая загрузка: файл читается кусками прямо в сокет
+    data = {
+        'chat_id': chat_id,
+        'caption': caption,
+        'parse_mode': 'HTML'  # Добавляем для поддержки HTML тегов в caption
+    }
+    body = MultipartFileBody(data, [(field, file_path, filename, content_type)])
+    
+    logger.debug("Загружаем файл %s (%d байт)", filename, len(body))
         
-        if response.status_code == 200:
-            response_data = response.json()
-            if DEBUG_MODE:
-                print(f"DEBUG: Telegram ответ: ok={response_data.get('ok')}")
-                if not response_data.get('ok'):
-                    print(f"DEBUG: ОШИБКА от Telegram: {response_data}")
-            return response_data
-        else:
-            if DEBUG_MODE:
-                print(f"DEBUG: HTTP ОШИБКА {response.status_code}: {response.text}")
+    response = _http.post(
+        f"{BASE_URL}/{method}",
+        data=body,
+        headers={"Content-Type": body.content_type},
+        timeout=TIMEOUT_SECONDS
+    )
+    
+    logger.debug("Файл отправлен, статус: %s", response.status_code)
+    
+    response_data = _check_response(response, method)
+    _remember_file_id(cache_key, response_data)
+    increment(f"{field}s_uploaded")
+    return response_data
+
+
+def send_document(chat_id, file_path, filename, caption="", raise_errors=False):
+    """Отправить PDF файл
+
+    raise_errors - ошибки Bot API и сети выбрасываются вызывающему (для повторов)
+    """
+    try:
+        logger.debug("send_document chat_id=%s файл=%s путь=%s", chat_id, filename, file_path)
+            
+        if not os.path.exists(file_path):
+            logger.warning("Файл не найден: %s", file_path)
+            send_message(chat_id, f"❌ Файл не найден: {filename}")
             return None
+        
+        return _send_file(chat_id, "sendDocument", "document", file_path, filename, caption, "application/pdf")
             
     except Exception as e:
-        if DEBUG_MODE:
-            print(f"DEBUG: ИСКЛЮЧЕНИЕ в send_message: {e}")
-            import traceback
-            traceback.print_exc()
+        if raise_errors and isinstance(e, (TelegramError, requests.RequestException)):
+            raise
+        logger.exception("Ошибка отправки файла %s", filename)
+        send_message(chat_id, f"❌ Ошибка отправки файла: {filename}")
         return None
 
 
-def send_document(chat_id, file_path, filename, caption=""):
-    """Отправить PDF файл"""
+def send_photo(chat_id, file_path, caption="", raise_errors=False):
+    """Отправить изображение (превью документа). Без файла ничего не отправляется
+
+    raise_errors - ошибки Bot API и сети выбрасываются вызывающему (для повторов)
+    """
     try:
-        if DEBUG_MODE:
-            print(f"DEBUG: send_document вызван для файла: {filename}")
-            print(f"DEBUG: Путь к файлу: {file_path}")
-            print(f"DEBUG: Существует ли файл: {os.path.exists(file_path)}")
-            
         if not os.path.exists(file_path):
-            if DEBUG_MODE:
-                print(f"DEBUG: Файл не найден: {file_path}")
-            send_message(chat_id, f"❌ Файл не найден: {filename}")
             return None
+        return _send_file(
+            chat_id, "sendPhoto", "photo", file_path, os.path.basename(file_path), caption, "image/jpeg"
+        )
+    except Exception as e:
+        if raise_errors and isinstance(e, (TelegramError, requests.RequestException)):
+            raise
+        logger.warning("Ошибка отправки превью %s: %s", file_path, e)
+        return None
+
+
+def send_media_group(chat_id, documents, raise_errors=False):
+    """Отправить до 10 PDF одним сообщением-альбомом
+
+    documents - список (путь, имя файла, подпись). Уже загруженные файлы
+    отправляются по file_id, остальные загружаются в том же запросе.
+    raise_errors - ошибки Bot API и сети выбрасываются вызывающему (для повторов)
+    """
+    documents = [doc for doc in documents if os.path.exists(doc[0])][:10]
+    if not documents:
+        return None
+    if len(documents) == 1:
+        # Альбом требует минимум 2 элемента
+        file_path, filename, caption = documents[0]
+        return send_document(chat_id, file_path, filename, caption, raise_errors)
+    
+    try:
+        cache_keys = [_file_cache_key(file_path) for file_path, _, _ in documents]
+        
+        for use_cache in (True, False):
+            media = []
+            uploads = []
+            for index, (file_path, filename, caption) in enumerate(documents):
+                file_id = _get_cached_file_id(cache_keys[index]) if use_cache else None
+                if file_id is None:
+                    field = f"file{index}"
+                    uploads.append((field, file_path, filename, 'application/pdf'))
+                    file_id = f"attach://{field}"
+                media.append({"type": "document", "media": file_id, "caption": caption, "parse_mode": "HTML"})
             
-        with open(file_path, 'rb') as file:
-            files = {'document': (filename, file, 'application/pdf')}
-            data = {
-                'chat_id': chat_id,
-                'caption': caption,
-                'parse_mode': 'HTML'  # Добавляем для поддержки HTML тегов в caption
-            }
+            data = {"chat_id": chat_id, "media": json.dumps(media, ensure_ascii=False)}
+            if uploads:
+                body = MultipartFileBody(data, uploads)
+                response = _http.post(
+                    f"{BASE_URL}/sendMediaGroup",
+                    data=body,
+                    headers={"Content-Type": body.content_type},
+                    timeout=TIMEOUT_SECONDS * len(uploads)
+                )
+            else:
+                response = _http.post(f"{BASE_URL}/sendMediaGroup", data=data, timeout=TIMEOUT_SECONDS)
             
-            if DEBUG_MODE:
-                print(f"DEBUG: Отправляем файл размером {os.path.getsize(file_path)} байт")
+            try:
+                response_data = _check_response(response, "sendMediaGroup")
+            except TelegramError as e:
+                if e.retryable:
+                    raise
+                if not use_cache or len(uploads) == len(documents) or not is_bad_file_id(e):
+                    if raise_errors:
+                        raise
+                    logger.warning("%s", e)
+                    return None
                 
-            response = requests.post(f"{BASE_URL}/sendDocument", files=files, data=data, timeout=TIMEOUT_SECONDS)
+                # Какой-то file_id устарел - повторяем с загрузкой всех файлов
+                logger.debug("sendMediaGroup с file_id не удался, загружаем файлы: %s", e)
+                for cache_key in cache_keys:
+                    _forget_file_id(cache_key)
+                continue
             
-            if DEBUG_MODE:
-                print(f"DEBUG: Файл отправлен, статус: {response.status_code}")
-                
-            return response.json()
+            for cache_key, message in zip(cache_keys, response_data["result"]):
+                _remember_file_id(cache_key, {"ok": True, "result": message})
+            increment("media_groups_sent")
+            increment("documents_uploaded", len(uploads))
+            increment("documents_sent_cached", len(documents) - len(uploads))
+            return response_data
             
     except Exception as e:
-        if DEBUG_MODE:
-            print(f"DEBUG: Ошибка отправки файла: {e}")
-        send_message(chat_id, f"❌ Ошибка отправки файла: {filename}")
+        if raise_errors and isinstance(e, (TelegramError, requests.RequestException)):
+            raise
+        logger.exception("Ошибка отправки альбома документов")
+        send_message(chat_id, "❌ Ошибка отправки файлов")
         return None
 
 
 def create_inline_keyboard(buttons):
     """Создать инлайн клавиатуру"""
     try:
-        if DEBUG_MODE:
-            print(f"DEBUG: create_inline_keyboard получил {len(buttons)} кнопок")
-        
         keyboard = []
-        for i, row in enumerate(buttons):
+        for row in buttons:
             keyboard_row = []
-            for j, button in enumerate(row):
-                if DEBUG_MODE:
-                    print(f"DEBUG: Обрабатываем кнопку [{i}][{j}]: text='{button['text'][:30]}...', callback='{button['callback_data']}'")
+            for button in row:
                 keyboard_row.append({
                     "text": button["text"],
                     "callback_data": button["callback_data"]
                 })
             keyboard.append(keyboard_row)
         
-        result = {"inline_keyboard": keyboard}
-        if DEBUG_MODE:
-            print(f"DEBUG: Создана клавиатура с {len(keyboard)} рядами")
-        return result
+        logger.debug("Создана клавиатура с %d рядами", len(keyboard))
+        return {"inline_keyboard": keyboard}
         
-    except Exception as e:
-        if DEBUG_MODE:
-            print(f"DEBUG: ОШИБКА в create_inline_keyboard: {e}")
-            import traceback
-            traceback.print_exc()
+    except Exception:
+        logger.exception("Ошибка в create_inline_keyboard")
         return {"inline_keyboard": []}
 
 
-def get_updates(update_offset):
-    """Получить обновления от Telegram"""
+def get_updates(update_offset, poll_timeout=30, limit=GET_UPDATES_LIMIT, raise_errors=False):
+    """Получить обновления от Telegram (записи updates.Update)
+
+    raise_errors - ошибки Bot API и сети выбрасываются вызывающему, чтобы
+    отличить сбой от пустого ответа (для адаптивного опроса)
+    """
     try:
         payload = {
             "offset": update_offset,
-            "timeout": 30,
+            "timeout": poll_timeout,
+            "limit": limit,
             "allowed_updates": ["message", "callback_query"]
         }
         
-        response = requests.post(f"{BASE_URL}/getUpdates", data=payload, timeout=35)
+        response = _http.post(f"{BASE_URL}/getUpdates", data=payload, timeout=poll_timeout + 5)
         
         if response.status_code == 200:
-            data = response.json()
-            if data["ok"]:
-                return data["result"]
-        
+            result = decode_updates(response.content)
+            if result is not None:
+                return result
+        _check_response(response, "getUpdates")
         return []
         
-    except requests.exceptions.Timeout:
-        # Таймаут - это нормально при long polling
+    except requests.exceptions.ReadTimeout:
+        # Ответ не успел прийти за время long polling - обновлений просто не было
         return []
     except Exception as e:
-        if DEBUG_MODE:
-            print(f"DEBUG: Ошибка получения обновлений: {e}")
+        if raise_errors and isinstance(e, (TelegramError, requests.RequestException)):
+            raise
+        logger.warning("Ошибка получения обновлений: %s", e)
         return []
 
 
 def answer_callback_query(callback_id):
     """Ответить на callback query (убрать часики)"""
     try:
-        response = requests.post(f"{BASE_URL}/answerCallbackQuery", data={"callback_query_id": callback_id})
-        if DEBUG_MODE:
-            print(f"DEBUG: Answer callback response: {response.status_code}")
+        response = _http.post(f"{BASE_URL}/answerCallbackQuery", data={"callback_query_id": callback_id})
+        logger.debug("answerCallbackQuery: %s", response.status_code)
         return response
     except Exception as e:
-        if DEBUG_MODE:
-            print(f"DEBUG: Ошибка answerCallbackQuery: {e}")
+        logger.warning("Ошибка answerCallbackQuery: %s", e)
         return None
 
 
@@ -215,16 +426,31 @@ def edit_message_text(chat_id, message_id, text, reply_markup=None):
         if reply_markup:
             payload["reply_markup"] = json.dumps(reply_markup)
             
-        response = requests.post(f"{BASE_URL}/editMessageText", data=payload)
+        response = _http.post(f"{BASE_URL}/editMessageText", data=payload)
         
-        if DEBUG_MODE:
-            print(f"DEBUG: Edit message response: {response.status_code}")
+        logger.debug("editMessageText: %s", response.status_code)
             
         return response
         
     except Exception as e:
-        if DEBUG_MODE:
-            print(f"DEBUG: Ошибка editMessageText: {e}")
+        logger.warning("Ошибка editMessageText: %s", e)
+        return None
+
+
+def edit_message_reply_markup(chat_id, message_id, reply_markup):
+    """Заменить только клавиатуру сообщения"""
+    try:
+        payload = {
+            "chat_id": chat_id,
+            "message_id": message_id,
+            "reply_markup": json.dumps(reply_markup)
+        }
+        response = _http.post(f"{BASE_URL}/editMessageReplyMarkup", data=payload, timeout=TIMEOUT_SECONDS)
+        logger.debug("editMessageReplyMarkup: %s", response.status_code)
+        return response
+        
+    except Exception as e:
+        logger.warning("Ошибка editMessageReplyMarkup: %s", e)
         return None
 
 
@@ -233,12 +459,15 @@ def check_bot_connection():
     try:
         bot_info = get_me()
         if bot_info:
+            BOT_INFO.update(bot_info)
             bot_name = bot_info["username"]
-            print(f"✅ Бот @{bot_name} подключен успешно")
+            logger.info("✅ Бот @%s подключен успешно", bot_name)
+            if not bot_info.get("can_read_all_group_messages"):
+                logger.info("🔒 Режим приватности: в группах приходят только команды, упоминания и ответы боту")
             return True
         else:
-            print("❌ Неверный токен бота")
+            logger.error("❌ Неверный токен бота")
             return False
     except Exception as e:
-        print(f"❌ Ошибка подключения: {e}")
+        logger.error("❌ Ошибка подключения: %s", e)
         return False
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Базы знаний филиалов в одном процессе
+
+Филиал по умолчанию описан в config.py (BASE_FOLDER, KNOWLEDGE_BASE,
+SPECIAL_FILES, SEARCH_KEYWORDS). Остальные филиалы - в TENANTS_FILE:
+
+[
+    {
+        "id": "bishkek",
+        "name": "Homeline Бишкек",
+        "base_folder": "pdf_files_bishkek",
+        "knowledge_base": {"critical": {"name": "...", "folder": "...", "files": {...}}},
+        "special_files": {"quick": "быстрый_справочник.pdf"},
+        "search_keywords": {"онт": ["простые_ont.pdf"]},
+        "chats": [123456789, -100987654321]
+    }
+]
+
+Без "search_keywords" филиал использует общую таблицу ключевых слов.
+Филиал чата: выбранный командой /branch, затем указанный в "chats",
+иначе филиал по умолчанию.
+"""
+
+import json
+import logging
+import threading
+from collections import namedtuple
+
+from config import (
+    BASE_FOLDER, KNOWLEDGE_BASE, SPECIAL_FILES, SEARCH_KEYWORDS, DEFAULT_TENANT_NAME, TENANTS_FILE
+)
+import sessions
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TENANT = "default"
+
+Tenant = namedtuple(
+    "Tenant", "tenant_id name base_folder knowledge_base special_files search_keywords chats"
+)
+
+_lock = threading.Lock()
+_tenants = None
+_chat_tenants = None
+
+
+def _load():
+    """Прочитать филиалы (вызывается под _lock)"""
+    tenants = {
+        DEFAULT_TENANT: Tenant(
+            DEFAULT_TENANT, DEFAULT_TENANT_NAME, BASE_FOLDER, KNOWLEDGE_BASE, SPECIAL_FILES, SEARCH_KEYWORDS, ()
+        )
+    }
+    try:
+        with open(TENANTS_FILE, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+    except FileNotFoundError:
+        entries = []
+    except (OSError, ValueError) as e:
+        logger.error(f"Не удалось прочитать {TENANTS_FILE}: {e}")
+        entries = []
+
+    for entry in entries:
+        try:
+            tenant = Tenant(
+                entry["id"], entry.get("name") or entry["id"], entry["base_folder"], entry["knowledge_base"],
+                entry.get("special_files") or {}, entry.get("search_keywords") or SEARCH_KEYWORDS,
+                tuple(entry.get("chats") or ())
+            )
+        except (KeyError, TypeError) as e:
+            logger.error(f"Неверное описание филиала в {TENANTS_FILE}: {e}")
+            continue
+        tenants[tenant.tenant_id] = tenant
+
+    chat_tenants = {}
+    for tenant in tenants.values():
+        for chat_id in tenant.chats:
+            chat_tenants[chat_id] = tenant.tenant_id
+    return tenants, chat_tenants
+
+
+def get_tenants():
+    """Все филиалы: id -> Tenant (филиал по умолчанию первый)"""
+    global _tenants, _chat_tenants
+    if _tenants is None:
+        with _lock:
+            if _tenants is None:
+                _tenants, _chat_tenants = _load()
+    return _tenants
+
+
+def tenant_for_chat(chat_id):
+    """id филиала, к которому относится чат"""
+    tenants = get_tenants()
+    if len(tenants) == 1:
+        return DEFAULT_TENANT
+    chosen = sessions.get_session(chat_id).tenant
+    if chosen in tenants:
+        return chosen
+    return _chat_tenants.get(chat_id, DEFAULT_TENANT)
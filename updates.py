@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Компактные записи обновлений Telegram
+
+Из ответа getUpdates берутся только поля, которые использует бот:
+записи со __slots__ вместо вложенных словарей, без подписок и
+try/except по каждому полю в обработчиках. Ответ разбирается orjson,
+если он установлен, иначе стандартным json.
+
+Замер: python benchmark_updates.py
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_loads = orjson.loads if orjson is not None else json.loads
+
+
+class Chat:
+    """Чат: id и тип (private, group, supergroup, channel)"""
+    __slots__ = ("id", "type")
+
+    def __init__(self, raw):
+        self.id = raw["id"]
+        self.type = raw.get("type")
+
+
+class Message:
+    """Входящее сообщение"""
+    __slots__ = ("message_id", "date", "chat", "from_id", "first_name", "text", "reply_to_from_id")
+
+    def __init__(self, raw):
+        self.message_id = raw.get("message_id")
+        self.date = raw.get("date")
+        self.chat = Chat(raw["chat"])
+        sender = raw.get("from") or {}
+        self.from_id = sender.get("id")
+        self.first_name = sender.get("first_name")
+        self.text = raw.get("text")
+        reply_to = raw.get("reply_to_message")
+        self.reply_to_from_id = (reply_to.get("from") or {}).get("id") if reply_to else None
+
+    def with_text(self, text):
+        """Копия сообщения с другим текстом"""
+        message = Message.__new__(Message)
+        for name in Message.__slots__:
+            setattr(message, name, getattr(self, name))
+        message.text = text
+        return message
+
+    def to_dict(self):
+        """Сообщение в формате Bot API (только используемые поля)"""
+        raw = {
+            "message_id": self.message_id, "date": self.date,
+            "chat": {"id": self.chat.id, "type": self.chat.type},
+            "from": {"id": self.from_id, "first_name": self.first_name},
+        }
+        if self.text is not None:
+            raw["text"] = self.text
+        if self.reply_to_from_id is not None:
+            raw["reply_to_message"] = {"from": {"id": self.reply_to_from_id}}
+        return raw
+
+
+class Callback:
+    """Нажатие inline-кнопки"""
+    __slots__ = ("id", "data", "message_id", "chat")
+
+    def __init__(self, raw):
+        self.id = raw["id"]
+        self.data = raw.get("data") or ""
+        message = raw["message"]
+        self.message_id = message["message_id"]
+        self.chat = Chat(message["chat"])
+
+    def to_dict(self):
+        """Callback в формате Bot API (только используемые поля)"""
+        return {
+            "id": self.id, "data": self.data,
+            "message": {"message_id": self.message_id, "chat": {"id": self.chat.id, "type": self.chat.type}},
+        }
+
+
+class Update:
+    """Обновление: сообщение, нажатие кнопки или ничего из используемого"""
+    __slots__ = ("update_id", "message", "callback")
+
+    def __init__(self, update_id, message=None, callback=None):
+        self.update_id = update_id
+        self.message = message
+        self.callback = callback
+
+    @property
+    def kind(self):
+        """Тип обновления (как ключ в Bot API)"""
+        if self.message is not None:
+            return "message"
+        if self.callback is not None:
+            return "callback_query"
+        return "other"
+
+    def with_message(self, message):
+        """Копия обновления с другим сообщением"""
+        return Update(self.update_id, message=message)
+
+    def to_dict(self):
+        """Обновление в формате Bot API для общей очереди реплик"""
+        raw = {"update_id": self.update_id}
+        if self.message is not None:
+            raw["message"] = self.message.to_dict()
+        elif self.callback is not None:
+            raw["callback_query"] = self.callback.to_dict()
+        return raw
+
+
+def parse_update(raw):
+    """Запись обновления из словаря Bot API"""
+    try:
+        message = raw.get("message")
+        if message is not None:
+            return Update(raw["update_id"], message=Message(message))
+        # У кнопок inline-режима нет message - такие нажатия боту не нужны
+        callback = raw.get("callback_query")
+        if callback is not None and callback.get("message"):
+            return Update(raw["update_id"], callback=Callback(callback))
+    except (KeyError, TypeError, AttributeError):
+        # Обновление без нужных полей пропускается, но offset по нему сдвигается
+        pass
+    return Update(raw["update_id"])
+
+
+def decode_updates(content):
+    """Обновления из тела ответа getUpdates (None - Telegram вернул ошибку)"""
+    data = _loads(content)
+    if not data.get("ok"):
+        return None
+    return [parse_update(raw) for raw in data["result"]]
+
+
+def dumps(update):
+    """Обновление в JSON для общей очереди"""
+    return json.dumps(update.to_dict(), ensure_ascii=False)
+
+
+def loads(payload):
+    """Обновление из JSON общей очереди"""
+    return parse_update(_loads(payload))
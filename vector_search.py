@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Локальный векторный поиск по тексту PDF и описаниям документов
+
+Каждый раздел (страница PDF или описание из KNOWLEDGE_BASE) превращается
+в TF-IDF вектор хэшированных символьных 3-грамм и слов. Матрица хранится
+в SEARCH_INDEX_DIR/vectors.npy и открывается через mmap, а запрос
+оценивается одним умножением матрицы на вектор. Индекс общий для всех
+филиалов: строки привязаны к содержимому файла, а в результат попадают
+только документы филиала чата.
+
+Сборка индекса: python vector_search.py
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+
+from config import SEARCH_INDEX_DIR, VECTOR_DIMENSIONS, VECTOR_MIN_SCORE, VECTOR_MAX_RESULTS
+from catalog import documents_by_content
+from metrics import increment
+from tenants import DEFAULT_TENANT
+import pdf_text
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+VECTORS_FILE = os.path.join(SEARCH_INDEX_DIR, "vectors.npy")
+IDF_FILE = os.path.join(SEARCH_INDEX_DIR, "idf.npy")
+ROWS_FILE = os.path.join(SEARCH_INDEX_DIR, "rows.json")
+
+_WORD = re.compile(r"\w+")
+
+_lock = threading.Lock()
+_index = None  # (матрица, idf, номера документов строк, ключи содержимого документов)
+
+
+def _features(text):
+    """Хэши слов и символьных 3-грамм текста"""
+    features = []
+    for word in _WORD.findall(text.lower().replace("ё", "е")):
+        features.append(zlib.crc32(f"w:{word}".encode("utf-8")) % VECTOR_DIMENSIONS)
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            features.append(zlib.crc32(padded[i:i + 3].encode("utf-8")) % VECTOR_DIMENSIONS)
+    return features
+
+
+def _term_frequencies(text):
+    """Логарифмические частоты признаков текста"""
+    counts = np.bincount(_features(text), minlength=VECTOR_DIMENSIONS).astype(np.float32)
+    return np.log1p(counts)
+
+
+def build_index():
+    """Построить матрицу TF-IDF по разделам документов и сохранить на диск"""
+    sections = pdf_text.load_sections()
+    matrix = np.zeros((len(sections), VECTOR_DIMENSIONS), dtype=np.float32)
+    for row, section in enumerate(sections):
+        matrix[row] = _term_frequencies(section["text"])
+
+    document_frequency = np.count_nonzero(matrix, axis=0)
+    idf = (np.log((1 + len(sections)) / (1 + document_frequency)) + 1).astype(np.float32)
+    matrix *= idf
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.maximum(norms, 1e-9)
+
+    os.makedirs(SEARCH_INDEX_DIR, exist_ok=True)
+    np.save(VECTORS_FILE, matrix)
+    np.save(IDF_FILE, idf)
+    with open(ROWS_FILE, "w", encoding="utf-8") as f:
+        json.dump([section["key"] for section in sections], f, ensure_ascii=False)
+    logger.info(f"🧭 Векторный индекс: {matrix.shape[0]} разделов x {VECTOR_DIMENSIONS}")
+
+
+def load_index():
+    """Загрузить индекс (через mmap), при необходимости пересобрав его"""
+    global _index
+    if np is None:
+        logger.warning("numpy не установлен - векторный поиск отключен")
+        return False
+
+    with _lock:
+        if pdf_text.is_stale(VECTORS_FILE) or not os.path.exists(ROWS_FILE):
+            build_index()
+
+        matrix = np.load(VECTORS_FILE, mmap_mode="r")
+        idf = np.load(IDF_FILE)
+        with open(ROWS_FILE, "r", encoding="utf-8") as f:
+            row_keys = json.load(f)
+
+        keys = list(dict.fromkeys(row_keys))
+        positions = {key: i for i, key in enumerate(keys)}
+        row_documents = np.array([positions[key] for key in row_keys], dtype=np.intp)
+        _index = (matrix, idf, row_documents, keys)
+    return True
+
+
+def is_ready():
+    """Индекс загружен"""
+    return _index is not None
+
+
+def search(query, tenant=DEFAULT_TENANT, limit=VECTOR_MAX_RESULTS, min_score=VECTOR_MIN_SCORE):
+    """Имена файлов филиала, ближайших к запросу, по убыванию близости
+
+    Индекс не строится на пути запроса: пока он не загружен, результат пустой.
+    """
+    index = _index
+    if index is None or not query:
+        return []
+    matrix, idf, row_documents, keys = index
+
+    started = time.perf_counter()
+    vector = _term_frequencies(query) * idf
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        return []
+    scores = matrix @ (vector / norm)
+
+    # Лучший раздел каждого документа
+    document_scores = np.full(len(keys), -1.0, dtype=np.float32)
+    np.maximum.at(document_scores, row_documents, scores)
+
+    # Документы других филиалов пропускаются
+    documents = documents_by_content(tenant)
+    results = []
+    for i in np.argsort(-document_scores):
+        if document_scores[i] < min_score or len(results) >= limit:
+            break
+        document = documents.get(keys[i])
+        if document is not None:
+            results.append(document.filename)
+
+    increment("vector_searches")
+    logger.debug(
+        "Векторный поиск %r: %s за %.2f мс", query, results, (time.perf_counter() - started) * 1000
+    )
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if np is None:
+        raise SystemExit("Нужен numpy: pip install -r requirements.txt")
+    build_index()
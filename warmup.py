@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Прогрев кэшей при запуске по истории запросов
+
+Журнал статистики читается построчно, самые частые запросы сразу
+попадают в кэш поиска и готовых кнопок, а самые популярные PDF
+загружаются в служебный чат, чтобы получить их file_id заранее.
+"""
+
+import logging
+import threading
+import time
+from collections import Counter
+
+from config import (
+    LOG_FILE, SCALE_OUT, WARMUP_TOP_QUERIES, WARMUP_TOP_DOCUMENTS, WARMUP_CHAT_ID
+)
+from catalog import find_document
+from metrics import set_value
+from telegram_api import send_document, get_cached_file_id
+import handlers
+import vector_search
+import snippets
+
+if SCALE_OUT:
+    import shared_store
+
+logger = logging.getLogger(__name__)
+
+# Сколько разных запросов считать, прежде чем отбросить редкие
+MAX_TRACKED_QUERIES = 50000
+
+
+def iter_log_records():
+    """Записи журнала статистики (время, user_id, действие) по одной"""
+    if SCALE_OUT:
+        yield from shared_store.iter_usage()
+        return
+    try:
+        with open(LOG_FILE, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                parts = line.rstrip("\n").split(" - ", 2)
+                if len(parts) == 3:
+                    yield parts[0], parts[1], parts[2]
+    except FileNotFoundError:
+        return
+
+
+def _prune(counter, keep):
+    """Оставить только самые частые значения"""
+    top = counter.most_common(keep)
+    counter.clear()
+    counter.update(dict(top))
+
+
+def collect_hot(top_queries=WARMUP_TOP_QUERIES, top_documents=WARMUP_TOP_DOCUMENTS):
+    """Самые частые запросы и самые запрашиваемые документы из журнала"""
+    queries = Counter()
+    documents = Counter()
+    for _, _, action in iter_log_records():
+        if action.startswith("search_"):
+            queries[action[len("search_"):]] += 1
+            if len(queries) > MAX_TRACKED_QUERIES:
+                _prune(queries, MAX_TRACKED_QUERIES // 5)
+        elif action.startswith("doc_"):
+            documents[action[len("doc_"):]] += 1
+    return (
+        [query for query, _ in queries.most_common(top_queries)],
+        [filename for filename, _ in documents.most_common(top_documents)]
+    )
+
+
+def preload_documents(filenames, stop_event):
+    """Загрузить популярные PDF в служебный чат, чтобы получить file_id"""
+    uploaded = 0
+    for filename in filenames:
+        if stop_event.is_set():
+            break
+        document = find_document(filename)
+        if document is None or get_cached_file_id(document.path):
+            continue
+        if send_document(WARMUP_CHAT_ID, document.path, document.filename, "🔥 Предзагрузка"):
+            uploaded += 1
+    logger.info(f"🔥 Предзагружено PDF: {uploaded}")
+
+
+def warm_caches(stop_event):
+    """Построить индекс и фрагменты, заполнить кэш поиска и кнопок, затем предзагрузить популярные PDF"""
+    started = time.perf_counter()
+
+    # Векторный индекс нужен до прогрева, чтобы запросы без ключевых слов тоже попали в кэш
+    try:
+        vector_search.load_index()
+    except Exception:
+        logger.exception("Не удалось загрузить векторный индекс")
+    try:
+        snippets.load_snippets()
+    except Exception:
+        logger.exception("Не удалось загрузить фрагменты текста")
+
+    hot_queries, hot_documents = collect_hot()
+
+    for keyword in hot_queries:
+        if stop_event.is_set():
+            return
+        found_files = handlers.find_files(keyword)
+        if found_files:
+            handlers.build_result_buttons(keyword, found_files)
+
+    set_value("warmup_queries", len(hot_queries))
+    logger.info(
+        f"🔥 Прогрев: {len(hot_queries)} запросов за "
+        f"{int((time.perf_counter() - started) * 1000)} мс"
+    )
+
+    if WARMUP_CHAT_ID and hot_documents:
+        preload_documents(hot_documents, stop_event)
+
+
+def start_warmup_thread(stop_event):
+    """Прогрев в фоне, чтобы не задерживать начало опроса"""
+    thread = threading.Thread(target=warm_caches, args=(stop_event,), name="cache-warmup", daemon=True)
+    thread.start()
+    return thread